@@ -0,0 +1,112 @@
+"""Measure the latency of `komodoenv-update --check`, which is run every time a
+komodoenv is sourced.
+
+Builds a mock komodo root and komodoenv in a temporary directory and runs the
+check repeatedly, with and without a valid `komodoenv.stamp`.
+
+    $ python benchmarks/bench_check.py --runs 50
+"""
+
+import argparse
+import importlib.machinery
+import importlib.util
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from komodoenv import update
+
+
+def make_komodo_root(root: Path) -> None:
+    release = root / "2030.01.00-py311"
+    (release / "root" / "bin").mkdir(parents=True)
+    (release / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    (release / "enable").write_text(f"export PATH={release}/root/bin:$PATH\n")
+    (release / "root" / "share" / "rips").mkdir(parents=True)
+    (release / "root" / "share" / "rips" / "config.json").write_text("{}\n")
+    (root / "stable-py311").symlink_to(release.name)
+
+
+def make_komodoenv(path: Path, komodo_root: Path) -> None:
+    (path / "root" / "bin").mkdir(parents=True)
+    shutil.copy(update.__file__, path / "root" / "bin" / "komodoenv-update")
+    release = (komodo_root / "stable-py311").resolve()
+    (path / "komodoenv.conf").write_text(
+        f"current-release = {release.name}\n"
+        "tracked-release = stable-py311\n"
+        f"mtime-release = {release.stat().st_mtime}\n"
+        "python-version = 3.11\n"
+        f"komodo-root = {komodo_root}\n"
+        f"linux-dist = {update.distro_id() + update.distro_versions()[0]}\n",
+    )
+
+
+def time_check(path: Path, runs: int, *, keep_stamp: bool) -> list[float]:
+    """Time `komodoenv-update --check` as a subprocess, ie. what the user sees"""
+    script = path / "root" / "bin" / "komodoenv-update"
+    stamp = path / update.STAMP_FILE
+    timings = []
+    for _ in range(runs):
+        if not keep_stamp:
+            stamp.unlink(missing_ok=True)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(script), "--check"], check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def time_check_inprocess(path: Path, runs: int, *, keep_stamp: bool) -> list[float]:
+    """Time the work done by `komodoenv-update --check` after the interpreter has
+    started and the script has been imported"""
+    script = path / "root" / "bin" / "komodoenv-update"
+    loader = importlib.machinery.SourceFileLoader("komodoenv_update", str(script))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+
+    stamp = path / update.STAMP_FILE
+    timings = []
+    for _ in range(runs):
+        if not keep_stamp:
+            stamp.unlink(missing_ok=True)
+        start = time.perf_counter()
+        module.main(["--check"])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    print(
+        f"{name:>10s}  median {statistics.median(timings) * 1000:8.2f} ms"
+        f"  min {min(timings) * 1000:8.2f} ms"
+        f"  max {max(timings) * 1000:8.2f} ms",
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=20, help="Number of runs per mode")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        komodo_root = Path(tmp) / "komodo"
+        komodo_root.mkdir()
+        make_komodo_root(komodo_root)
+        kenv = Path(tmp) / "kenv"
+        make_komodoenv(kenv, komodo_root)
+
+        print("komodoenv-update --check (subprocess)")
+        report("full", time_check(kenv, args.runs, keep_stamp=False))
+        report("stamped", time_check(kenv, args.runs, keep_stamp=True))
+
+        print("komodoenv-update --check (in-process, excluding startup)")
+        report("full", time_check_inprocess(kenv, args.runs, keep_stamp=False))
+        report("stamped", time_check_inprocess(kenv, args.runs, keep_stamp=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Measure the startup time of the Python interpreter in a komodoenv, ie.
+`python -c pass`, with the old zzz_komodo.pth and with the precomputed site
+layout written by `create_pth`.
+
+Builds a synthetic komodo release and a komodoenv using it in a temporary
+directory, and times the komodoenv's interpreter as a subprocess.
+
+    $ python -m benchmarks.bench_startup --runs 50 --dist-infos 5000
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import (
+    add_scale_arguments,
+    make_release,
+    release_name,
+    scale_from_args,
+)
+from komodoenv import update
+
+
+def old_pth(config: dict, release: Path, kenv: Path) -> None:
+    """Write zzz_komodo.pth like komodoenv did before `create_pth` precomputed
+    the site layout"""
+    version = "python" + config["python-version"]
+    sitedir = kenv / "root" / "lib" / version / "site-packages"
+    (sitedir / "sitecustomize.py").unlink(missing_ok=True)
+    (sitedir / "zzz_komodo.pth").write_text(
+        "".join(
+            f"{release / 'root' / lib / version / 'site-packages'}\n"
+            for lib in ("lib64", "lib")
+        ),
+    )
+
+
+def time_startup(kenv: Path, runs: int) -> list[float]:
+    python = kenv / "root" / "bin" / "python"
+    subprocess.run([python, "-c", "pass"], check=True)  # Warm up caches
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([python, "-c", "pass"], check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    print(
+        f"{name:>12s}  median {statistics.median(timings) * 1000:8.2f} ms"
+        f"  min {min(timings) * 1000:8.2f} ms"
+        f"  max {max(timings) * 1000:8.2f} ms",
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_scale_arguments(ap)
+    ap.add_argument("--runs", type=int, default=20, help="Number of runs per layout")
+    args = ap.parse_args()
+    scale = scale_from_args(args)._replace(scripts=0, binaries=0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        komodo_root = Path(tmp) / "komodo"
+        komodo_root.mkdir()
+        release = make_release(komodo_root, release_name(0), scale)
+        kenv = Path(tmp) / "kenv"
+        subprocess.run(
+            [sys.executable, "-m", "venv", "--without-pip", kenv / "root"],
+            check=True,
+        )
+        config = {"python-version": "{}.{}".format(*sys.version_info[:2])}
+
+        old_pth(config, release, kenv)
+        report("pth", time_startup(kenv, args.runs))
+
+        generation = update.new_generation(kenv)
+        update.create_pth(config, release, kenv, generation)
+        update.switch_generation(kenv, generation, config)
+        sitedir = kenv / "root" / "lib" / ("python" + config["python-version"])
+        layout = (
+            "sitecustomize"
+            if (sitedir / "site-packages" / "sitecustomize.py").exists()
+            else "precomputed pth"
+        )
+        report(layout, time_startup(kenv, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Benchmark komodoenv's hot paths against a synthetic production-scale komodo
+root, and catch regressions by comparing with a previous run.
+
+    $ python -m benchmarks.bench_suite --save baseline.json
+    $ python -m benchmarks.bench_suite --baseline baseline.json --tolerance 20
+
+With --baseline, exits with status 1 if the median of any benchmark is more
+than --tolerance percent slower than in the baseline.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import distro
+
+from benchmarks.synthetic import (
+    PYVER,
+    RHEL_SUFFIX,
+    add_scale_arguments,
+    make_komodo_root,
+    release_name,
+    scale_from_args,
+)
+from komodoenv import __main__ as komodoenv_main
+from komodoenv import update
+
+
+def run(setup, func, runs: int) -> list[float]:
+    """Time `func(setup())` `runs` times, excluding the time taken by `setup`"""
+    timings = []
+    for _ in range(runs):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def make_kenv(tmp: Path, prefix: str = "kenv-") -> Path:
+    """Empty komodoenv to generate shims and sync configuration into"""
+    kenv = Path(tempfile.mkdtemp(dir=tmp, prefix=prefix))
+    (kenv / "root" / "bin").mkdir(parents=True)
+    (kenv / "root" / "shims").mkdir()
+    return kenv
+
+
+def benchmarks(komodo_root: Path, tmp: Path, jobs: int) -> dict:
+    """Name of each benchmark mapped to its (setup, func)"""
+    name = release_name(0)
+    release = komodo_root / (name + RHEL_SUFFIX)
+    config = {
+        "komodo-root": str(komodo_root),
+        "current-release": release.name,
+        "tracked-release": f"stable-{PYVER}",
+        "python-version": "{}.{}".format(*sys.version_info[:2]),
+    }
+    # An up-to-date komodoenv, for measuring no-op updates
+    synced = make_kenv(tmp, prefix="synced-")
+    synced_gen = update.new_generation(synced)
+    update.update_bins(release, synced, synced_gen)
+    update.copy_config_dirs(config, synced)
+    synced_lazy = make_kenv(tmp, prefix="synced-lazy-")
+    synced_lazy_gen = update.new_generation(synced_lazy)
+    update.update_lazy_bins(release, synced_lazy, synced_lazy_gen)
+
+    def cold_indices(arg=None):
+        update._pkg_indices.clear()  # noqa: SLF001
+        return arg
+
+    def fresh_kenv():
+        return make_kenv(tmp)
+
+    def fresh_generation():
+        kenv = make_kenv(tmp)
+        return kenv, update.new_generation(kenv)
+
+    def indexed():
+        if update.read_release_index(komodo_root) is None:
+            update.index_releases(komodo_root, jobs=jobs)
+
+    return {
+        "update_bins": (
+            fresh_generation,
+            lambda kenv: update.update_bins(release, *kenv, incremental=False),
+        ),
+        "update_bins-threaded": (
+            fresh_generation,
+            lambda kenv: update.update_bins(
+                release, *kenv, incremental=False, jobs=jobs
+            ),
+        ),
+        "update_bins-noop": (
+            lambda: (synced, synced_gen),
+            lambda kenv: update.update_bins(release, *kenv),
+        ),
+        "update_lazy_bins": (
+            fresh_generation,
+            lambda kenv: update.update_lazy_bins(release, *kenv, incremental=False),
+        ),
+        "update_lazy_bins-noop": (
+            lambda: (synced_lazy, synced_lazy_gen),
+            lambda kenv: update.update_lazy_bins(release, *kenv),
+        ),
+        "get_tracked_release": (
+            lambda: None,
+            lambda _: update.get_tracked_release(
+                (komodo_root / f"stable-{PYVER}").resolve(), RHEL_SUFFIX
+            ),
+        ),
+        "get_tracked_release-indexed": (
+            indexed,
+            lambda _: update.get_tracked_release(
+                (komodo_root / f"stable-{PYVER}").resolve(), RHEL_SUFFIX
+            ),
+        ),
+        "copy_config_dirs": (
+            lambda: cold_indices(fresh_kenv()),
+            lambda kenv: update.copy_config_dirs(config, kenv),
+        ),
+        "copy_config_dirs-noop": (
+            lambda: cold_indices(synced),
+            lambda kenv: update.copy_config_dirs(config, kenv),
+        ),
+        "get_pkg_version": (
+            cold_indices,
+            lambda _: update.get_pkg_version(config, release / "root", "notebook"),
+        ),
+        "get_pkg_version-warm": (
+            lambda: None,
+            lambda _: update.get_pkg_version(config, release / "root", "notebook"),
+        ),
+        "resolve_release": (
+            lambda: None,
+            lambda _: komodoenv_main.resolve_release(root=komodo_root, name=name),
+        ),
+        "resolve_release-indexed": (
+            indexed,
+            lambda _: komodoenv_main.resolve_release(root=komodo_root, name=name),
+        ),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print how `results` compare to `baseline`, and return whether any
+    benchmark regressed by more than `tolerance` percent"""
+    regressed = False
+    for name, timings in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["median"]
+        new = timings["median"]
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(
+            f"{name:>24s}  {old * 1000:10.2f} -> {new * 1000:10.2f} ms  {change:+7.1f}%{flag}"
+        )
+    return regressed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_scale_arguments(ap)
+    ap.add_argument("--runs", type=int, default=5, help="Number of runs per benchmark")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="Threads")
+    ap.add_argument(
+        "--komodo-root",
+        type=Path,
+        help="Use an existing synthetic komodo root instead of generating one",
+    )
+    ap.add_argument("--only", nargs="+", help="Only run these benchmarks")
+    ap.add_argument("--save", type=Path, help="Write the results to this JSON file")
+    ap.add_argument("--baseline", type=Path, help="Compare with this JSON file")
+    ap.add_argument(
+        "--tolerance",
+        type=float,
+        default=25.0,
+        help="Slowdown in percent that is considered a regression",
+    )
+    args = ap.parse_args()
+
+    if distro.id() != "rhel":
+        # Let resolve_release run outside of RHEL
+        komodoenv_main.distro_suffix = lambda: RHEL_SUFFIX
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        komodo_root = args.komodo_root
+        if komodo_root is None:
+            komodo_root = tmp / "komodo"
+            start = time.perf_counter()
+            make_komodo_root(komodo_root, scale_from_args(args))
+            print(f"Generated komodo root in {time.perf_counter() - start:.1f}s")
+
+        results = {}
+        for name, (setup, func) in benchmarks(komodo_root, tmp, args.jobs).items():
+            if args.only and name not in args.only:
+                continue
+            timings = run(setup, func, args.runs)
+            results[name] = {
+                "median": statistics.median(timings),
+                "min": min(timings),
+                "max": max(timings),
+            }
+            print(
+                f"{name:>24s}  median {results[name]['median'] * 1000:10.2f} ms"
+                f"  min {results[name]['min'] * 1000:10.2f} ms",
+            )
+            for path in tmp.glob("kenv-*"):
+                shutil.rmtree(path, ignore_errors=True)
+
+    if args.save is not None:
+        args.save.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        print(f"\nCompared with {args.baseline}")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Measure the I/O done by `update_bins` when generating shims for a komodo
+`bin/` with large compiled executables.
+
+Compares reading every executable in full (as `update_bins` used to do) with
+only reading the shebang line of non-Python executables, and serial with
+threaded shim generation.
+
+    $ python benchmarks/bench_update_bins.py --binaries 50 --binary-size 20
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from komodoenv import update
+
+
+def make_bin(srcpath: Path, binaries: int, binary_size: int, scripts: int) -> None:
+    bindir = srcpath / "root" / "bin"
+    bindir.mkdir(parents=True)
+    chunk = os.urandom(1024**2)
+    for i in range(binaries):
+        with open(bindir / f"binary{i}", "wb") as f:
+            f.write(b"\x7fELF")
+            f.writelines(chunk for _ in range(binary_size))
+    for i in range(scripts):
+        (bindir / f"script{i}").write_text(
+            "#!/prog/res/komodo/bin/python\nimport sys\nsys.exit(0)\n",
+        )
+
+
+def rchar() -> int:
+    """Number of bytes read by this process, according to the kernel"""
+    with open("/proc/self/io", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("rchar:"):
+                return int(line.split()[1])
+    return 0
+
+
+def legacy_update_bins(srcpath: Path, dstpath: Path) -> None:
+    """Shim generation prior to bounded reads: read everything"""
+    python = str(dstpath / "root" / "bin" / "python")
+    for entry in (srcpath / "root" / "bin").iterdir():
+        with open(entry, "rb") as f:
+            text = f.read()
+        (dstpath / "root" / "shims" / entry.name).write_bytes(
+            update.rewrite_executable(entry, python, text),
+        )
+
+
+def measure(name: str, func, srcpath: Path, dstpath: Path) -> None:
+    shutil.rmtree(dstpath, ignore_errors=True)
+    (dstpath / "root" / "bin").mkdir(parents=True)
+    (dstpath / "root" / "shims").mkdir()
+
+    before = rchar()
+    start = time.perf_counter()
+    func(srcpath, dstpath)
+    elapsed = time.perf_counter() - start
+    read = rchar() - before
+    print(f"{name:>10s}  {elapsed * 1000:10.2f} ms  {read / 1024**2:10.2f} MiB read")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--binaries", type=int, default=20, help="Number of binaries")
+    ap.add_argument("--binary-size", type=int, default=10, help="Size in MiB")
+    ap.add_argument("--scripts", type=int, default=500, help="Number of scripts")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="Threads")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        srcpath = Path(tmp) / "komodo"
+        dstpath = Path(tmp) / "kenv"
+        make_bin(srcpath, args.binaries, args.binary_size, args.scripts)
+
+        measure("legacy", legacy_update_bins, srcpath, dstpath)
+        measure(
+            "bounded",
+            lambda src, dst: update.update_bins(
+                src, dst, update.new_generation(dst), incremental=False
+            ),
+            srcpath,
+            dstpath,
+        )
+        measure(
+            "threaded",
+            lambda src, dst: update.update_bins(
+                src, dst, update.new_generation(dst), incremental=False, jobs=args.jobs
+            ),
+            srcpath,
+            dstpath,
+        )
+
+
+if __name__ == "__main__":
+    main()
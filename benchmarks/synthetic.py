@@ -0,0 +1,203 @@
+"""Generate a synthetic komodo root at production scale.
+
+Each release has the layout komodoenv expects: a `-rhelX` release directory
+with `root/bin` (Python scripts and large compiled binaries), a site-packages
+with many dist-infos, jupyter and rips config trees, and a redirecting
+release without the suffix whose `enable` sets CUSTOM_COORDINATE. Releases are
+reached through chains of symlinks like `stable -> stable-py3 ->
+stable-py311 -> 2030.01-py311 -> 2030.01.00-py311`.
+
+    $ python -m benchmarks.synthetic /tmp/komodo --releases 3 --scripts 2000
+"""
+
+import argparse
+import itertools
+import os
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+PYVER = "py{}{}".format(*sys.version_info[:2])
+RHEL_SUFFIX = "-rhel8"
+
+
+class Scale(NamedTuple):
+    releases: int = 3
+    scripts: int = 1000
+    binaries: int = 20
+    binary_size: int = 1024  # KiB
+    dist_infos: int = 2000
+    config_files: int = 200
+    chain_depth: int = 1
+
+
+def release_name(index: int) -> str:
+    return f"2030.{index + 1:02d}.00-{PYVER}"
+
+
+def make_bin(release: Path, scale: Scale) -> None:
+    bindir = release / "root" / "bin"
+    bindir.mkdir(parents=True)
+    (bindir / "python").symlink_to(sys.executable)
+    (bindir / f"python{sys.version_info[0]}.{sys.version_info[1]}").symlink_to(
+        sys.executable
+    )
+
+    for i in range(scale.scripts):
+        path = bindir / f"script{i}"
+        path.write_text(
+            f"#!{bindir}/python\n"
+            "import sys\n"
+            f"from package{i}.cli import main\n"
+            "sys.exit(main())\n",
+        )
+        path.chmod(0o755)
+
+    chunk = os.urandom(1024)
+    for i in range(scale.binaries):
+        path = bindir / f"binary{i}"
+        with open(path, "wb") as f:
+            f.write(b"\x7fELF")
+            f.writelines(chunk for _ in range(scale.binary_size))
+        path.chmod(0o755)
+
+
+def make_site_packages(release: Path, scale: Scale) -> None:
+    pkgdir = (
+        release
+        / "root"
+        / "lib"
+        / "python{}.{}".format(*sys.version_info[:2])
+        / "site-packages"
+    )
+    pkgdir.mkdir(parents=True)
+    for i in range(scale.dist_infos):
+        (pkgdir / f"package{i}").mkdir()
+        (pkgdir / f"package{i}" / "__init__.py").write_text("")
+        dist_info = pkgdir / f"package{i}-1.0.{i}.dist-info"
+        dist_info.mkdir()
+        (dist_info / "METADATA").write_text(
+            f"Metadata-Version: 2.1\nName: package{i}\nVersion: 1.0.{i}\n"
+        )
+    # .pth files like those of setuptools and of editable installs
+    (pkgdir / "distutils-precedence.pth").write_text("import os\n")
+    (pkgdir / "extra").mkdir()
+    (pkgdir / "extra.pth").write_text("extra\n")
+    (pkgdir / "notebook-7.2.0.dist-info").mkdir()
+    (pkgdir / "komodoenv-1.0.0.dist-info").mkdir()
+
+
+def make_config_trees(release: Path, scale: Scale) -> None:
+    root = release / "root"
+    trees = [
+        root / "share" / "jupyter" / "labextensions",
+        root / "etc" / "jupyter" / "jupyter_server_config.d",
+        root / "share" / "rips",
+    ]
+    for i in range(scale.config_files):
+        tree = trees[i % len(trees)]
+        path = tree / f"ext{i // 10}" / f"config{i}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f'{{"index": {i}}}\n')
+
+
+def make_release(root: Path, name: str, scale: Scale) -> Path:
+    """Create release `name` and its redirecting release, returning the path
+    of the former"""
+    release = root / (name + RHEL_SUFFIX)
+    make_bin(release, scale)
+    make_site_packages(release, scale)
+    make_config_trees(release, scale)
+    (release / "enable").write_text(
+        f"export KOMODO_RELEASE={release.name}\nexport PATH={release}/root/bin:$PATH\n",
+    )
+
+    redirect = root / name
+    redirect.mkdir()
+    (redirect / "enable").write_text(
+        f'CUSTOM_COORDINATE=""\nsource {release}/enable\n',
+    )
+    return release
+
+
+def make_chain(root: Path, mode: str, target: str, depth: int) -> None:
+    """Link `mode` to `target` through `mode`-py3, `mode`-pyXY and `depth`
+    release series links"""
+    base = target.split("-", 1)[0].rsplit(".", 1)[0]
+    chain = [mode, f"{mode}-py3", f"{mode}-{PYVER}"]
+    chain += [f"{base}-{k}-{PYVER}" for k in range(depth - 1, 0, -1)]
+    if depth > 0:
+        chain.append(f"{base}-{PYVER}")
+    chain.append(target)
+    for src, dst in itertools.pairwise(chain):
+        if not (root / src).is_symlink():
+            (root / src).symlink_to(dst)
+
+
+def make_komodo_root(root: Path, scale: Scale) -> None:
+    root.mkdir(parents=True, exist_ok=True)
+    names = [release_name(i) for i in range(scale.releases)]
+    for name in names:
+        make_release(root, name, scale)
+
+    make_chain(root, "stable", names[0], scale.chain_depth)
+    make_chain(root, "testing", names[min(1, len(names) - 1)], scale.chain_depth)
+    make_chain(root, "bleeding", names[-1], scale.chain_depth)
+
+
+def add_scale_arguments(ap: argparse.ArgumentParser) -> None:
+    defaults = Scale()
+    ap.add_argument("--releases", type=int, default=defaults.releases)
+    ap.add_argument(
+        "--scripts",
+        type=int,
+        default=defaults.scripts,
+        help="Python scripts in bin/ per release",
+    )
+    ap.add_argument(
+        "--binaries",
+        type=int,
+        default=defaults.binaries,
+        help="Compiled binaries in bin/ per release",
+    )
+    ap.add_argument(
+        "--binary-size",
+        type=int,
+        default=defaults.binary_size,
+        help="Size of each binary in KiB",
+    )
+    ap.add_argument(
+        "--dist-infos",
+        type=int,
+        default=defaults.dist_infos,
+        help="Distributions in site-packages per release",
+    )
+    ap.add_argument(
+        "--config-files",
+        type=int,
+        default=defaults.config_files,
+        help="Files in the jupyter and rips config trees per release",
+    )
+    ap.add_argument(
+        "--chain-depth",
+        type=int,
+        default=defaults.chain_depth,
+        help="Release series symlinks between eg. stable-pyXY and the release",
+    )
+
+
+def scale_from_args(args: argparse.Namespace) -> Scale:
+    return Scale(**{field: getattr(args, field) for field in Scale._fields})
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("destination", type=Path, help="Komodo root to create")
+    add_scale_arguments(ap)
+    args = ap.parse_args()
+
+    make_komodo_root(args.destination, scale_from_args(args))
+
+
+if __name__ == "__main__":
+    main()
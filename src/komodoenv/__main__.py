@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import argparse
 import os
-import re
 import subprocess
 import sys
 from pathlib import Path
@@ -10,10 +9,14 @@ from shutil import rmtree
 
 import distro
 
+from komodoenv import index, update_all
+from komodoenv.cache import cache_dir
 from komodoenv.colors import blue, strip_color, yellow
 from komodoenv.creator import Creator
+from komodoenv.probe import find_python, python_version
+from komodoenv.python import Python
 from komodoenv.statfs import is_nfs
-from komodoenv.update import get_tracked_release
+from komodoenv.update import TIMINGS_ENV, ReleaseResolver, Timings
 
 
 def get_release_maturity_text(release_path):
@@ -54,16 +57,9 @@ def distro_suffix():
     return f"-rhel{distro.major_version()}"
 
 
-def resolve_release(
-    *,
-    root: Path,
-    name: str,
-    no_update: bool = False,
-) -> tuple[Path, Path]:
-    """Autodetect komodo release heuristically"""
-    if not (root / name / "enable").is_file():
-        sys.exit(f"'{root / name}' is not a valid komodo release")
-
+def which_python(enable: Path) -> Path:
+    """Find the Python of a komodo release by sourcing its `enable` in bash.
+    Only used when `probe.find_python` can't follow the enable script."""
     env = os.environ.copy()
     if "BASH_ENV" in env:
         del env["BASH_ENV"]
@@ -72,7 +68,7 @@ def resolve_release(
             [
                 "/bin/bash",
                 "-c",
-                f"source {root / name / 'enable'};which python;python --version",
+                f"source {enable};which python",
             ],
             env=env,
         )
@@ -80,28 +76,49 @@ def resolve_release(
         .splitlines(keepends=False)
     )
 
-    if len(python_info) != 2:
-        msg = f"Expected exactly 2 lines, but got {len(python_info)}"
+    if len(python_info) != 1:
+        msg = f"Expected exactly 1 line, but got {len(python_info)}"
         raise RuntimeError(msg)
-    actual_path = Path(python_info[0]).parents[2]  # <path>/root/bin/python
+    return Path(python_info[0])
+
+
+def resolve_release(
+    *,
+    root: Path,
+    name: str,
+    no_update: bool = False,
+) -> tuple[Path, Path]:
+    """Autodetect komodo release heuristically"""
+    if not (root / name / "enable").is_file():
+        sys.exit(f"'{root / name}' is not a valid komodo release")
+
+    python_path = find_python(root / name / "enable")
+    if python_path is None:
+        python_path = which_python(root / name / "enable")
+    actual_path = python_path.parents[2]  # <path>/root/bin/python
     if no_update:
         return actual_path, actual_path
 
-    match = re.search(r"Python (\d).(\d+)", python_info[1])
-    if match is None:
-        sys.exit(f"An error occurred while detecting the version of Python of '{root}'")
-    major, minor = match.groups()
-    pyver = "-py" + major + minor
-    distribution_suffix = distro_suffix()
+    version = python_version(python_path.parents[1])
+    if version is None:
+        python = Python(python_path)
+        try:
+            python.detect()
+        except ValueError:
+            sys.exit(
+                f"An error occurred while detecting the version of Python of '{root}'"
+            )
+        version = python.version_info[:2]
+    major, minor = version
+    pyver = f"-py{major}{minor}"
+    resolver = ReleaseResolver(distro_suffix())
 
     for mode in "stable", "testing", "bleeding":
         track = root / (mode + pyver)
-        dir_ = get_tracked_release(
-            (root / (mode + pyver)).resolve(), distribution_suffix
-        )
+        dir_ = resolver.tracked_release(resolver.resolve(track))
 
-        if (dir_ / "root").is_dir():
-            symlink = dir_.resolve()
+        if resolver.is_dir(dir_ / "root"):
+            symlink = resolver.resolve(dir_)
             if symlink.name == actual_path.name:
                 return symlink, track
 
@@ -111,8 +128,30 @@ def resolve_release(
     )
 
 
+def settings_from_args(args: argparse.Namespace) -> dict[str, str]:
+    """Entries for komodoenv.settings that tell komodoenv-update how to update"""
+    settings = {}
+    if args.shared_shims:
+        settings["shim-store"] = str(Path(args.shared_shims).absolute())
+    if args.lazy_shims:
+        settings["shim-mode"] = "lazy"
+    if args.auto_update:
+        settings["auto-update"] = "true"
+    return settings
+
+
+# Commands that are recognised when they're the first argument, as opposed to
+# the destination of a new komodoenv
+SUBCOMMANDS = {"update-all": update_all.main, "index": index.main}
+
+
 def parse_args(args):
-    ap = argparse.ArgumentParser()
+    ap = argparse.ArgumentParser(
+        epilog="Other commands, given as the first argument: "
+        + ", ".join(f"'komodoenv {name}'" for name in SUBCOMMANDS)
+        + ". To create a komodoenv in a directory named like one of them, give "
+        "its path, eg. 'komodoenv ./index'.",
+    )
     ap.add_argument(
         "-f",
         "--force",
@@ -146,6 +185,73 @@ def parse_args(args):
         default="/prog/komodo" if Path("/prog/komodo").is_dir() else "/prog/res/komodo",
         help="Absolute path to komodo root (default: /prog/res/komodo for Onprem, /prog/komodo for Azure)",
     )
+    ap.add_argument(
+        "--link",
+        action="store_true",
+        default=False,
+        help="Reflink or hardlink the Python interpreter from the komodo release "
+        "instead of copying it, when on the same filesystem",
+    )
+    ap.add_argument(
+        "--template-cache",
+        action="store_const",
+        dest="template_cache",
+        default=None,
+        const=str(cache_dir() / "templates"),
+        help="Like --template-cache-dir ~/.cache/komodoenv/templates. Takes no "
+        "value, so that eg. '--template-cache my-kenv' creates my-kenv",
+    )
+    ap.add_argument(
+        "--template-cache-dir",
+        type=str,
+        dest="template_cache",
+        metavar="DIR",
+        help="Build a template komodoenv once per komodo release in DIR and "
+        "create komodoenvs by copying it",
+    )
+    ap.add_argument(
+        "--shared-shims",
+        action="store_const",
+        dest="shared_shims",
+        default=None,
+        const=str(cache_dir() / "shims"),
+        help="Like --shared-shims-dir ~/.cache/komodoenv/shims. Takes no value, "
+        "so that eg. '--shared-shims my-kenv' creates my-kenv",
+    )
+    ap.add_argument(
+        "--shared-shims-dir",
+        type=str,
+        dest="shared_shims",
+        metavar="DIR",
+        help="Keep the shims of komodo's compiled executables in DIR, shared by "
+        "all komodoenvs of the same release, instead of in each komodoenv. DIR "
+        "must be readable by everyone using the komodoenv",
+    )
+    ap.add_argument(
+        "--lazy-shims",
+        action="store_true",
+        default=False,
+        help="Instead of a shim for every komodo executable, create a symlink to "
+        "a single dispatcher which looks up the executable when it's run. Makes "
+        "updates much faster for large releases",
+    )
+    ap.add_argument(
+        "--auto-update",
+        action="store_true",
+        default=False,
+        help="When enabling the komodoenv finds that komodo has been updated, "
+        "update the komodoenv in the background instead of asking to run "
+        "komodoenv-update",
+    )
+    ap.add_argument(
+        "--timings",
+        type=Path,
+        default=os.environ.get(TIMINGS_ENV) or None,
+        metavar="PATH",
+        help="Append the wall time of each step of the creation to PATH as JSON "
+        "lines. As steps run in parallel, I/O is only recorded for all of them "
+        f"together, as the 'populate' step (default: ${TIMINGS_ENV})",
+    )
     ap.add_argument(
         "--force-color",
         action="store_true",
@@ -208,6 +314,9 @@ def main(args=None):
 
     if args is None:
         args = sys.argv[1:]
+    if args and args[0] in SUBCOMMANDS:
+        SUBCOMMANDS[args[0]](list(args[1:]))
+        return
     args = parse_args(args)
 
     if args.destination.is_dir() and args.force:
@@ -233,6 +342,12 @@ def main(args=None):
         trackpath=args.track,
         dstpath=args.destination,
         use_color=use_color,
+        link_interpreter=args.link,
+        template_cache=(
+            Path(args.template_cache).absolute() if args.template_cache else None
+        ),
+        settings=settings_from_args(args),
+        timings=Timings("create", args.timings.absolute() if args.timings else None),
     )
     creator.create()
 
@@ -0,0 +1,69 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def cache_dir() -> Path:
+    """Per-user cache directory for komodoenv"""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "komodoenv"
+
+
+class Cache:
+    """Directory of JSON entries, one file per key.
+
+    Entries are written to a temporary file and renamed into place, so any
+    number of komodoenv processes may read and write concurrently. Reading an
+    entry bumps its mtime, and the least recently used entries are removed
+    once there are more than `max_entries`. The cache is best-effort: any
+    error reading or writing it is treated as a cache miss.
+    """
+
+    def __init__(self, name: str, max_entries: int = 64) -> None:
+        self.path = cache_dir() / name
+        self.max_entries = max_entries
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / (hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str):
+        path = self.entry_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("key") != key:
+            return None
+        return entry.get("value")
+
+    def put(self, key: str, value) -> None:
+        with contextlib.suppress(OSError):
+            self.path.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"key": key, "value": value}, f)
+                Path(tmp).replace(self.entry_path(key))
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            with contextlib.suppress(FileNotFoundError):
+                Path(path).unlink()
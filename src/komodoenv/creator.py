@@ -1,6 +1,11 @@
+import fcntl
+import hashlib
+import json
 import os
+import shutil
 import subprocess
-from contextlib import contextmanager
+import time
+from contextlib import contextmanager, suppress
 from importlib.metadata import distribution
 from pathlib import Path
 from textwrap import dedent
@@ -9,7 +14,26 @@ import distro
 
 from komodoenv.bundle import get_bundled_wheel
 from komodoenv.colors import green, strip_color
+from komodoenv.installer import install_wheel
 from komodoenv.python import Python
+from komodoenv.statfs import same_filesystem
+from komodoenv.tasks import TaskGraph, echo
+from komodoenv.update import (
+    GENERATIONS,
+    SETTINGS_FILE,
+    SHEBANG_MAX,
+    SHIMS_MANIFEST,
+    TIMINGS_ENV,
+    Timings,
+    lock_file,
+    write_atomic,
+)
+
+# From /usr/include/linux/fs.h
+_FICLONE = 0x40049409
+
+# Name of the file in a template directory describing what it was built from
+TEMPLATE_STAMP = "komodoenv.template.json"
 
 
 @contextmanager
@@ -19,6 +43,32 @@ def open_chmod(path: Path, mode: str = "w", file_mode=0o644):
     path.chmod(file_mode)
 
 
+def clone_file(src: Path, dst: Path, *, hardlink: bool = True) -> str:
+    """Make `dst` a copy of `src` as cheaply as possible. When both are on the
+    same filesystem, try a copy-on-write reflink first, then a hardlink (unless
+    disabled), before falling back to copying.
+
+    Returns the strategy that was used: "reflink", "hardlink" or "copy".
+    """
+    if same_filesystem(src, dst.parent):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+        except OSError:
+            dst.unlink(missing_ok=True)
+        else:
+            return "reflink"
+
+        if hardlink:
+            with suppress(OSError):
+                os.link(src, dst)
+                return "hardlink"
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
 class Creator:
     _fmt_action = "  " + green("{action:>10s}") + "    {message}"
 
@@ -30,14 +80,25 @@ class Creator:
         trackpath,
         dstpath=None,
         use_color=False,
+        link_interpreter=False,
+        template_cache=None,
+        timings=None,
+        settings=None,
     ):
         if not use_color:
             self._fmt_action = strip_color(self._fmt_action)
+        self.use_color = use_color
 
         self.komodo_root = komodo_root
         self.srcpath = srcpath
         self.trackpath = trackpath
         self.dstpath = dstpath
+        self.link_interpreter = link_interpreter
+        self.template_cache = template_cache
+        # Entries for komodoenv.settings, which tell komodoenv-update eg. how
+        # to generate shims
+        self.settings = settings or {}
+        self.timings = timings if timings is not None else Timings("create")
 
         self.srcpy = Python(srcpath / "root/bin/python")
         self.srcpy.detect()
@@ -45,7 +106,7 @@ class Creator:
         self.dstpy = self.srcpy.make_dst(dstpath / "root/bin/python")
 
     def print_action(self, action, message):
-        print(self._fmt_action.format(action=action, message=message))
+        echo(self._fmt_action.format(action=action, message=message))
 
     def mkdir(self, path):
         self.print_action("mkdir", path + "/")
@@ -74,45 +135,203 @@ class Creator:
                 + str(self.srcpy.version_info[1]),
                 "-m",
                 "venv",
-                "--copies",
+                "--symlinks" if self.link_interpreter else "--copies",
                 "--without-pip",
                 str(self.dstpath / "root"),
             ],
             env=env,
         )
 
+        if self.link_interpreter:
+            self.unlink_interpreter()
+
+    def unlink_interpreter(self):
+        """Replace the symlinks to komodo's interpreter created by `venv
+        --symlinks` with reflinks, hardlinks or copies, so that the komodoenv
+        doesn't break when the komodo release it was created from is removed.
+        """
+        bindir = self.dstpath / "root" / "bin"
+        strategies = set()
+        for path in bindir.iterdir():
+            if not path.is_symlink():
+                continue
+            target = Path(os.path.realpath(path))
+            if bindir in target.parents:
+                continue
+
+            tmp = path.with_name(f".{path.name}.tmp")
+            strategies.add(clone_file(target, tmp))
+            tmp.replace(path)
+
+        if strategies:
+            self.print_action(
+                "link", f"interpreter using {', '.join(sorted(strategies))}"
+            )
+
     def run(self, path):
         self.print_action("run", path)
-        subprocess.check_output([str(self.dstpath / path)])
+        env = None
+        if self.timings.path is not None:
+            env = {**os.environ, TIMINGS_ENV: str(self.timings.path)}
+        subprocess.check_output([str(self.dstpath / path)], env=env)
 
     def pip_install(self, package: str) -> None:
-        pip_wheel = get_bundled_wheel("pip")
-        dst_wheel = get_bundled_wheel(package)
+        """Install a bundled wheel directly, without starting pip"""
         self.print_action("install", package)
-
-        env = os.environ.copy()
-        env["PYTHONPATH"] = pip_wheel
-
-        subprocess.check_output(
-            [
-                str(self.dstpath / "root/bin/python"),
-                "-m",
-                "pip",
-                "install",
-                "--no-cache-dir",
-                "--no-deps",
-                "--disable-pip-version-check",
-                dst_wheel,
-            ],
-            env=env,
+        install_wheel(
+            get_bundled_wheel(package),
+            site_packages=self.dstpath / self.dstpy.site_packages_path,
+            prefix=self.dstpath / "root",
+            python=self.dstpath / "root/bin/python",
+            version_info=self.dstpy.version_info,
         )
 
-    def create(self):
-        self.dstpath.mkdir()
-
-        self.venv()
-
-        # Create komodoenv.conf
+    def tracked_release(self):
+        """Path of the tracked release. Only the name of `trackpath` is
+        meaningful, as `--track` may be given as a bare name like stable-py311,
+        which is relative to the komodo root rather than the working directory."""
+        return self.komodo_root / self.trackpath.name
+
+    def template_key(self):
+        """Name of the template directory for this release"""
+        key = (
+            f"{self.komodo_root}:{self.srcpath}:{self.tracked_release()}:"
+            f"{self.link_interpreter}:{sorted(self.settings.items())}"
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return f"{self.srcpath.name}-{digest}"
+
+    def template_stamp(self):
+        """What a template must have been built from to be usable"""
+        return {
+            "komodoenv-version": distribution("komodoenv").version,
+            "release": os.path.realpath(self.srcpath),
+            "release-mtime": self.srcpath.stat().st_mtime,
+            "tracked-release": os.path.realpath(self.tracked_release()),
+            "tracked-mtime": self.tracked_release().stat().st_mtime,
+        }
+
+    def read_template_stamp(self, template):
+        """The stamp of `template`, or None if it's missing or was built from
+        something else than this release"""
+        try:
+            stamp = json.loads((template / TEMPLATE_STAMP).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if {k: v for k, v in stamp.items() if k != "prefix"} != self.template_stamp():
+            return None
+        return stamp
+
+    def build_template(self, template):
+        """Create a komodoenv in the template cache, and atomically move it to
+        `template` when complete. Must be called with the template's lock held
+        exclusively, see `create_from_template`."""
+        # Unlike tempfile.mkdtemp, which creates it 0700, the directory gets
+        # the permissions of the umask, and copytree passes them on to the
+        # komodoenvs created from the template
+        tmp = self.template_cache / f".build-{os.getpid()}-{os.urandom(4).hex()}"
+        tmp.mkdir()
+        self.print_action("template", f"building in {tmp}")
+        try:
+            Creator(
+                komodo_root=self.komodo_root,
+                srcpath=self.srcpath,
+                trackpath=self.trackpath,
+                dstpath=tmp,
+                use_color=self.use_color,
+                link_interpreter=self.link_interpreter,
+                timings=self.timings,
+                settings=self.settings,
+            ).populate()
+            stamp = {**self.template_stamp(), "prefix": str(tmp)}
+            (tmp / TEMPLATE_STAMP).write_text(json.dumps(stamp), encoding="utf-8")
+
+            # Move a stale template out of the way first, as rename can't
+            # replace a non-empty directory
+            stale = template.with_name(f".stale-{template.name}-{os.getpid()}")
+            with suppress(FileNotFoundError):
+                template.rename(stale)
+            try:
+                tmp.rename(template)
+            except OSError:
+                # Another process which couldn't take the lock published first
+                if self.read_template_stamp(template) is None:
+                    raise
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        shutil.rmtree(stale, ignore_errors=True)
+
+    def create_from_template(self):
+        """Copy the template of this release, building it first if needed.
+
+        Copying holds the template's lock shared, and building it exclusively,
+        so that concurrent creations build each template only once, and a
+        template isn't replaced while it's being copied."""
+        template = self.template_cache / self.template_key()
+        lock = template.with_name(f"{template.name}.lock")
+        self.template_cache.mkdir(parents=True, exist_ok=True)
+        with lock_file(lock, shared=True):
+            stamp = self.read_template_stamp(template)
+            if stamp is not None:
+                self.clone_template(template, stamp)
+                return
+
+        with lock_file(lock):
+            # Another process may have built it while we were waiting
+            stamp = self.read_template_stamp(template)
+            if stamp is None:
+                with self.timings.phase("template"):
+                    self.build_template(template)
+                stamp = self.read_template_stamp(template)
+            self.clone_template(template, stamp)
+
+    def clone_template(self, template, stamp):
+        self.print_action("clone", f"from {template}")
+        with self.timings.phase("clone"):
+            shutil.copytree(
+                template,
+                self.dstpath,
+                symlinks=True,
+                copy_function=lambda src, dst: clone_file(
+                    Path(src), Path(dst), hardlink=False
+                ),
+            )
+            (self.dstpath / TEMPLATE_STAMP).unlink()
+        with self.timings.phase("relocate"):
+            self.relocate(stamp["prefix"])
+
+    def relocate(self, prefix):
+        """Replace references to `prefix`, where a template was built, with this
+        komodoenv's path in the files that contain it: the enable scripts,
+        pyvenv.cfg, venv activate scripts and the shebangs of scripts and shims.
+        """
+        old = prefix.encode("utf-8")
+        new = str(self.dstpath).encode("utf-8")
+        paths = [self.dstpath / "root" / "pyvenv.cfg"]
+        with suppress(FileNotFoundError):
+            paths.extend((self.dstpath / "root" / "bin").iterdir())
+        # The enable scripts and shims are in generations, which root/shims and
+        # enable link into
+        for state in [self.dstpath, *(self.dstpath / GENERATIONS).glob("gen-*")]:
+            paths += [state / "enable", state / "enable.csh", state / SHIMS_MANIFEST]
+            if not (state / "root" / "shims").is_symlink():
+                with suppress(FileNotFoundError):
+                    paths.extend((state / "root" / "shims").iterdir())
+
+        for path in paths:
+            if path.is_symlink() or not path.is_file():
+                continue
+            with open(path, "rb") as f:
+                head = f.read(SHEBANG_MAX)
+                if b"\0" in head:  # Binary file, eg. the Python interpreter
+                    continue
+                text = head + f.read()
+            if old in text:
+                write_atomic(path, text.replace(old, new), path.stat().st_mode & 0o777)
+
+    def create_conf(self):
         with self.create_file("komodoenv.conf") as f:
             f.write(
                 dedent(
@@ -127,7 +346,12 @@ class Creator:
                 """,
                 ),
             )
+        if self.settings:
+            with self.create_file(SETTINGS_FILE) as f:
+                for key, value in self.settings.items():
+                    f.write(f"{key} = {value}\n")
 
+    def create_pth(self):
         python_paths = [
             pth for pth in self.srcpy.site_paths if pth.startswith(str(self.srcpath))
         ]
@@ -140,7 +364,8 @@ class Creator:
         ) as f:
             f.write("\n".join(python_paths) + "\n")
 
-        # Create & run komodo-update
+    def update(self):
+        """Create & run komodoenv-update"""
         with (
             open(
                 Path(__file__).parent / "update.py",
@@ -153,9 +378,51 @@ class Creator:
         ):
             outf.write(inf.read())
         self.run("root/bin/komodoenv-update")
-        self.pip_install("pip")
 
+    def remove_shadowed_shims(self):
+        """Remove the shims of komodo's executables that the komodoenv has in its
+        own root/bin, which komodoenv-update doesn't create shims for. As pip is
+        installed while komodoenv-update runs, whether it has found pip in
+        root/bin depends on timing."""
         self.remove_file("root/shims/komodoenv")
+        for path in (self.dstpath / "root" / "bin").iterdir():
+            shim = self.dstpath / "root" / "shims" / path.name
+            if shim.is_file():
+                shim.unlink()
+
+    def populate(self):
+        """Create everything inside of the (existing) komodoenv directory. Steps
+        that don't depend on each other, like generating shims and installing
+        pip, run at the same time. The I/O of the steps can't be told apart, so
+        only the wall time of each step is recorded, and the I/O of all of them
+        together as the 'populate' phase."""
+
+        def step(name, func, *args):
+            def run():
+                with self.timings.phase(name, io=False):
+                    func(*args)
+
+            return run
+
+        tasks = TaskGraph()
+        tasks.add("venv", step("venv", self.venv))
+        tasks.add("conf", step("conf", self.create_conf))
+        tasks.add("pth", step("pth", self.create_pth), after=("venv",))
+        tasks.add("update", step("update", self.update), after=("venv", "conf", "pth"))
+        tasks.add("pip", step("pip", self.pip_install, "pip"), after=("venv",))
+        tasks.add("cleanup", self.remove_shadowed_shims, after=("update", "pip"))
+        with self.timings.phase("populate"):
+            tasks.run()
+
+    def create(self):
+        start = time.perf_counter()
+        with self.timings.phase("total"):
+            if self.template_cache is not None:
+                self.create_from_template()
+            else:
+                self.dstpath.mkdir()
+                self.populate()
+        wall = time.perf_counter() - start
 
         if os.environ.get("SHELL", "").endswith("csh"):
             enable_script = self.dstpath / "enable.csh"
@@ -166,7 +433,7 @@ class Creator:
             dedent(
                 f"""\
 
-        Komodoenv has successfully been generated. You can now pip-install software.
+        Komodoenv has successfully been generated in {wall:.1f}s. You can now pip-install software.
 
             $ source {enable_script}
         """,
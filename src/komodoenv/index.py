@@ -0,0 +1,65 @@
+"""Index the releases of a komodo root.
+
+With an up-to-date index, komodoenv and komodoenv-update find the release
+tracked by eg. `stable-py311` without following symlinks or reading `enable`
+scripts. The index is meant to be rebuilt whenever releases are deployed, but
+an out of date index is simply ignored.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from komodoenv import update
+
+
+def print_index(index: dict) -> None:
+    print(f"{'release':40s}  {'python':6s}  {'rhel':6s}  {'coordinate':12s}  target")
+    for name, info in sorted(index["releases"].items()):
+        print(
+            f"{name:40s}  {info['python'] or '-':6s}  {info['rhel-suffix'] or '-':6s}"
+            f"  {info['custom-coordinate'] or '-':12s}  {info['target']}"
+        )
+
+
+def parse_args(args: list[str]) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(
+        prog="komodoenv index",
+        description="Index the releases of a komodo root, which speeds up "
+        "creating and updating komodoenvs",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=8,
+        help="Number of releases to inspect concurrently",
+    )
+    ap.add_argument(
+        "-l",
+        "--list",
+        action="store_true",
+        default=False,
+        help="Print the existing index instead of rebuilding it",
+    )
+    ap.add_argument("root", type=Path, help="Komodo root to index")
+    return ap.parse_args(args)
+
+
+def main(args: list[str]) -> None:
+    args = parse_args(args)
+    root = args.root.absolute()
+    if args.list:
+        index = update.read_release_index(root)
+        if index is None:
+            sys.exit(f"'{root}' has no up-to-date index")
+        print_index(index)
+        return
+
+    try:
+        index = update.index_releases(root, jobs=args.jobs)
+    except OSError as err:
+        sys.exit(f"Could not index '{root}': {err}")
+    print(f"Indexed {len(index['releases'])} releases in {root / update.RELEASE_INDEX}")
@@ -0,0 +1,182 @@
+"""Minimal installer for pure-Python wheels, as specified by the binary
+distribution format (PEP 427) and the recording installed projects
+specification (PEP 376, PEP 627).
+
+This lets komodoenv lay down its bundled wheels without starting the new
+environment's interpreter and running pip.
+"""
+
+from __future__ import annotations
+
+import base64
+import csv
+import hashlib
+import io
+import os
+import zipfile
+from configparser import ConfigParser
+from pathlib import Path, PurePosixPath
+
+SCRIPT_TEMPLATE = """\
+#!{python}
+import re
+import sys
+from {module} import {attr}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({func}())
+"""
+
+
+class InvalidWheelError(Exception):
+    pass
+
+
+def _record_hash(data: bytes) -> str:
+    digest = hashlib.sha256(data).digest()
+    return "sha256=" + base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def _safe_relpath(name: str) -> PurePosixPath:
+    path = PurePosixPath(name)
+    if path.is_absolute() or ".." in path.parts:
+        msg = f"Refusing to install file outside of target: {name}"
+        raise InvalidWheelError(msg)
+    return path
+
+
+def _dist_info_dir(wheel: zipfile.ZipFile) -> str:
+    dirs = {
+        name.split("/", 1)[0]
+        for name in wheel.namelist()
+        if name.split("/", 1)[0].endswith(".dist-info")
+    }
+    if len(dirs) != 1:
+        msg = f"Expected exactly one .dist-info directory, got {len(dirs)}"
+        raise InvalidWheelError(msg)
+    return dirs.pop()
+
+
+def _data_target(
+    parts: tuple[str, ...],
+    *,
+    site_packages: Path,
+    prefix: Path,
+    dist_name: str,
+) -> Path:
+    """Where to install a file from the wheel's .data directory"""
+    scheme, *rest = parts
+    if scheme in {"purelib", "platlib"}:
+        return site_packages.joinpath(*rest)
+    elif scheme == "scripts":
+        return prefix.joinpath("bin", *rest)
+    elif scheme == "headers":
+        return prefix.joinpath("include", "site", dist_name, *rest)
+    elif scheme == "data":
+        return prefix.joinpath(*rest)
+
+    msg = f"Unknown wheel data scheme: {scheme}"
+    raise InvalidWheelError(msg)
+
+
+def console_scripts(
+    entry_points: str,
+    dist_name: str,
+    version_info: tuple[int, ...],
+) -> dict[str, str]:
+    """Parse the [console_scripts] section of entry_points.txt. Like pip, also
+    create the pipX.Y variant of pip's console script."""
+    parser = ConfigParser(delimiters=("=",))
+    parser.optionxform = str
+    parser.read_string(entry_points)
+    if not parser.has_section("console_scripts"):
+        return {}
+
+    scripts = dict(parser.items("console_scripts"))
+    if dist_name == "pip" and "pip" in scripts:
+        scripts.setdefault("pip{}.{}".format(*version_info[:2]), scripts["pip"])
+    return scripts
+
+
+def install_wheel(
+    wheel_path: Path,
+    *,
+    site_packages: Path,
+    prefix: Path,
+    python: Path,
+    version_info: tuple[int, ...],
+) -> list[Path]:
+    """Unpack `wheel_path` into `site_packages`, generate its console scripts in
+    `prefix`/bin and write the RECORD and INSTALLER metadata files.
+
+    Returns the list of installed files.
+    """
+    bindir = prefix / "bin"
+    installed: list[tuple[Path, bytes, int]] = []
+
+    with zipfile.ZipFile(wheel_path) as wheel:
+        dist_info = _dist_info_dir(wheel)
+        dist_name = dist_info.split("-", 1)[0]
+        data_dir = dist_info[: -len(".dist-info")] + ".data"
+
+        for info in wheel.infolist():
+            if info.is_dir():
+                continue
+            relpath = _safe_relpath(info.filename)
+            if relpath.parts[-1] == "RECORD" and relpath.parts[0] == dist_info:
+                continue
+            data = wheel.read(info)
+
+            if relpath.parts[0] == data_dir:
+                target = _data_target(
+                    relpath.parts[1:],
+                    site_packages=site_packages,
+                    prefix=prefix,
+                    dist_name=dist_name,
+                )
+                if target.parent == bindir and data.startswith(b"#!python"):
+                    data = b"#!" + str(python).encode("utf-8") + data[8:]
+            else:
+                target = site_packages.joinpath(*relpath.parts)
+
+            mode = (info.external_attr >> 16) & 0o777
+            installed.append((target, data, mode))
+
+        entry_points = ""
+        if f"{dist_info}/entry_points.txt" in wheel.namelist():
+            entry_points = wheel.read(f"{dist_info}/entry_points.txt").decode("utf-8")
+
+    for name, spec in console_scripts(entry_points, dist_name, version_info).items():
+        module, _, func = spec.partition(":")
+        script = SCRIPT_TEMPLATE.format(
+            python=python,
+            module=module.strip(),
+            attr=func.strip().split(".")[0],
+            func=func.strip(),
+        )
+        installed.append((bindir / name, script.encode("utf-8"), 0o755))
+
+    dist_info_path = site_packages / dist_info
+    installed.append((dist_info_path / "INSTALLER", b"komodoenv\n", 0o644))
+    installed.append((dist_info_path / "REQUESTED", b"", 0o644))
+
+    for target, data, mode in installed:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        target.chmod(0o755 if mode & 0o111 else 0o644)
+
+    record_path = dist_info_path / "RECORD"
+    with io.StringIO() as buf:
+        writer = csv.writer(buf, lineterminator="\n")
+        for target, data, _ in installed:
+            writer.writerow(
+                (
+                    os.path.relpath(target, site_packages),
+                    _record_hash(data),
+                    len(data),
+                ),
+            )
+        writer.writerow((os.path.relpath(record_path, site_packages), "", ""))
+        record_path.write_text(buf.getvalue(), encoding="utf-8")
+
+    return [target for target, _, _ in installed] + [record_path]
@@ -0,0 +1,230 @@
+"""Find the Python interpreter of a komodo release, and its version, without
+running anything.
+
+Sourcing a release's `enable` in bash to ask `which python` forks bash, runs
+everything the enable script does and then starts Python, which takes seconds
+on a slow NFS. Instead, the enable script is read here and only the statements
+that can change PATH are followed: variable assignments and sourcing of other
+scripts. Function definitions are skipped, and calls to them are assumed not to
+prepend to PATH. Whenever PATH may be changed in a way we can't follow, eg. by
+a conditional assignment, the caller must fall back to bash.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import shlex
+from pathlib import Path
+
+# Maximum number of nested `source`s, and of symlinks, to follow
+MAX_DEPTH = 8
+
+# Stand-in for the PATH inherited from the caller of the enable script
+INHERITED = "\0"
+
+NAME = re.compile(r"\w+")
+ASSIGNMENT = re.compile(r"([A-Za-z_]\w*)=(.*)", re.DOTALL)
+PARAMETER = re.compile(r"(\w+)(?:(:?[-+])(.*))?", re.DOTALL)
+FUNCTION = re.compile(r"(?:function\s+[\w:-]+(?:\s*\(\s*\))?|[\w:-]+\s*\(\s*\))\s*\{?")
+AFFECTS_PATH = re.compile(r"\bPATH\s*[+]?=|\bsource\b|(?:^|[;&|]\s*)\.\s|\beval\b")
+BLOCK_START = {"if", "for", "while", "until", "case", "select"}
+BLOCK_END = {"fi", "done", "esac"}
+VERSION = re.compile(r"python(\d+)\.(\d+)")
+
+
+class UnsupportedScriptError(Exception):
+    """The enable script does something that can't be followed statically"""
+
+
+def closing_brace(value: str, start: int) -> int:
+    """Index of the '}' matching the '{' at `start`"""
+    depth = 0
+    for i in range(start, len(value)):
+        if value[i] == "{":
+            depth += 1
+        elif value[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise UnsupportedScriptError(value)
+
+
+def lookup(name: str, variables: dict[str, str | None]) -> str:
+    value = variables.get(name, "")  # Unset variables expand to nothing
+    if value is None:
+        raise UnsupportedScriptError(name)
+    return value
+
+
+def expand(value: str, variables: dict[str, str | None]) -> str:
+    """Expand the `$VAR`, `${VAR}`, `${VAR-word}` and `${VAR+word}` references
+    in `value`, with or without ':'"""
+    if "`" in value or "$(" in value:
+        raise UnsupportedScriptError(value)
+
+    result = []
+    i = 0
+    while i < len(value):
+        if value.startswith("${", i):
+            end = closing_brace(value, i + 1)
+            match = PARAMETER.fullmatch(value, i + 2, end)
+            if match is None:  # eg. ${#VAR} or ${VAR/x/y}
+                raise UnsupportedScriptError(value)
+            name, operator, word = match.groups()
+            current = lookup(name, variables)
+            is_set = name in variables and (current != "" or ":" not in operator)
+            if operator is None:
+                result.append(current)
+            elif operator.endswith("-"):
+                result.append(current if is_set else expand(word, variables))
+            else:
+                result.append(expand(word, variables) if is_set else "")
+            i = end + 1
+        elif value.startswith("$", i):
+            match = NAME.match(value, i + 1)
+            if match is None:
+                result.append("$")
+                i += 1
+            else:
+                result.append(lookup(match[0], variables))
+                i = match.end()
+        else:
+            result.append(value[i])
+            i += 1
+    return "".join(result)
+
+
+def assign(
+    words: list[str], variables: dict[str, str | None], *, conditional: bool
+) -> None:
+    for word in words:
+        match = ASSIGNMENT.fullmatch(word)
+        if match is None:  # eg. `export NAME`
+            continue
+        name, value = match.groups()
+        try:
+            variables[name] = None if conditional else expand(value, variables)
+        except UnsupportedScriptError:
+            variables[name] = None  # Only matters if the variable is used
+        if name == "PATH" and variables[name] is None:
+            raise UnsupportedScriptError(word)
+
+
+def source(
+    line: str, words: list[str], variables: dict[str, str | None], depth: int
+) -> None:
+    if len(words) != 2 or any(c in line for c in ";&|"):
+        raise UnsupportedScriptError(line)
+    path = Path(expand(words[1], variables))
+    if not path.is_absolute():
+        raise UnsupportedScriptError(line)
+    if path.exists():
+        follow(path, variables, depth + 1)
+
+
+def run(
+    line: str,
+    words: list[str],
+    variables: dict[str, str | None],
+    depth: int,
+    *,
+    conditional: bool,
+) -> None:
+    """Follow the statement `line`, split into `words`"""
+    if words[0] in {"source", "."}:
+        # Sourcing a file that doesn't exist does nothing, so it doesn't
+        # matter whether it's conditional
+        if conditional and Path(expand(words[-1], variables)).exists():
+            raise UnsupportedScriptError(line)
+        source(line, words, variables, depth)
+    elif words[0] == "export" or all(map(ASSIGNMENT.fullmatch, words)):
+        assign(words, variables, conditional=conditional)
+    elif AFFECTS_PATH.search(line):
+        # eg. `VAR=value command`, or `source` after `;`
+        raise UnsupportedScriptError(line)
+
+
+def follow(path: Path, variables: dict[str, str | None], depth: int = 0) -> None:
+    """Update `variables` like sourcing the bash script `path` would"""
+    if depth > MAX_DEPTH:
+        raise UnsupportedScriptError(path)
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except (OSError, UnicodeDecodeError) as err:
+        raise UnsupportedScriptError(path) from err
+
+    blocks = 0
+    in_function = False
+    for line in map(str.strip, lines):
+        if in_function:
+            # Assumes that functions end with a lone '}', like the
+            # `disable_komodo` of komodo's enable
+            in_function = line != "}"
+            continue
+        if FUNCTION.fullmatch(line):
+            in_function = True
+            continue
+        try:
+            words = shlex.split(line, comments=True)
+        except ValueError as err:
+            raise UnsupportedScriptError(line) from err
+        if not words:
+            continue
+
+        run(line, words, variables, depth, conditional=blocks > 0)
+        blocks += sum(word in BLOCK_START for word in words)
+        blocks -= sum(word.rstrip(";") in BLOCK_END for word in words)
+
+
+def find_python(enable: Path) -> Path | None:
+    """The `python` that is first in PATH after sourcing `enable`, like
+    `source enable; which python`, or None if that can't be found statically"""
+    variables: dict[str, str | None] = {**os.environ, "PATH": INHERITED}
+    try:
+        follow(enable, variables)
+    except UnsupportedScriptError:
+        return None
+
+    for directory in variables["PATH"].split(":"):
+        if not directory or INHERITED in directory:
+            return None
+        python = Path(directory) / "python"
+        if python.is_file() and os.access(python, os.X_OK):
+            return python
+    return None
+
+
+def python_version(root: Path) -> tuple[int, int] | None:
+    """Major and minor version of the interpreter in a komodo release's `root`,
+    from the names of the symlinks behind root/bin/python, from pyvenv.cfg or
+    from the name of root/lib/pythonX.Y, or None if it can't be determined"""
+    path = root / "bin" / "python"
+    for _ in range(MAX_DEPTH):
+        match = VERSION.fullmatch(path.name)
+        if match is not None:
+            return int(match[1]), int(match[2])
+        try:
+            path = path.parent / path.readlink()
+        except OSError:
+            break
+
+    try:
+        with open(root / "pyvenv.cfg", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                if key.strip() in {"version", "version_info"}:
+                    major, minor = value.strip().split(".")[:2]
+                    return int(major), int(minor)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        versions = {
+            (int(match[1]), int(match[2]))
+            for match in (VERSION.fullmatch(p.name) for p in (root / "lib").iterdir())
+            if match is not None
+        }
+    except OSError:
+        return None
+    return versions.pop() if len(versions) == 1 else None
@@ -3,6 +3,28 @@ import os
 from pathlib import Path
 from subprocess import PIPE, Popen
 
+from komodoenv.cache import Cache
+
+# Collects everything komodoenv needs to know about an interpreter, so that
+# it only has to be started once.
+INTROSPECT_SCRIPT = b"""\
+import json, sys, sysconfig
+print(json.dumps({
+    "version_info": sys.version_info[:],
+    "path": sys.path,
+    "prefix": sys.prefix,
+    "sysconfig_paths": sysconfig.get_paths(),
+    "abi_tag": sysconfig.get_config_var("SOABI"),
+}))
+"""
+
+# Introspection results of the interpreters that have been detected by this
+# process, keyed by `Python.identity`
+_detected = {}
+
+# Maximum number of interpreters to remember in the on-disk cache
+CACHE_MAX_ENTRIES = 32
+
 
 class Python:
     def __init__(self, executable, komodo_prefix=None):
@@ -17,24 +39,60 @@ class Python:
 
         self.root = self.executable.parent.parent
         self.version_info = None
+        self.site_paths = None
+        self.prefix = None
+        self.sysconfig_paths = None
+        self.abi_tag = None
 
     def make_dst(self, executable):
         py = Python(executable, self.komodo_prefix)
         py.version_info = self.version_info
+        py.abi_tag = self.abi_tag
         return py
 
+    @property
+    def identity(self):
+        """Key identifying this interpreter. The executable itself is not
+        resolved, because a venv's interpreter is a symlink to its base."""
+        executable = Path(
+            os.path.realpath(self.executable.parent), self.executable.name
+        )
+        return f"{executable}:{self.komodo_prefix}"
+
+    @property
+    def cache_key(self):
+        """Key for the on-disk cache, or None if the executable doesn't exist.
+        Komodo releases are immutable, so the identity of the actual
+        interpreter binary is enough to know that it hasn't changed."""
+        try:
+            st = self.executable.stat()
+        except OSError:
+            return None
+        realpath = os.path.realpath(self.executable)
+        return f"{self.identity}:{realpath}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
     def detect(self):
         """Detects what type of Python installation this is"""
-        # Get python version_info
-        script = b"import sys,json;print(json.dumps(sys.version_info[:]))"
-        env = {
-            "LD_LIBRARY_PATH": f"{self.komodo_prefix}/lib64:{self.komodo_prefix}/lib",
-        }
-        self.version_info = tuple(json.loads(self.call(script=script, env=env)))
-
-        # Get python sys.path
-        script = b"import sys,json;print(json.dumps(sys.path))"
-        self.site_paths = json.loads(self.call(script=script, env=env))
+        info = _detected.get(self.identity)
+        if info is None:
+            cache = Cache("python", max_entries=CACHE_MAX_ENTRIES)
+            key = self.cache_key
+            if key is not None:
+                info = cache.get(key)
+            if info is None:
+                env = {
+                    "LD_LIBRARY_PATH": f"{self.komodo_prefix}/lib64:{self.komodo_prefix}/lib",
+                }
+                info = json.loads(self.call(script=INTROSPECT_SCRIPT, env=env))
+                if key is not None:
+                    cache.put(key, info)
+            _detected[self.identity] = info
+
+        self.version_info = tuple(info["version_info"])
+        self.site_paths = info["path"]
+        self.prefix = info["prefix"]
+        self.sysconfig_paths = info["sysconfig_paths"]
+        self.abi_tag = info["abi_tag"]
 
     @property
     def site_packages_path(self):
@@ -36,10 +36,7 @@ class _Statfs(Structure):
     )
 
 
-def _test_fs_type(path, f_type):
-    if sys.platform != "linux":
-        return None
-
+def _statfs(path):
     path = Path(path)
     while not path.is_dir():
         path = path.parent
@@ -49,7 +46,14 @@ def _test_fs_type(path, f_type):
 
     libc.statfs(create_string_buffer(str(path).encode("utf-8")), byref(stat))
 
-    return stat.f_type == f_type
+    return stat
+
+
+def _test_fs_type(path, f_type):
+    if sys.platform != "linux":
+        return None
+
+    return _statfs(path).f_type == f_type
 
 
 def is_tmpfs(path):
@@ -60,3 +64,14 @@ def is_tmpfs(path):
 def is_nfs(path):
     """Test if `path` is on a `nfs` filesystem."""
     return _test_fs_type(path, _NFS_SUPER_MAGIC)
+
+
+def same_filesystem(path1, path2):
+    """Test if `path1` and `path2` are on the same filesystem, ie. whether files
+    may be hardlinked or reflinked between them."""
+    if sys.platform != "linux":
+        return None
+
+    stat1 = _statfs(path1)
+    stat2 = _statfs(path2)
+    return (stat1.f_type, stat1.f_fsid) == (stat2.f_type, stat2.f_fsid)
@@ -0,0 +1,106 @@
+"""Run the steps of creating a komodoenv on a thread pool, each as soon as the
+steps it depends on are done.
+
+Steps spend most of their time waiting for subprocesses and the filesystem, so
+threads suffice. Lines printed with `echo` by a step are held back until all
+steps added before it have finished, so that the progress reads the same as if
+the steps had run one after another.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+# Lines held back by the step running on the current thread, if any
+_output = threading.local()
+
+
+def echo(line: str) -> None:
+    """Print `line`, or hold it back if called from a step of a `TaskGraph`"""
+    buffer = getattr(_output, "buffer", None)
+    if buffer is None:
+        print(line)
+    else:
+        buffer.append(line)
+
+
+class TaskGraph:
+    """Steps and the steps each of them depends on. Dependencies must be added
+    before the steps that depend on them, so that the order in which steps are
+    added is one in which they could run serially."""
+
+    def __init__(self) -> None:
+        self._tasks: dict[str, tuple[Callable[[], object], tuple[str, ...]]] = {}
+
+    def add(
+        self, name: str, func: Callable[[], object], *, after: tuple[str, ...] = ()
+    ) -> None:
+        """Add the step `name`, which runs `func` once the steps `after` are
+        done"""
+        if name in self._tasks:
+            msg = f"Step '{name}' was already added"
+            raise ValueError(msg)
+        unknown = [dep for dep in after if dep not in self._tasks]
+        if unknown:
+            msg = f"Step '{name}' depends on unknown steps: {', '.join(unknown)}"
+            raise ValueError(msg)
+        self._tasks[name] = (func, after)
+
+    def _ready(self, started: dict[str, list[str]], done: set[str]) -> list[str]:
+        """The steps that can be started"""
+        return [
+            name
+            for name, (_, after) in self._tasks.items()
+            if name not in started and all(dep in done for dep in after)
+        ]
+
+    def _call(self, name: str, buffer: list[str]) -> None:
+        _output.buffer = buffer
+        try:
+            self._tasks[name][0]()
+        finally:
+            _output.buffer = None
+
+    def run(self) -> None:
+        """Run all steps. If a step raises, no more steps are started, and the
+        exception is re-raised once the running ones have finished."""
+        names = list(self._tasks)
+        outputs: dict[str, list[str]] = {}
+        done: set[str] = set()
+        running: dict[Future, str] = {}
+        error: BaseException | None = None
+        printed = 0
+
+        # No more steps than this can run at once anyway
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+            while True:
+                for name in self._ready(outputs, done) if error is None else []:
+                    outputs[name] = []
+                    running[executor.submit(self._call, name, outputs[name])] = name
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is None:
+                        done.add(name)
+                    elif error is None:
+                        error = future.exception()
+
+                while printed < len(names) and names[printed] in done:
+                    print(
+                        "".join(f"{line}\n" for line in outputs[names[printed]]), end=""
+                    )
+                    printed += 1
+
+        if error is not None:
+            # Show how far the steps that didn't finish got
+            for name in names[printed:]:
+                print("".join(f"{line}\n" for line in outputs.get(name, [])), end="")
+            raise error
@@ -8,13 +8,19 @@ to avoid any dependency on komodo during the update.
 """
 
 import contextlib
+import fcntl
+import hashlib
+import json
 import os
 import platform
 import re
+import shlex
 import shutil
 import subprocess
 import sys
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from textwrap import dedent
 from typing import Dict, List, Optional, Tuple
@@ -42,6 +48,72 @@ except ImportError:
         sys.stderr.write("Warning: komodoenv is only compatible with RHEL7 or RHEL8")
 
 
+# Name of the file next to komodoenv.conf with the settings that are changed by
+# hand rather than by updates, like auto-update. komodoenv.conf is replaced by
+# every update and rollback, this file is left alone. See `read_config`.
+SETTINGS_FILE = "komodoenv.settings"
+
+# Name of the file next to komodoenv.conf which caches the state of the tracked
+# release as of the last check. See `release_stamp`.
+STAMP_FILE = "komodoenv.stamp"
+
+# Name of the file next to komodoenv.conf which records how each shim was
+# generated. See `update_bins`.
+SHIMS_MANIFEST = "komodoenv.shims.json"
+
+# Name of the file next to komodoenv.conf which records which komodo release
+# the config directories were last synced from. See `copy_config_dirs`.
+SYNC_STATE = "komodoenv.sync.json"
+
+# Name of the file next to komodoenv.conf which tells the lazy shims' dispatcher
+# where to find each komodo executable, and the name of the dispatcher in
+# root/shims. See `update_lazy_bins`.
+SHIMS_TABLE = "komodoenv.shims.table"
+DISPATCHER = ".komodoenv-dispatch"
+
+# Name of the file next to komodoenv.conf which is locked while updating. See
+# `update_lock`.
+LOCK_FILE = "komodoenv.lock"
+
+# Name of the file next to komodoenv.conf which caches the distributions
+# installed in komodo releases, and how many releases to remember there. See
+# `dist_info_index`.
+PKG_INDEX = "komodoenv.pkgindex.json"
+PKG_INDEX_MAX_ENTRIES = 4
+
+# Path of the index of the releases in a komodo root, relative to the root, and
+# the version of its format. It's kept in a subdirectory so that writing it
+# doesn't change the mtime of the root, by which its freshness is judged. See
+# `index_releases`.
+RELEASE_INDEX = ".komodoenv/index.json"
+RELEASE_INDEX_VERSION = 2
+
+# Name of the file next to komodoenv.conf to which a background update writes
+# its output, and how many seconds to wait before starting another background
+# update if the last one didn't finish. See `start_background_update`.
+UPDATE_LOG = "komodoenv.update.log"
+UPDATE_RETRY = 3600
+
+# Name of the directory next to komodoenv.conf which holds the generations of
+# the files an update replaces, the pattern of their names and the generation
+# that the files from before generations were introduced are moved to. See
+# `switch_generation`.
+GENERATIONS = "komodoenv.generations"
+GENERATION_NAME = re.compile(r"gen-(\d+)")
+LEGACY_GENERATION = "gen-0"
+
+# Environment variable naming a file to which the timings of each phase of
+# komodoenv and komodoenv-update are appended as JSON lines. See `Timings`.
+TIMINGS_ENV = "KOMODOENV_TIMINGS"
+
+# How much of a komodo release's `enable` script is read at a time when looking
+# for its CUSTOM_COORDINATE. See `ReleaseResolver`.
+ENABLE_PROBE_CHUNK = 4096
+
+# Number of bytes to read from the start of an executable to check for a
+# shebang. Linux itself doesn't look any further than this.
+SHEBANG_MAX = 256
+
 ENABLE_BASH = """\
 disable_komodo () {{
     if [[ -v _PRE_KOMODO_PATH ]]; then
@@ -78,7 +150,7 @@ disable_komodo preserve_disable_komodo
 export KOMODO_RELEASE={komodoenv_prefix}
 
 export _PRE_KOMODO_PATH="$PATH"
-export PATH={komodoenv_prefix}/root/bin:{komodoenv_prefix}/root/shims${{PATH:+:${{PATH}}}}
+export PATH={komodoenv_prefix}/root/bin:{shims_path}${{PATH:+:${{PATH}}}}
 
 export _PRE_KOMODO_MANPATH="${{MANPATH:-}}"
 export MANPATH={komodoenv_prefix}/root/share/man:{komodo_prefix}/root/share/man${{MANPATH:+:${{MANPATH}}}}
@@ -106,7 +178,7 @@ then
     cat {komodo_prefix}/motd/messages/*
 fi
 
-{komodoenv_prefix}/root/bin/komodoenv-update --check
+{update_check}
 """
 
 
@@ -126,9 +198,9 @@ disable_komodo preserve_disable_komodo
 
 if $?PATH then
     setenv _PRE_KOMODO_PATH "$PATH"
-    setenv PATH {komodoenv_prefix}/root/bin:{komodoenv_prefix}/root/shims:$PATH
+    setenv PATH {komodoenv_prefix}/root/bin:{shims_path}:$PATH
 else
-    setenv PATH {komodoenv_prefix}/root/bin:{komodoenv_prefix}/root/shims
+    setenv PATH {komodoenv_prefix}/root/bin:{shims_path}
 endif
 
 if $?MANPATH then
@@ -167,15 +239,34 @@ if ( -d {komodo_prefix}/motd/messages ) then
     cat {komodo_prefix}/motd/messages/*
 endif
 
-{komodoenv_prefix}/root/bin/komodoenv-update --check
+{update_check}
 """
 
 
-def read_config() -> Dict[str, str]:
-    with open(Path(__file__).parents[2] / "komodoenv.conf", encoding="utf-8") as f:
-        lines = f.readlines()
+UPDATE_CHECK = "{komodoenv_prefix}/root/bin/komodoenv-update --check"
+
+
+# Only start Python to check for updates if the tracked release has been
+# repointed or modified since the last check. Both '-ef' and '-nt' are
+# builtins, so the common case doesn't fork at all.
+UPDATE_CHECK_BASH = """\
+if [ ! {tracked_release} -ef {tracked_target} ] || [ ! {komodoenv_prefix}/{stamp} -nt {tracked_release} ]; then
+    {komodoenv_prefix}/root/bin/komodoenv-update --check
+fi"""
+
+
+UPDATE_CHECK_CSH = """\
+set _komodoenv_fresh = 0
+test {tracked_release} -ef {tracked_target} && test {komodoenv_prefix}/{stamp} -nt {tracked_release} && set _komodoenv_fresh = 1
+if ( $_komodoenv_fresh == 0 ) then
+    {komodoenv_prefix}/root/bin/komodoenv-update --check
+endif
+unset _komodoenv_fresh"""
+
+
+def parse_config(text: str) -> Dict[str, str]:
     config = {}
-    for line in lines:
+    for line in text.splitlines():
         try:
             split_at = line.index("=")
         except ValueError:
@@ -184,6 +275,43 @@ def read_config() -> Dict[str, str]:
             key = line[:split_at].strip()
             val = line[split_at + 1 :].strip()
             config[key] = val
+    return config
+
+
+def read_config_file(path: Path) -> Dict[str, str]:
+    """Parse the config file at `path`. The parsed file is remembered for as
+    long as it isn't replaced or modified."""
+    try:
+        st = path.stat()
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        key = None
+
+    cached = _configs.get(str(path))
+    if key is not None and cached is not None and cached[0] == key:
+        return dict(cached[1])
+    with open(path, encoding="utf-8") as f:
+        config = parse_config(f.read())
+    if key is not None:
+        _configs[str(path)] = (key, dict(config))
+    return config
+
+
+def read_settings(prefix: Path) -> Dict[str, str]:
+    """Read `SETTINGS_FILE`, or nothing if the komodoenv doesn't have one"""
+    try:
+        return read_config_file(prefix / SETTINGS_FILE)
+    except FileNotFoundError:
+        return {}
+
+
+def read_config(prefix: Optional[Path] = None) -> Dict[str, str]:
+    """Read komodoenv.conf, with the settings in `SETTINGS_FILE` taking
+    precedence over it."""
+    if prefix is None:
+        prefix = Path(__file__).parents[2]
+    config = read_config_file(prefix / "komodoenv.conf")
+    config.update(read_settings(prefix))
 
     if "komodo-root" not in config:
         config["komodo-root"] = (
@@ -193,6 +321,19 @@ def read_config() -> Dict[str, str]:
     return config
 
 
+# Configs parsed by `read_config_file`, keyed by path, with the inode, size and
+# mtime of the file they were parsed from
+_configs = {}  # type: Dict[str, Tuple[Tuple[int, int, int], Dict[str, str]]]
+
+# Indices built by `dist_info_index`, keyed by site-packages directory
+_pkg_indices = {}  # type: Dict[str, dict]
+
+# Number of files opened, directories listed and processes spawned by this
+# process, counted once `Timings` has installed an audit hook
+_audit_counts = {"files_opened": 0, "dirs_listed": 0, "subprocesses": 0}
+_audit_installed = False
+
+
 def rhel_version_suffix() -> str:
     """
     Return the current running RHEL version as "-rhelX" where X is the major
@@ -221,7 +362,42 @@ def check_same_distro(config: Dict[str, str]) -> bool:
     return False
 
 
-def copy_config_dirs(config: Dict[str, str]) -> None:
+def sync_tree(src: Path, dst: Path) -> None:
+    """Recursively copy the entries of `src` which don't exist in `dst`,
+    preserving symlinks, permissions and times. Equivalent to
+    `rsync -a --ignore-existing src/ dst`.
+    """
+    created = not dst.is_dir()
+    if created:
+        dst.mkdir()
+    with os.scandir(str(src)) as it:
+        for entry in it:
+            target = dst / entry.name
+            if entry.is_symlink():
+                if not os.path.lexists(str(target)):
+                    # Path.readlink requires Python 3.9
+                    target.symlink_to(os.readlink(entry.path))  # noqa: PTH115
+            elif entry.is_dir():
+                sync_tree(Path(entry.path), target)
+            elif not os.path.lexists(str(target)):
+                shutil.copy2(entry.path, str(target))
+    if created:
+        shutil.copystat(str(src), str(dst))
+
+
+def sync_config_tree(src: Path, dst: Path, state: Dict[str, str]) -> None:
+    """Sync `src` to `dst` unless it was already synced from the same komodo
+    release, as recorded in `state`. Komodo releases are immutable, so the
+    resolved path and mtime of `src` is enough to tell.
+    """
+    fingerprint = f"{os.path.realpath(str(src))}:{src.stat().st_mtime_ns}"
+    if state.get(str(dst)) == fingerprint and dst.is_dir():
+        return
+    sync_tree(src, dst)
+    state[str(dst)] = fingerprint
+
+
+def copy_config_dirs(config: Dict[str, str], prefix: Optional[Path] = None) -> None:
     """
     Notebook 7 does not play well with komodoenv, and so we need to copy the
     data and config dirs from the komodo release.
@@ -232,7 +408,13 @@ def copy_config_dirs(config: Dict[str, str]) -> None:
     srcpath = Path(config["komodo-root"]) / config["current-release"] / "root"
     if not srcpath.is_dir():
         srcpath = Path(str(srcpath.parent) + rhel_version_suffix()) / "root"
-    dstpath = Path(__file__).resolve().parents[1]
+    if prefix is None:
+        prefix = Path(__file__).resolve().parents[2]
+    dstpath = prefix / "root"
+    state_path = prefix / SYNC_STATE
+    state = read_json(state_path)
+    old_state = dict(state)
+
     notebook_version = get_pkg_version(config, srcpath, "notebook")
     src_share_jupyter = srcpath / "share" / "jupyter"
     src_etc_jupyter = srcpath / "etc" / "jupyter"
@@ -247,61 +429,339 @@ def copy_config_dirs(config: Dict[str, str]) -> None:
         dst_etc.mkdir(exist_ok=True)
         dst_share.mkdir(exist_ok=True)
         try:
-            subprocess.run(
-                ["rsync", "-a", "--ignore-existing", src_share_jupyter, dst_share],
-                check=True,
-            )
-            subprocess.run(
-                ["rsync", "-a", "--ignore-existing", src_etc_jupyter, dst_etc],
-                check=True,
-            )
-        except subprocess.CalledProcessError as err:
+            sync_config_tree(src_share_jupyter, dst_share / "jupyter", state)
+            sync_config_tree(src_etc_jupyter, dst_etc / "jupyter", state)
+        except OSError as err:
             print(f"An error occurred when fixing up jupyter environment: \n{err}")
             print("'Jupyter' may not work as intended in the komodoenv.")
     if src_share_rips.is_dir():
         dst_share.mkdir(exist_ok=True)
         try:
-            subprocess.run(
-                ["rsync", "-a", "--ignore-existing", src_share_rips, dst_share],
-                check=True,
-            )
-        except subprocess.CalledProcessError as err:
+            sync_config_tree(src_share_rips, dst_share / "rips", state)
+        except OSError as err:
             print(f"An error occurred when fixing up rips config: \n{err}")
             print("'rips' may not work as intended in the komodoenv.")
 
+    if state != old_state:
+        with contextlib.suppress(OSError):
+            write_atomic(state_path, json.dumps(state).encode("utf-8"))
+
+
+def dist_info_index(pkgdir: Path) -> Dict[str, str]:
+    """Map the name of every distribution in `pkgdir` to its version, using a
+    single scan of the directory. This format is defined in PEP 376 "Database
+    of Installed Python Distributions".
+
+    Indices are remembered for the lifetime of the process and, when running
+    from inside a komodoenv, persisted next to komodoenv.conf. They're keyed on
+    the mtime of `pkgdir`, which changes whenever a distribution is added or
+    removed.
+    """
+    st = pkgdir.stat()
+    key = str(pkgdir)
+    cached = _pkg_indices.get(key)
+    if cached is not None and cached["mtime"] == st.st_mtime_ns:
+        return cached["packages"]
+
+    prefix = Path(__file__).parents[2]
+    persist = (prefix / "komodoenv.conf").is_file()
+    stored = read_json(prefix / PKG_INDEX) if persist else {}
+    cached = stored.get(key)
+    if cached is not None and cached.get("mtime") == st.st_mtime_ns:
+        _pkg_indices[key] = cached
+        return cached["packages"]
+
+    packages = {}  # type: Dict[str, str]
+    with os.scandir(str(pkgdir)) as it:
+        for entry in it:
+            if not entry.name.endswith(".dist-info"):
+                continue
+            name, sep, version = entry.name[: -len(".dist-info")].partition("-")
+            if sep and (name not in packages or packages[name] < version):
+                packages[name] = version
+
+    cached = {"mtime": st.st_mtime_ns, "packages": packages}
+    _pkg_indices[key] = cached
+    if persist:
+        # Only the current and tracked releases are of interest
+        stored = {k: v for k, v in stored.items() if k != key}
+        stored = dict(list(stored.items())[-(PKG_INDEX_MAX_ENTRIES - 1) :])
+        stored[key] = cached
+        with contextlib.suppress(OSError):
+            write_atomic(prefix / PKG_INDEX, json.dumps(stored).encode("utf-8"))
+    return packages
+
 
 def get_pkg_version(
     config: Dict[str, str],
     srcpath: Path,
     package: str = "komodoenv",
 ) -> Optional[str]:
-    """Locate `package`'s version in the current komodo distribution. This format is
-    defined in PEP 376 "Database of Installed Python Distributions".
+    """Locate `package`'s version in the current komodo distribution.
 
     Returns None if package wasn't found.
     """
     pkgdir = srcpath / "lib" / ("python" + config["python-version"]) / "site-packages"
-    pattern = re.compile(f"^{package}-(.+).dist-info")
 
-    if not pkgdir.is_dir():
+    try:
+        return dist_info_index(pkgdir).get(package)
+    except (FileNotFoundError, NotADirectoryError):
         return None
-    matches = []
-    for entry in pkgdir.iterdir():
-        match = pattern.match(entry.name)
-        if match is not None:
-            matches.append(match[1])
-    if len(matches) > 0:
-        return max(matches)
-    return None
 
 
-def can_update(config: Dict[str, str]) -> bool:
+def read_release_index(root: Path) -> Optional[dict]:
+    """The `index_releases` of `root`, or None if there is none or it's older
+    than the last change to the root"""
+    index = read_json(root / RELEASE_INDEX)
+    if index.get("version") != RELEASE_INDEX_VERSION:
+        return None
+    try:
+        mtime = root.stat().st_mtime_ns
+    except OSError:
+        return None
+    return index if index.get("mtime") == mtime else None
+
+
+class ReleaseResolver:
+    """Resolves komodo release names to release directories.
+
+    The result of every symlink resolution, directory check and read of an
+    `enable` file is remembered for the lifetime of the resolver, so that
+    resolving the same releases repeatedly during one invocation only touches
+    the filesystem once. `stats` counts the filesystem operations that were
+    actually performed.
+
+    If the komodo root has a fresh `index_releases`, the releases in it are
+    resolved with a single stat of the release directory each.
+    """
+
+    def __init__(self, rhel_suffix: Optional[str] = None, *, use_index=True) -> None:
+        self.rhel_suffix = rhel_suffix
+        self.stats = {
+            "resolve": 0,
+            "is_dir": 0,
+            "open": 0,
+            "bytes_read": 0,
+            "hits": 0,
+            "indices": 0,
+            "stat": 0,
+        }
+        self._resolved = {}  # type: Dict[str, Path]
+        self._is_dir = {}  # type: Dict[str, bool]
+        self._coordinates = {}  # type: Dict[str, str]
+        self._indices = {}  # type: Dict[str, Optional[dict]]
+        self.use_index = use_index
+
+    def _from_index(self, path: Path) -> None:
+        """Fill the caches with what the release index of the parent of `path`
+        says about it, if the parent has a fresh index and the release hasn't
+        changed since it was indexed"""
+        path = Path(path)
+        if not path.is_absolute():  # Eg. Path() for a release that wasn't found
+            return
+        root = str(path.parent)
+        if root not in self._indices:
+            index = read_release_index(path.parent) if self.use_index else None
+            self._indices[root] = index
+            if index is not None:
+                self.stats["indices"] += 1
+                # The root may be reached through symlinks or resolved
+                self._indices.setdefault(index["root"], index)
+        index = self._indices[root]
+        if index is None:
+            return
+
+        info = index["releases"].get(path.name)
+        if info is None:
+            # Not in the root, so there's no need to look
+            target = os.path.join(index["root"], path.name)  # noqa: PTH118
+            self._resolved[str(path)] = Path(target)
+            self._is_dir[target + "/root"] = False
+            return
+        target = info["target"]
+        try:
+            fresh = Path(target).stat().st_mtime_ns == info["mtime"]
+        except OSError:
+            fresh = False
+        self.stats["stat"] += 1
+        if not fresh:  # Eg. root/ was added to the release after indexing
+            return
+        self._resolved[str(path)] = Path(target)
+        self._is_dir[target + "/root"] = info["has-root"]
+        self._coordinates[target] = info["custom-coordinate"]
+
+    def resolve(self, path: Path) -> Path:
+        key = str(path)
+        if key not in self._resolved:
+            self._from_index(path)
+        if key in self._resolved:
+            self.stats["hits"] += 1
+        else:
+            self.stats["resolve"] += 1
+            self._resolved[key] = Path(path).resolve()
+        return self._resolved[key]
+
+    def is_dir(self, path: Path) -> bool:
+        key = str(path)
+        if key not in self._is_dir and Path(path).name == "root":
+            self._from_index(Path(path).parent)
+        if key in self._is_dir:
+            self.stats["hits"] += 1
+        else:
+            self.stats["is_dir"] += 1
+            self._is_dir[key] = Path(path).is_dir()
+        return self._is_dir[key]
+
+    def _read_custom_coordinate(self, enable: Path) -> Optional[str]:
+        """Look for CUSTOM_COORDINATE in the `enable` script, reading no further
+        than the end of the line which sets it"""
+        try:
+            f = open(str(enable), "rb")  # noqa: SIM115
+        except OSError:
+            return None
+        self.stats["open"] += 1
+
+        data = b""
+        with f:
+            while True:
+                chunk = f.read(ENABLE_PROBE_CHUNK)
+                self.stats["bytes_read"] += len(chunk)
+                data += chunk
+                start = data.find(b"CUSTOM_COORDINATE=")
+                end = data.find(b"\n", start) if start >= 0 else -1
+                if start >= 0 and (end >= 0 or not chunk):
+                    line = data[start : end if end >= 0 else None].decode(
+                        "utf-8", "replace"
+                    )
+                    value = line.strip().split("CUSTOM_COORDINATE=")[1]
+                    return "-" + value.strip('"').strip("-")
+                if not chunk:
+                    return None
+
+    def custom_coordinate(self, release_path: Path) -> str:
+        key = str(release_path)
+        if key not in self._coordinates:
+            self._from_index(release_path)
+        if key in self._coordinates:
+            self.stats["hits"] += 1
+            return self._coordinates[key]
+
+        coordinate = self._read_custom_coordinate(release_path / "enable")
+        if coordinate is None:
+            parts = release_path.name.split("-")
+            possible_custom_coordinate = parts[-1]
+            coordinate = ""
+            if len(parts) > 1 and not any(
+                possible_custom_coordinate.startswith(token) for token in ("py", "rhel")
+            ):
+                coordinate = f"-{possible_custom_coordinate}"
+
+        self._coordinates[key] = coordinate
+        return coordinate
+
+    def tracked_release(self, tracked_release: Path) -> Path:
+        """Find the directory of the release that `tracked_release` refers to,
+        taking the RHEL version and custom coordinate into account.
+
+        Returns Path() if no such release exists.
+        """
+        if not self.rhel_suffix:
+            self.rhel_suffix = rhel_version_suffix()
+
+        custom_coordinate = self.custom_coordinate(tracked_release)
+        detected_python_version = ""
+        parts = Path(tracked_release).name.split("-")
+        abs_path = Path(tracked_release).parent
+        base_release = f"{abs_path}/{parts[0]}"
+        for p in parts:
+            if re.match(r"^(?:\d{8}|\d{4})$", p):
+                base_release += f"-{p}"
+            elif p.startswith("py"):
+                detected_python_version = f"-{p}"
+
+        rhel_suffix = self.rhel_suffix
+        for rp in [
+            f"{base_release}{detected_python_version}{rhel_suffix}{custom_coordinate}",
+            f"{base_release}{detected_python_version}{rhel_suffix}",
+            f"{base_release}{detected_python_version}{custom_coordinate}",
+            f"{base_release}{detected_python_version}",
+        ]:
+            possible_root_release = self.resolve(Path(rp))
+            if self.is_dir(possible_root_release / "root"):
+                return possible_root_release
+
+        return Path()
+
+
+def release_info(path: Path, resolver: ReleaseResolver) -> Optional[dict]:
+    """What `ReleaseResolver` needs to know about the release `path`, for the
+    index"""
+    target = path.resolve()
+    try:
+        # Before looking inside, so that changes while indexing are noticed
+        mtime = target.stat().st_mtime_ns
+    except OSError:  # Eg. a dangling symlink
+        return None
+    if not target.is_dir():  # Eg. a README
+        return None
+    python = re.search(r"-py(\d)(\d+)", target.name)
+    rhel_suffix = re.search(r"-rhel\d+", target.name)
+    return {
+        "target": str(target),
+        "mtime": mtime,
+        "has-root": (target / "root").is_dir(),
+        "custom-coordinate": resolver.custom_coordinate(target),
+        "python": f"{python[1]}.{python[2]}" if python else None,
+        "rhel-suffix": rhel_suffix[0] if rhel_suffix else "",
+    }
+
+
+def index_releases(root: Path, *, jobs: int = 1) -> dict:
+    """Write an index of the releases in the komodo root `root`, with where
+    each of them resolves to and what's needed to find the release tracked by
+    it. `ReleaseResolver` uses the index as long as no release has been added,
+    removed or relinked since, ie. as long as the mtime of `root` is unchanged,
+    and uses the entry of a release as long as the mtime of its directory is
+    unchanged, eg. its root/ hasn't been created since.
+    """
+    (root / RELEASE_INDEX).parent.mkdir(exist_ok=True)
+    resolver = ReleaseResolver(use_index=False)
+    mtime = None
+    # Scan until the root doesn't change while scanning it
+    for _ in range(3):
+        before = root.stat().st_mtime_ns
+        with os.scandir(str(root)) as it:
+            names = sorted(entry.name for entry in it if not entry.name.startswith("."))
+        infos = map_jobs(
+            lambda name: (name, release_info(root / name, resolver)), names, jobs
+        )
+        if root.stat().st_mtime_ns == before:
+            mtime = before
+            break
+
+    index = {
+        "version": RELEASE_INDEX_VERSION,
+        "root": str(root.resolve()),
+        "mtime": mtime,
+        "releases": {name: info for name, info in infos if info},
+    }
+    write_atomic(root / RELEASE_INDEX, json.dumps(index, indent=1).encode("utf-8"))
+    return index
+
+
+def can_update(
+    config: Dict[str, str], resolver: Optional[ReleaseResolver] = None
+) -> bool:
     """Compares the version of komodoenv that built the release with the one in the
     one we want to update to. If the major versions are the same, we know the
     layout is identical, and can be safely updated with this script.
     """
-    track_path = (Path(config["komodo-root"]) / config["tracked-release"]).resolve()
-    track_path = get_tracked_release(track_path)
+    if resolver is None:
+        resolver = ReleaseResolver()
+    track_path = resolver.resolve(
+        Path(config["komodo-root"]) / config["tracked-release"]
+    )
+    track_path = resolver.tracked_release(track_path)
     version = get_pkg_version(config, track_path / "root")
     if "komodoenv-version" not in config or version is None:
         return False
@@ -312,73 +772,77 @@ def can_update(config: Dict[str, str]) -> bool:
     return current_maj == updated_maj
 
 
-def write_config(config: Dict[str, str]):
-    with open(Path(__file__).parents[2] / "komodoenv.conf", "w", encoding="utf-8") as f:
-        f.writelines(f"{key} = {val}\n" for key, val in config.items())
+def write_config(config: Dict[str, str], prefix: Optional[Path] = None):
+    if prefix is None:
+        prefix = Path(__file__).parents[2]
+    data = "".join(f"{key} = {val}\n" for key, val in config.items())
+    write_atomic(prefix / "komodoenv.conf", data.encode("utf-8"))
+
+
+@contextlib.contextmanager
+def lock_file(path: Path, *, blocking: bool = True, shared: bool = False):
+    """Advisory lock on the file at `path`, which is created if needed. Yields
+    False if `blocking` is False and another process holds the lock. If the
+    file can't be created, eg. because its directory belongs to someone else,
+    proceeds without locking.
+    """
+    try:
+        fd = os.open(str(path), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    except OSError:
+        yield True
+        return
+
+    try:
+        try:
+            fcntl.flock(
+                fd,
+                (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                | (0 if blocking else fcntl.LOCK_NB),
+            )
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def update_lock(prefix: Path, *, blocking: bool = True):
+    """Advisory lock around updating the komodoenv at `prefix`, so that
+    concurrent komodoenv-update processes, eg. from parallel LSF jobs, don't
+    interleave their work. See `lock_file`.
+    """
+    with lock_file(prefix / LOCK_FILE, blocking=blocking) as locked:
+        yield locked
 
 
 def get_tracked_release(
-    tracked_release: Path, rhel_suffix: Optional[str] = None
+    tracked_release: Path,
+    rhel_suffix: Optional[str] = None,
+    resolver: Optional[ReleaseResolver] = None,
 ) -> Path:
-    if not rhel_suffix:
-        rhel_suffix = rhel_version_suffix()
-
-    custom_coordinate = find_custom_coordinate(tracked_release)
-    detected_python_version = ""
-    parts = Path(tracked_release).name.split("-")
-    abs_path = Path(tracked_release).parent
-    base_release = f"{abs_path}/{parts[0]}"
-    for p in parts:
-        if re.match(r"^(?:\d{8}|\d{4})$", p):
-            base_release += f"-{p}"
-        elif p.startswith("py"):
-            detected_python_version = f"-{p}"
-
-    for rp in [
-        f"{base_release}{detected_python_version}{rhel_suffix}{custom_coordinate}",
-        f"{base_release}{detected_python_version}{rhel_suffix}",
-        f"{base_release}{detected_python_version}{custom_coordinate}",
-        f"{base_release}{detected_python_version}",
-    ]:
-        possible_root_release = Path(rp).resolve()
-        if (possible_root_release / "root").is_dir():
-            return possible_root_release
-
-    return Path()
+    if resolver is None:
+        resolver = ReleaseResolver(rhel_suffix)
+    return resolver.tracked_release(tracked_release)
 
 
 def find_custom_coordinate(release_path: Path) -> str:
-    if (release_path / "enable").is_file():
-        with open(release_path / "enable", "r") as file:
-            for line in file:
-                if "CUSTOM_COORDINATE=" in line:
-                    custom_coordinate_value = (
-                        line.strip()
-                        .split("CUSTOM_COORDINATE=")[1]
-                        .strip('"')
-                        .strip("-")
-                    )
-                    return "-" + custom_coordinate_value
-
-    parts = release_path.name.split("-")
-    possible_custom_coordinate = parts[-1]
-    if len(parts) > 1 and not any(
-        possible_custom_coordinate.startswith(token) for token in ("py", "rhel")
-    ):
-        return f"-{possible_custom_coordinate}"
-    return ""
+    return ReleaseResolver().custom_coordinate(release_path)
 
 
-def current_track(config: Dict[str, str]) -> Dict[str, str]:
+def find_current(
+    config: Dict[str, str], resolver: Optional[ReleaseResolver] = None
+) -> Optional[Dict[str, str]]:
+    """Find the release that the tracked release currently points to, or None
+    if it doesn't exist"""
+    if resolver is None:
+        resolver = ReleaseResolver()
     path = Path(config["komodo-root"]) / config["tracked-release"]
 
-    tracked_release = get_tracked_release(path.resolve())
-    if not (tracked_release / "root").is_dir():
-        print(
-            f"Not able to find the tracked komodo release {config['tracked-release']}. Will not update.",
-            file=sys.stderr,
-        )
-        sys.exit(0)
+    tracked_release = resolver.tracked_release(resolver.resolve(path))
+    if not resolver.is_dir(tracked_release / "root"):
+        return None
     st = path.stat()
 
     return {
@@ -388,6 +852,19 @@ def current_track(config: Dict[str, str]) -> Dict[str, str]:
     }
 
 
+def current_track(
+    config: Dict[str, str], resolver: Optional[ReleaseResolver] = None
+) -> Dict[str, str]:
+    current = find_current(config, resolver)
+    if current is None:
+        print(
+            f"Not able to find the tracked komodo release {config['tracked-release']}. Will not update.",
+            file=sys.stderr,
+        )
+        sys.exit(0)
+    return current
+
+
 def should_update(config: Dict[str, str], current: Dict[str, str]) -> bool:
     return any(
         config[x] != current[x]
@@ -395,20 +872,102 @@ def should_update(config: Dict[str, str], current: Dict[str, str]) -> bool:
     )
 
 
-def enable_script(fmt: str, komodo_prefix: Path, komodoenv_prefix: Path) -> str:
-    return fmt.format(
-        komodo_prefix=str(komodo_prefix),
-        komodo_release=komodo_prefix.name,
-        komodoenv_prefix=str(komodoenv_prefix),
-        komodoenv_release=komodoenv_prefix.name,
-    )
-
+def release_stamp(config: Dict[str, str]) -> str:
+    """A cheap fingerprint of the tracked release: where the tracked symlink
+    points to, the mtime of its target and the release we're currently on.
+    Computing it costs a single readlink chain and a stat, as opposed to the
+    full `current_track` resolution.
 
-def update_enable_script(komodo_prefix: Path, komodoenv_prefix: Path) -> None:
-    with open(komodoenv_prefix / "enable", "w", encoding="utf-8") as f:
-        f.write(enable_script(ENABLE_BASH, komodo_prefix, komodoenv_prefix))
-    with open(komodoenv_prefix / "enable.csh", "w", encoding="utf-8") as f:
-        f.write(enable_script(ENABLE_CSH, komodo_prefix, komodoenv_prefix))
+    Returns "" if the tracked release doesn't exist.
+    """
+    path = Path(config["komodo-root"]) / config["tracked-release"]
+    try:
+        st = path.stat()
+    except OSError:
+        return ""
+    target = os.path.realpath(str(path))
+    return f"{target}\n{st.st_mtime}\n{config.get('current-release', '')}\n"
+
+
+def stamp_is_fresh(config: Dict[str, str], stamp_path: Path) -> bool:
+    """Returns True if nothing has changed since the stamp was last written"""
+    try:
+        with open(stamp_path, encoding="utf-8") as f:
+            stamp = f.read()
+    except OSError:
+        return False
+    return stamp != "" and stamp == release_stamp(config)
+
+
+def write_stamp(config: Dict[str, str], stamp_path: Path) -> None:
+    with contextlib.suppress(OSError), open(stamp_path, "w", encoding="utf-8") as f:
+        f.write(release_stamp(config))
+
+
+def enable_script(
+    fmt: str,
+    komodo_prefix: Path,
+    komodoenv_prefix: Path,
+    update_check: str = UPDATE_CHECK,
+    tracked_release: Optional[Path] = None,
+    shared_shims: Optional[Path] = None,
+) -> str:
+    """Format an enable script. If `tracked_release` is given, `update_check` is
+    the shell snippet which decides whether to run `komodoenv-update --check`,
+    otherwise the check is always run. `shared_shims` is the directory of shims
+    returned by `update_bins`, if any.
+    """
+    shims_path = str(komodoenv_prefix / "root" / "shims")
+    if shared_shims is not None:
+        shims_path += os.pathsep + str(shared_shims)
+    kwargs = {
+        "komodo_prefix": str(komodo_prefix),
+        "komodo_release": komodo_prefix.name,
+        "komodoenv_prefix": str(komodoenv_prefix),
+        "komodoenv_release": komodoenv_prefix.name,
+        "shims_path": shims_path,
+    }
+    if tracked_release is None:
+        update_check = UPDATE_CHECK
+    else:
+        kwargs.update(
+            tracked_release=str(tracked_release),
+            tracked_target=os.path.realpath(str(tracked_release)),
+            stamp=STAMP_FILE,
+        )
+    return fmt.format(update_check=update_check.format(**kwargs), **kwargs)
+
+
+def update_enable_script(
+    komodo_prefix: Path,
+    komodoenv_prefix: Path,
+    generation: Path,
+    tracked_release: Optional[Path] = None,
+    shared_shims: Optional[Path] = None,
+) -> None:
+    """Write the enable scripts of `generation`, as created by `new_generation`"""
+    with open(generation / "enable", "w", encoding="utf-8") as f:
+        f.write(
+            enable_script(
+                ENABLE_BASH,
+                komodo_prefix,
+                komodoenv_prefix,
+                UPDATE_CHECK_BASH,
+                tracked_release,
+                shared_shims,
+            ),
+        )
+    with open(generation / "enable.csh", "w", encoding="utf-8") as f:
+        f.write(
+            enable_script(
+                ENABLE_CSH,
+                komodo_prefix,
+                komodoenv_prefix,
+                UPDATE_CHECK_CSH,
+                tracked_release,
+                shared_shims,
+            ),
+        )
 
 
 def rewrite_executable(path: Path, python: str, text: bytes) -> bytes:
@@ -435,57 +994,719 @@ def rewrite_executable(path: Path, python: str, text: bytes) -> bytes:
     ).encode("utf8")
 
 
-def update_bins(srcpath: Path, dstpath: Path) -> None:
-    python = dstpath / "root" / "bin" / "python"
-    shimdir = dstpath / "root" / "shims"
-    if shimdir.is_dir():
-        shutil.rmtree(shimdir)
-
-    shimdir.mkdir()
-    for entry in (srcpath / "root" / "bin").iterdir():
-        if (dstpath / "root" / "bin" / entry.name).is_file():
-            continue
+def generate_shim(path: Path, python: str) -> bytes:
+    """Generate the shim for the executable `path`. Only Python scripts need to be
+    read in full, for everything else (eg. compiled binaries) we only read
+    enough to see the shebang line, if any.
+    """
+    with open(path, "rb", buffering=0) as f:
+        text = f.read(SHEBANG_MAX)
+        newline_pos = text.find(b"\n")
+        if text[:2] == b"#!" and (newline_pos < 0 or b"python" in text[:newline_pos]):
+            text += f.readall()
+    return rewrite_executable(path, python, text)
+
+
+def read_json(path: Path) -> dict:
+    """Read a JSON state file, returning {} if it's missing or corrupt"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_atomic(path: Path, data: bytes, file_mode: int = 0o644) -> None:
+    """Write `data` to `path` such that readers see either the old or the new
+    contents, never a partially written file.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        tmp.chmod(file_mode)
+        tmp.replace(path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+
+
+def write_changed(path: Path, data: bytes, file_mode: int = 0o644) -> None:
+    """`write_atomic`, unless `path` already contains `data`"""
+    with contextlib.suppress(OSError):
+        if path.read_bytes() == data:
+            return
+    write_atomic(path, data, file_mode)
+
+
+def map_jobs(func, items: list, jobs: int) -> list:
+    """Apply `func` to each of `items`, on a thread pool if `jobs` > 1"""
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+def release_bins(srcpath: Path, *, jobs: int = 1) -> Dict[str, dict]:
+    """Locate the executable behind every entry in komodo's root/bin, preferring
+    root/libexec, along with the source path, size and mtime that are recorded
+    in the shims manifest. Directories are ignored.
+    """
 
-        shimpath = dstpath / "root" / "shims" / entry.name
-        path = srcpath / "root" / "libexec" / entry.name
+    def locate(name: str) -> Tuple[str, Optional[dict]]:
+        path = srcpath / "root" / "libexec" / name
         if not path.is_file():
-            path = srcpath / "root" / "bin" / entry.name
+            path = srcpath / "root" / "bin" / name
         if not path.is_file():  # if folder, ignore
-            continue
+            return name, None
+
+        st = path.stat()
+        return name, {"source": str(path), "size": st.st_size, "mtime": st.st_mtime_ns}
+
+    with os.scandir(str(srcpath / "root" / "bin")) as it:
+        names = [entry.name for entry in it]
+    return {name: info for name, info in map_jobs(locate, names, jobs) if info}
+
+
+def shim_store_path(shim_store: Path, digests: Dict[str, str]) -> Path:
+    """Directory of `shim_store` holding the shims with the given names and
+    SHA-256 digests"""
+    key = hashlib.sha256(json.dumps(digests, sort_keys=True).encode("utf-8"))
+    return shim_store / key.hexdigest()
+
+
+def publish_shims(path: Path, shims: Dict[str, bytes]) -> None:
+    """Create the `shim_store_path` directory `path` containing `shims`.
+    Directories are created atomically and never modified afterwards, so that
+    any number of komodoenvs can share them."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp.mkdir()
+        for name, shim in shims.items():
+            with open(tmp / name, "wb") as f:
+                f.write(shim)
+            (tmp / name).chmod(0o755)
+        tmp.chmod(0o755)
+        tmp.rename(path)
+    except OSError:
+        shutil.rmtree(str(tmp), ignore_errors=True)
+        if not path.is_dir():  # Unless another process beat us to it
+            raise
+
+
+def update_bins(
+    srcpath: Path,
+    dstpath: Path,
+    generation: Path,
+    *,
+    incremental: bool = True,
+    jobs: int = 1,
+    bins: Optional[Dict[str, dict]] = None,
+    shim_store: Optional[Path] = None,
+) -> Optional[Path]:
+    """Generate a shim in root/shims of `generation`, as created by
+    `new_generation`, for every executable in komodo's root/bin.
+
+    The source path, size and mtime of each executable and the hash of the
+    generated shim are kept in a manifest. With `incremental`, shims whose
+    source hasn't changed since the last update are left alone. Each shim is
+    replaced atomically and the directory is never emptied, so that running
+    jobs don't observe a partially populated root/shims.
+
+    With `jobs` > 1, shims are generated on a thread pool of that size, which
+    hides the latency of the many small file operations on NFS. The result is
+    identical to the serial case.
+
+    `bins`, as returned by `release_bins`, lets komodoenvs of the same release
+    share a single listing of it.
+
+    With `shim_store`, only the shims of Python scripts, which refer to this
+    komodoenv's interpreter, are put in root/shims. The others are the same for
+    every komodoenv of the release, and are put in a directory of `shim_store`
+    named after their contents (see `shim_store_path`). Returns that directory,
+    which must be added to PATH, or None if there are no shared shims.
+    """
+    python = str(dstpath / "root" / "bin" / "python")
+    shebang = ("#!" + python).encode("utf-8")
+    shimdir = generation / "root" / "shims"
+    manifest_path = generation / SHIMS_MANIFEST
+
+    manifest = read_json(manifest_path) if incremental else {}
+    old_shims = {}
+    if (
+        manifest.get("python"),
+        bool(manifest.get("shared")),
+        bool(manifest.get("lazy")),
+    ) == (python, bool(shim_store), False):
+        old_shims = manifest.get("shims", {})
+
+    shimdir.mkdir(exist_ok=True)
+    with os.scandir(str(shimdir)) as it:
+        existing = {entry.name for entry in it}
+    with os.scandir(str(dstpath / "root" / "bin")) as it:
+        dst_bins = {entry.name for entry in it if entry.is_file()}
+
+    def update_shim(name: str) -> Tuple[str, dict, Optional[bytes]]:
+        info = dict(bins[name])
+        old = old_shims.get(name, {})
+        if (old.get("shared") or name in existing) and all(
+            old.get(k) == v for k, v in info.items()
+        ):
+            return name, old, None
+
+        shim = generate_shim(Path(info["source"]), python)
+        info["sha256"] = hashlib.sha256(shim).hexdigest()
+        info["shared"] = bool(shim_store) and not shim.startswith(shebang)
+        if info["shared"]:
+            return name, info, shim
+        if name not in existing or old.get("sha256") != info["sha256"]:
+            write_atomic(shimdir / name, shim, 0o755)
+        return name, info, None
+
+    if bins is None:
+        bins = release_bins(srcpath, jobs=jobs)
+    results = map_jobs(
+        update_shim, [name for name in bins if name not in dst_bins], jobs
+    )
+    new_shims = {name: info for name, info, _ in results}
+    shared = {name: shim for name, info, shim in results if info.get("shared")}
+
+    store_dir = None
+    if shim_store is not None and shared:
+        store_dir = shim_store_path(
+            shim_store, {name: new_shims[name]["sha256"] for name in shared}
+        )
+        if not store_dir.is_dir():
+            # Regenerate the shared shims that were unchanged
+            sources = {name: Path(new_shims[name]["source"]) for name in shared}
+            publish_shims(
+                store_dir,
+                {
+                    name: shim or generate_shim(sources[name], python)
+                    for name, shim in shared.items()
+                },
+            )
+
+    local = {name for name, info in new_shims.items() if not info.get("shared")}
+    for name in existing - local:
+        with contextlib.suppress(FileNotFoundError):
+            (shimdir / name).unlink()
+
+    write_atomic(
+        manifest_path,
+        json.dumps(
+            {
+                "python": python,
+                "shared": bool(shim_store),
+                "store": str(store_dir) if store_dir else None,
+                "shims": new_shims,
+            }
+        ).encode("utf-8"),
+    )
+    return store_dir
+
+
+DISPATCHER_SCRIPT = """\
+#!/bin/bash
+# Runs the komodo executable that this symlink is named after. Generated by
+# komodoenv-update, which lists the executables in {table}
+name="${{0##*/}}"
+. "{table}"
+case "$libexec" in
+    *"|$name|"*) target="$root/libexec/$name" ;;
+    *) target="$root/bin/$name" ;;
+esac
+case "$python" in
+    *"|$name|"*) exec "{python}" "$target" "$@" ;;
+esac
+export LD_LIBRARY_PATH="$root/lib:$root/lib64${{LD_LIBRARY_PATH:+:${{LD_LIBRARY_PATH}}}}"
+exec -a "$0" "$target" "$@"
+"""
+
+
+def is_python_script(path: Path) -> bool:
+    """Whether `path` has a Python shebang, like `rewrite_executable` decides"""
+    with open(path, "rb", buffering=0) as f:
+        head = f.read(SHEBANG_MAX)
+    newline_pos = head.find(b"\n")
+    return head[:2] == b"#!" and newline_pos >= 0 and b"python" in head[:newline_pos]
+
+
+def update_lazy_bins(
+    srcpath: Path,
+    dstpath: Path,
+    generation: Path,
+    *,
+    incremental: bool = True,
+    jobs: int = 1,
+    bins: Optional[Dict[str, dict]] = None,
+) -> None:
+    """Like `update_bins`, but instead of generating a shim for every executable
+    in komodo's root/bin, make root/shims contain a single dispatcher script and
+    a symlink to it for every executable.
+
+    The dispatcher finds the executable it was invoked as in `SHIMS_TABLE`,
+    which lists the executables that are Python scripts or live in
+    root/libexec. Only the table has to be rewritten when the release changes,
+    and only the first bytes of executables that changed are read.
+    """
+    python = str(dstpath / "root" / "bin" / "python")
+    shimdir = generation / "root" / "shims"
+    manifest_path = generation / SHIMS_MANIFEST
+    table_path = generation / SHIMS_TABLE
+
+    manifest = read_json(manifest_path) if incremental else {}
+    old_shims = {}
+    if manifest.get("lazy") and manifest.get("python") == python:
+        old_shims = manifest.get("shims", {})
+
+    shimdir.mkdir(exist_ok=True)
+    with os.scandir(str(shimdir)) as it:
+        existing = {entry.name: entry.is_symlink() for entry in it}
+    with os.scandir(str(dstpath / "root" / "bin")) as it:
+        dst_bins = {entry.name for entry in it if entry.is_file()}
+
+    def classify(name: str) -> Tuple[str, dict]:
+        info = dict(bins[name])
+        old = old_shims.get(name, {})
+        if "python" in old and all(old.get(k) == v for k, v in info.items()):
+            return name, old
+        info["python"] = is_python_script(Path(info["source"]))
+        return name, info
+
+    if bins is None:
+        bins = release_bins(srcpath, jobs=jobs)
+    new_shims = dict(
+        map_jobs(classify, [name for name in bins if name not in dst_bins], jobs)
+    )
+
+    def table_entry(predicate) -> str:
+        matching = [name for name, info in sorted(new_shims.items()) if predicate(info)]
+        return shlex.quote("|" + "".join(name + "|" for name in matching))
 
-        with open(path, "rb") as f:
-            text = f.read()
-        with open(shimpath, "wb") as f:
-            f.write(rewrite_executable(path, str(python), text))
-        shimpath.chmod(0o755)
+    table = (
+        f"root={shlex.quote(str(srcpath / 'root'))}\n"
+        f"python={table_entry(lambda info: info['python'])}\n"
+        "libexec="
+        + table_entry(lambda info: Path(info["source"]).parent.name == "libexec")
+        + "\n"
+    )
+    dispatcher = DISPATCHER_SCRIPT.format(table=table_path, python=python)
+    write_changed(table_path, table.encode("utf-8"))
+    write_changed(shimdir / DISPATCHER, dispatcher.encode("utf-8"), 0o755)
+
+    # Symlinks recorded in the manifest are assumed to point to the dispatcher,
+    # so that an update needn't read every link
+    for name in new_shims:
+        if not (existing.get(name) and name in old_shims):
+            tmp = shimdir / f".{name}.{os.getpid()}.tmp"
+            tmp.symlink_to(DISPATCHER)
+            tmp.replace(shimdir / name)
+    for name in set(existing) - set(new_shims) - {DISPATCHER}:
+        with contextlib.suppress(FileNotFoundError):
+            (shimdir / name).unlink()
+
+    new_manifest = {"python": python, "lazy": True, "shims": new_shims}
+    if new_manifest != manifest:
+        write_atomic(manifest_path, json.dumps(new_manifest).encode("utf-8"))
+
+
+SITECUSTOMIZE_HEADER = "# Generated by komodoenv-update."
+SITECUSTOMIZE = (
+    SITECUSTOMIZE_HEADER
+    + """ Adds the site-packages of komodo release
+# {release} to sys.path, as found from its .pth files at update time.
+import sys
+
+sys.path.extend([path for path in {paths!r} if path not in sys.path])
+"""
+)
 
 
-def create_pth(config: Dict[str, str], srcpath: Path, dstpath: Path) -> None:
-    path = (
-        dstpath
-        / "root"
-        / "lib"
-        / ("python" + config["python-version"])
-        / "site-packages"
+def is_own_sitecustomize(path: Path) -> bool:
+    """Whether `path` is a sitecustomize.py generated by `create_pth`"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read(len(SITECUSTOMIZE_HEADER)) == SITECUSTOMIZE_HEADER
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def komodo_site_paths(config: Dict[str, str], srcpath: Path) -> List[str]:
+    """The directories komodo's site-packages add to sys.path, including the
+    directories listed in their .pth files, in the order `site` adds them.
+    Lines of .pth files that import modules are ignored."""
+    paths = []  # type: List[str]
+    for lib in "lib64", "lib":
+        sitedir = srcpath / "root" / lib / ("python" + config["python-version"])
+        sitedir = sitedir / "site-packages"
+        if not sitedir.is_dir() or str(sitedir) in paths:
+            continue
+        paths.append(str(sitedir))
+        for pth in sorted(sitedir.glob("*.pth")):
+            if pth.name.startswith("."):
+                continue
+            with contextlib.suppress(OSError, UnicodeDecodeError):
+                for line in pth.read_text(encoding="utf-8").splitlines():
+                    line = line.rstrip()  # noqa: PLW2901
+                    if not line or line.startswith(("#", "import ", "import\t")):
+                        continue
+                    path = os.path.abspath(os.path.join(str(sitedir), line))  # noqa: PTH100, PTH118
+                    if path not in paths and os.path.isdir(path):  # noqa: PTH112
+                        paths.append(path)
+    return paths
+
+
+def can_use_sitecustomize(
+    config: Dict[str, str], dstpath: Path, paths: List[str]
+) -> bool:
+    """Whether a sitecustomize module in the komodoenv's site-packages would be
+    imported, and wouldn't hide one from the base interpreter or komodo"""
+    sitedir = dstpath / "root" / "lib" / ("python" + config["python-version"])
+    sitedir = sitedir / "site-packages"
+    sitecustomize = sitedir / "sitecustomize.py"
+    if sitecustomize.exists() and not is_own_sitecustomize(sitecustomize):
+        return False  # Installed by the user
+
+    try:
+        pyvenv = parse_config((dstpath / "root" / "pyvenv.cfg").read_text("utf-8"))
+    except OSError:
+        return False
+    stdlib = Path(pyvenv.get("home", "/")).parent / "lib"
+    stdlib = stdlib / ("python" + config["python-version"])
+    return not any(
+        (Path(path) / name).exists()
+        for path in [str(stdlib), *paths]
+        for name in ("sitecustomize.py", "sitecustomize")
     )
+
+
+def site_packages(config: Dict[str, str]) -> Path:
+    """The komodoenv's site-packages, relative to the komodoenv"""
+    return Path("root", "lib", "python" + config["python-version"], "site-packages")
+
+
+def create_pth(
+    config: Dict[str, str],
+    srcpath: Path,
+    dstpath: Path,
+    generation: Path,
+) -> None:
+    """Make the komodoenv's interpreter use komodo's site-packages.
+
+    The directories are found from komodo's .pth files here rather than at
+    every start of the interpreter, and added to sys.path by a generated
+    sitecustomize module. Having one also spares the interpreter looking for
+    sitecustomize in all of komodo's site-packages. If another sitecustomize
+    would be imported instead of ours, the directories are listed in
+    zzz_komodo.pth, which is otherwise left empty.
+
+    The files are written to `generation`, as created by `new_generation`, for
+    `switch_generation` to link into site-packages.
+    """
+    path = dstpath / site_packages(config)
     # If upgrading from an old komodoenv using '_komodo.pth'
     # to a newer which uses 'zzz_komodo.pth' we must make sure to
     # remove the old _komodo.pth.
     with contextlib.suppress(FileNotFoundError):
         (path / "_komodo.pth").unlink()
-    new_style_pth = path / "zzz_komodo.pth"
-    with open(new_style_pth, "w", encoding="utf-8") as f:
-        for lib in "lib64", "lib":  # noqa: FURB122
-            f.write(
-                str(
-                    srcpath
-                    / "root"
-                    / lib
-                    / ("python" + config["python-version"])
-                    / "site-packages",
-                )
-                + "\n",
-            )
+
+    paths = komodo_site_paths(config, srcpath)
+    path = generation / site_packages(config)
+    path.mkdir(parents=True, exist_ok=True)
+    if can_use_sitecustomize(config, dstpath, paths):
+        sitecustomize = SITECUSTOMIZE.format(release=srcpath.name, paths=paths)
+        write_atomic(path / "sitecustomize.py", sitecustomize.encode("utf-8"))
+        paths = []
+    # We use zzz_komodo.pth to try and make it the last .pth file to be
+    # processed alphabetically
+    write_atomic(path / "zzz_komodo.pth", "".join(p + "\n" for p in paths).encode())
+
+
+def generation_paths(config: Dict[str, str]) -> List[Path]:
+    """The paths in a komodoenv that are symlinks into its current generation"""
+    site = site_packages(config)
+    return [
+        Path("komodoenv.conf"),
+        Path("enable"),
+        Path("enable.csh"),
+        Path("root", "shims"),
+        site / "sitecustomize.py",
+        site / "zzz_komodo.pth",
+    ]
+
+
+def replace_symlink(path: Path, target: str) -> None:
+    """Atomically make `path` a symlink to `target`"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with contextlib.suppress(FileNotFoundError):
+        tmp.unlink()
+    tmp.symlink_to(target)
+    tmp.replace(path)
+
+
+def copy_shims(src: Path, dst: Path, jobs: int = 1) -> None:
+    """Populate root/shims of the generation `dst` with the shims of `src`, and
+    copy its shims manifest, so that updating `dst` incrementally only touches
+    the shims that changed. Shims are hardlinked, which is safe as they're only
+    ever replaced, never modified in place."""
+    srcdir = src / "root" / "shims"
+    dstdir = dst / "root" / "shims"
+    dstdir.mkdir(parents=True)
+    try:
+        with os.scandir(str(srcdir)) as it:
+            entries = [
+                (entry.name, entry.is_symlink())
+                for entry in it
+                if entry.is_symlink() or entry.is_file()
+            ]
+    except FileNotFoundError:
+        return
+
+    def copy(entry: Tuple[str, bool]) -> None:
+        name, is_symlink = entry
+        if is_symlink:
+            (dstdir / name).symlink_to(os.readlink(str(srcdir / name)))  # noqa: PTH115
+            return
+        try:
+            os.link(str(srcdir / name), str(dstdir / name))
+        except OSError:  # eg. a filesystem without hardlinks
+            shutil.copy2(str(srcdir / name), str(dstdir / name))
+
+    map_jobs(copy, entries, jobs)
+    with contextlib.suppress(FileNotFoundError):
+        shutil.copyfile(str(src / SHIMS_MANIFEST), str(dst / SHIMS_MANIFEST))
+
+
+def new_generation(prefix: Path, *, jobs: int = 1) -> Path:
+    """Create the directory of the next generation of the komodoenv at `prefix`,
+    starting out with the shims of the current one. See `switch_generation`."""
+    gens = prefix / GENERATIONS
+    gens.mkdir(exist_ok=True)
+    numbers = [0]
+    for path in gens.iterdir():
+        match = GENERATION_NAME.fullmatch(path.name)
+        if match is not None:
+            numbers.append(int(match.group(1)))
+    generation = gens / f"gen-{max(numbers) + 1}"
+
+    current = gens / "current"
+    copy_shims(current if current.is_dir() else prefix, generation, jobs)
+    return generation
+
+
+def link_generation(prefix: Path, config: Dict[str, str]) -> None:
+    """Make the `generation_paths` of the komodoenv at `prefix` symlinks into
+    the current generation, or remove them if it doesn't have them. Files from
+    before komodoenv had generations are moved to `LEGACY_GENERATION`."""
+    current = prefix / GENERATIONS / "current"
+    legacy = prefix / GENERATIONS / LEGACY_GENERATION
+    for name in generation_paths(config):
+        path = prefix / name
+        target = os.path.relpath(str(current / name), str(path.parent))
+        linked = path.is_symlink() and os.readlink(str(path)) == target  # noqa: PTH115
+        if not os.path.lexists(str(current / name)):
+            if linked or (not path.is_symlink() and is_own_sitecustomize(path)):
+                path.unlink()
+            continue
+        if linked:
+            continue
+
+        if path.is_dir() and not path.is_symlink():
+            # A directory can't be replaced atomically, so root/shims is
+            # briefly missing while moving it
+            (legacy / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.rmtree(str(legacy / name), ignore_errors=True)
+            path.rename(legacy / name)
+        elif path.is_file() and not path.is_symlink():
+            (legacy / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(str(path), str(legacy / name))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        replace_symlink(path, target)
+
+    if legacy.is_dir():
+        with contextlib.suppress(FileNotFoundError):
+            (prefix / SHIMS_MANIFEST).rename(legacy / SHIMS_MANIFEST)
+
+
+def switch_generation(prefix: Path, generation: Path, config: Dict[str, str]) -> None:
+    """Make `generation` the current generation of the komodoenv at `prefix`.
+
+    The komodoenv's `generation_paths` are symlinks through
+    komodoenv.generations/current, so repointing that one symlink switches all
+    of them at once: a process never sees, say, the enable script of one
+    release with the shims of another. Only a change in which of the paths
+    exist, eg. from zzz_komodo.pth alone to sitecustomize.py, takes effect
+    after the switch. The previous generation is kept for `rollback`, older
+    ones are removed.
+    """
+    gens = prefix / GENERATIONS
+    try:
+        previous = os.readlink(str(gens / "current"))  # noqa: PTH115
+    except OSError:
+        previous = LEGACY_GENERATION
+    replace_symlink(gens / "current", generation.name)
+    replace_symlink(gens / "previous", previous)
+    link_generation(prefix, config)
+
+    keep = {"current", "previous", generation.name, previous}
+    for path in gens.iterdir():
+        if path.name in keep:
+            continue
+        if path.is_symlink():
+            path.unlink()
+        else:
+            shutil.rmtree(str(path), ignore_errors=True)
+
+
+def rollback(prefix: Path) -> Optional[Dict[str, str]]:
+    """Switch the komodoenv at `prefix` back to its previous generation, and
+    make the generation rolled back from the previous one, so that rolling back
+    twice undoes the rollback. Returns the config of the generation rolled back
+    to, or None if there's no previous generation.
+
+    The stamp is written, and the enable scripts of the generation rolled back
+    to are rewritten for where the tracked release points now, so that neither
+    `--check` nor the enable scripts' staleness test offer to update again
+    until the tracked release changes. The config directories, which aren't
+    part of generations, are left as they are.
+    """
+    gens = prefix / GENERATIONS
+    try:
+        current = os.readlink(str(gens / "current"))  # noqa: PTH115
+        previous = os.readlink(str(gens / "previous"))  # noqa: PTH115
+    except OSError:
+        return None
+    generation = gens / previous
+    if not (generation / "enable").is_file():
+        return None
+    try:
+        config = read_config_file(generation / "komodoenv.conf")
+    except OSError:
+        return None
+    config.update(read_settings(prefix))
+
+    komodo_root = Path(config["komodo-root"])
+    store = read_json(generation / SHIMS_MANIFEST).get("store")
+    update_enable_script(
+        komodo_root / config["current-release"],
+        prefix,
+        generation,
+        komodo_root / config["tracked-release"],
+        Path(store) if store else None,
+    )
+    replace_symlink(gens / "current", previous)
+    replace_symlink(gens / "previous", current)
+    link_generation(prefix, config)
+    write_stamp(config, prefix / STAMP_FILE)
+    return config
+
+
+def append_line(path: Path, line: str) -> None:
+    """Append `line` to `path` with a single write, so that concurrent writers
+    don't interleave"""
+    with contextlib.suppress(OSError), open(str(path), "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def _audit_hook(counts: Dict[str, int]):
+    """Audit hook counting the events of interest to `Timings` in `counts`"""
+
+    def hook(event: str, _args: tuple) -> None:
+        if event == "open":
+            counts["files_opened"] += 1
+        elif event in ("os.listdir", "os.scandir"):
+            counts["dirs_listed"] += 1
+        elif event in ("subprocess.Popen", "os.posix_spawn", "os.exec"):
+            counts["subprocesses"] += 1
+
+    return hook
+
+
+def _proc_io(fd: Optional[int]) -> Dict[str, int]:
+    """I/O counters of this process, as reported by the kernel in the already
+    opened /proc/self/io"""
+    names = {
+        "rchar": "bytes_read",
+        "wchar": "bytes_written",
+        "syscr": "read_calls",
+        "syscw": "write_calls",
+    }
+    counters = {}
+    if fd is None:
+        return counters
+    try:
+        text = os.pread(fd, 4096, 0).decode("ascii")
+    except OSError:
+        return counters
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        if key in names:
+            counters[names[key]] = int(value)
+    return counters
+
+
+class Timings:
+    """Records the wall time and I/O counters of each phase of `command`, and
+    appends them to `path` as one JSON object per line.
+
+    Files opened, directories listed and subprocesses spawned are counted with
+    an audit hook, which requires Python 3.8. Bytes and syscalls are read from
+    /proc/self/io, and don't include the work done by subprocesses. Both count
+    for the whole process, so phases that run at the same time as others on
+    other threads must be recorded with `io=False`: only their wall time is
+    recorded. When `path` is None, phases aren't measured at all.
+    """
+
+    def __init__(self, command: str, path: Optional[Path] = None) -> None:
+        global _audit_installed  # noqa: PLW0603
+
+        self.command = command
+        self.path = path
+        self.started = time.time()
+        self._io_fd = None
+        if path is not None:
+            with contextlib.suppress(OSError):
+                self._io_fd = os.open("/proc/self/io", os.O_RDONLY | os.O_CLOEXEC)
+        if path is not None and not _audit_installed and hasattr(sys, "addaudithook"):
+            sys.addaudithook(_audit_hook(_audit_counts))
+            _audit_installed = True
+
+    def __del__(self) -> None:
+        if self._io_fd is not None:
+            os.close(self._io_fd)
+
+    def _sample(self) -> Dict[str, int]:
+        sample = _proc_io(self._io_fd)
+        if _audit_installed:
+            sample.update(_audit_counts)
+        return sample
+
+    @contextlib.contextmanager
+    def phase(self, name: str, *, io: bool = True):
+        if self.path is None:
+            yield
+            return
+
+        before = self._sample() if io else {}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            after = self._sample() if io else {}
+            record = {
+                "command": self.command,
+                "phase": name,
+                "pid": os.getpid(),
+                "started": self.started,
+                "wall": wall,
+            }
+            record.update({k: after[k] - before[k] for k in after if k in before})
+            append_line(self.path, json.dumps(record))
 
 
 def parse_args(args: List[str]):
@@ -499,30 +1720,183 @@ def parse_args(args: List[str]):
         default=False,
         help="Check if this komodoenv can be updated",
     )
+    ap.add_argument(
+        "--background",
+        action="store_true",
+        default=False,
+        help="Update, with the output going to komodoenv.update.log. This is how "
+        "--check starts updates when auto-update is enabled in komodoenv.settings",
+    )
+    ap.add_argument(
+        "--rollback",
+        action="store_true",
+        default=False,
+        help="Switch back to the state before the last update",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        nargs="?",
+        default=1,
+        const=os.cpu_count() or 1,
+        help="Generate shims in parallel using this many threads "
+        "(default if given without a value: number of CPUs)",
+    )
+    ap.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="Report the time taken by each step of the update",
+    )
+    ap.add_argument(
+        "--timings",
+        type=Path,
+        default=os.environ.get(TIMINGS_ENV) or None,
+        metavar="PATH",
+        help="Append the wall time and I/O of each step of the update to PATH "
+        f"as JSON lines (default: ${TIMINGS_ENV})",
+    )
 
     return ap.parse_args(args)
 
 
-def main(args: Optional[List[str]] = None) -> None:
-    args = parse_args(args)
+def apply_update(
+    config: Dict[str, str],
+    current: Dict[str, str],
+    prefix: Path,
+    *,
+    jobs: int = 1,
+    verbose: bool = False,
+    timings: Optional[Timings] = None,
+    bins: Optional[Dict[str, dict]] = None,
+) -> None:
+    """Update the komodoenv at `prefix` to the release `current`, as returned
+    by `find_current`.
+
+    The config, shims, enable scripts and site-packages files are written to a
+    new generation, which then replaces the current one in a single step. See
+    `switch_generation`.
+    """
+    if timings is None:
+        timings = Timings("update")
 
-    config = read_config()
-    if not check_same_distro(config):
-        return
+    with timings.phase("generation"):
+        generation = new_generation(prefix, jobs=jobs)
+    config.update(current)
+    # Keep the settings out of komodoenv.conf, or removing one from
+    # SETTINGS_FILE would have no effect
+    settings = read_settings(prefix)
+    write_config({k: v for k, v in config.items() if k not in settings}, generation)
+
+    srcpath = Path(config["komodo-root"]) / config["current-release"]
 
-    copy_config_dirs(config)
+    shim_store = Path(config["shim-store"]) if config.get("shim-store") else None
+    start = time.perf_counter()
+    with timings.phase("shims"):
+        if config.get("shim-mode") == "lazy":
+            shared_shims = None
+            update_lazy_bins(srcpath, prefix, generation, jobs=jobs, bins=bins)
+        else:
+            shared_shims = update_bins(
+                srcpath, prefix, generation, jobs=jobs, bins=bins, shim_store=shim_store
+            )
+    if verbose:
+        mode = f"{jobs} threads" if jobs > 1 else "serial"
+        print(
+            f"Generated shims in {time.perf_counter() - start:.3f}s ({mode})",
+            file=sys.stderr,
+        )
+    with timings.phase("enable"):
+        update_enable_script(
+            srcpath,
+            prefix,
+            generation,
+            Path(config["komodo-root"]) / config["tracked-release"],
+            shared_shims,
+        )
+    with timings.phase("pth"):
+        create_pth(config, srcpath, prefix, generation)
+    with timings.phase("switch"):
+        switch_generation(prefix, generation, config)
+    # we run copy_config_dirs before and after updating to make sure it is always up to date
+    with timings.phase("config-dirs"):
+        copy_config_dirs(config, prefix)
+    write_stamp(config, prefix / STAMP_FILE)
 
-    current = current_track(config)
+
+def auto_update_enabled(config: Dict[str, str]) -> bool:
+    return config.get("auto-update", "").lower() in ("1", "true", "yes", "on")
+
+
+def start_background_update(prefix: Path, jobs: int = 1) -> bool:
+    """Start a detached `komodoenv-update --background` for the komodoenv at
+    `prefix`, and return whether it was started. Its output goes to
+    `UPDATE_LOG`, which it removes when it has updated successfully. No new
+    update is started while a recent log exists, so that a failing update isn't
+    retried every time the komodoenv is enabled.
+    """
+    log = prefix / UPDATE_LOG
+    with contextlib.suppress(OSError):
+        if time.time() - log.stat().st_mtime < UPDATE_RETRY:
+            return False
+
+    script = prefix / "root" / "bin" / "komodoenv-update"
+    try:
+        with open(str(log), "wb") as f:
+            subprocess.Popen(
+                [sys.executable, str(script), "--background", f"--jobs={jobs}"],
+                stdin=subprocess.DEVNULL,
+                stdout=f,
+                stderr=subprocess.STDOUT,
+                cwd="/",
+                start_new_session=True,
+            )
+    except OSError:
+        return False
+    return True
+
+
+def update_locked(args, prefix: Path, timings: Timings) -> None:
+    """The part of `main` that runs while holding the `update_lock`"""
+    # Re-read the config, as another process may have updated the komodoenv
+    # while we were waiting for the lock
+    config = read_config(prefix)
+    stamp_path = prefix / STAMP_FILE
+
+    with timings.phase("config-dirs"):
+        copy_config_dirs(config, prefix)
+
+    resolver = ReleaseResolver()
+    with timings.phase("track"):
+        current = current_track(config, resolver)
+    if args.verbose:
+        print(f"Resolved tracked release: {resolver.stats}", file=sys.stderr)
     if not should_update(config, current):
+        write_stamp(config, stamp_path)
         return
 
-    if args.check and not can_update(config):
+    if args.check and not can_update(config, resolver):
         print(
             "Warning: Your komodoenv is out of date. You will need to recreate komodo",
             file=sys.stderr,
         )
         sys.exit(0)
 
+    elif (
+        args.check
+        and auto_update_enabled(config)
+        and start_background_update(prefix, args.jobs)
+    ):
+        print(
+            "Updating komodoenv to the latest komodo release "
+            f"({current['current-release']}) in the background. Shells started "
+            "after it's done will use it.",
+            file=sys.stderr,
+        )
+        return
+
     elif args.check:
         print(
             dedent(
@@ -537,17 +1911,57 @@ def main(args: Optional[List[str]] = None) -> None:
         )
         sys.exit(0)
 
-    config.update(current)
-    write_config(config)
+    apply_update(
+        config,
+        current,
+        prefix,
+        jobs=args.jobs,
+        verbose=args.verbose,
+        timings=timings,
+    )
 
-    srcpath = Path(config["komodo-root"]) / config["current-release"]
 
-    dstpath = Path(__file__).resolve().parents[2]  # komodoenv/root/bin/update.py
-    update_bins(srcpath, dstpath)
-    update_enable_script(srcpath, dstpath)
-    create_pth(config, srcpath, dstpath)
-    # we run copy_config_dirs before and after updating to make sure it is always up to date
-    copy_config_dirs(config)
+def main(args: Optional[List[str]] = None) -> None:
+    args = parse_args(args)
+    timings = Timings("update", args.timings)
+    prefix = Path(__file__).resolve().parents[2]  # komodoenv/root/bin/update.py
+
+    if args.rollback:
+        with update_lock(prefix):
+            config = rollback(prefix)
+        if config is None:
+            print("Error: This komodoenv has no update to roll back", file=sys.stderr)
+            sys.exit(1)
+        print(f"Rolled back to komodo release {config['current-release']}")
+        return
+
+    config = read_config()
+    with timings.phase("distro"):
+        same_distro = check_same_distro(config)
+    if not same_distro:
+        return
+
+    # Fast path for 'source enable': if the tracked release still points to
+    # the same place as the last time we checked, there's nothing to do.
+    stamp_path = prefix / STAMP_FILE
+    with timings.phase("stamp"):
+        fresh = args.check and stamp_is_fresh(config, stamp_path)
+    if fresh:
+        return
+
+    # 'source enable' must never wait, so --check gives up if an update is in
+    # progress. Concurrent updates wait for each other, and all but the first
+    # find that there's nothing left to do.
+    if args.background:
+        with contextlib.suppress(OSError):
+            os.nice(10)
+    with update_lock(prefix, blocking=not args.check) as locked:
+        if locked:
+            update_locked(args, prefix, timings)
+    if args.background:
+        # Success, so there's no reason to hold off the next background update
+        with contextlib.suppress(FileNotFoundError):
+            (prefix / UPDATE_LOG).unlink()
 
 
 if __name__ == "__main__":
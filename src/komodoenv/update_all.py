@@ -0,0 +1,232 @@
+"""Update every komodoenv below some directories in one go.
+
+Komodoenvs are found by their komodoenv.conf and grouped by the release they
+track, so that each tracked release is resolved and its root/bin is listed only
+once, however many komodoenvs track it. The komodoenvs are then updated on a
+pool of worker threads.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from komodoenv import update
+
+# Outcomes of updating a komodoenv, in the order they're reported
+STATUSES = ("updated", "up-to-date", "incompatible", "wrong-distro", "failed")
+
+
+def discover(dirs: list[Path], *, max_depth: int = 2) -> list[Path]:
+    """Find komodoenvs in `dirs` and their subdirectories, down to `max_depth`
+    levels. Symlinks, hidden directories and the contents of komodoenvs are
+    not searched."""
+    found = []
+
+    def walk(path: Path, depth: int) -> None:
+        if (path / "komodoenv.conf").is_file():
+            found.append(path)
+            return
+        if depth >= max_depth:
+            return
+        try:
+            with os.scandir(path) as it:
+                subdirs = [
+                    Path(entry.path)
+                    for entry in it
+                    if not entry.name.startswith(".")
+                    and entry.is_dir(follow_symlinks=False)
+                ]
+        except OSError:
+            return
+        for subdir in sorted(subdirs):
+            walk(subdir, depth + 1)
+
+    for path in dirs:
+        walk(Path(path).absolute(), 0)
+    return found
+
+
+def refresh_update_script(prefix: Path) -> None:
+    """Replace the komodoenv's komodoenv-update with this version's"""
+    update.write_changed(
+        prefix / "root" / "bin" / "komodoenv-update",
+        Path(update.__file__).read_bytes(),
+        0o755,
+    )
+
+
+def update_env(
+    prefix: Path,
+    config: dict[str, str],
+    current: dict[str, str],
+    bins: dict[str, dict],
+    resolver: update.ReleaseResolver,
+    *,
+    jobs: int = 1,
+    dry_run: bool = False,
+) -> str:
+    """Bring the komodoenv at `prefix` up to date with `current`, and return
+    its status"""
+    if dry_run:
+        if not update.should_update(config, current):
+            return "up-to-date"
+        if not update.can_update(config, resolver):
+            return "incompatible"
+        return "updated"
+
+    with update.update_lock(prefix):
+        # The komodoenv may have been updated while waiting for the lock
+        config = update.read_config(prefix)
+        if not update.should_update(config, current):
+            update.write_stamp(config, prefix / update.STAMP_FILE)
+            return "up-to-date"
+        if not update.can_update(config, resolver):
+            return "incompatible"
+        # Updating changes the layout of the komodoenv to that of this version
+        # of komodoenv, which the komodoenv's own komodoenv-update must know
+        refresh_update_script(prefix)
+        update.apply_update(config, current, prefix, jobs=jobs, bins=bins)
+    return "updated"
+
+
+def group_by_track(
+    prefixes: list[Path], results: dict[str, dict[Path, str]]
+) -> dict[tuple[str, str], list[tuple[Path, dict[str, str]]]]:
+    """Read the config of each komodoenv and group them by komodo root and
+    tracked release. Komodoenvs that can't be updated are added to `results`."""
+    thisdist = update.distro_id() + update.distro_versions()[0]
+    groups = defaultdict(list)
+    for prefix in prefixes:
+        try:
+            config = update.read_config(prefix)
+        except (OSError, UnicodeDecodeError) as err:
+            results["failed"][prefix] = f"Could not read komodoenv.conf: {err}"
+            continue
+        if config.get("linux-dist", "") != thisdist:
+            results["wrong-distro"][prefix] = (
+                f"Created for {config.get('linux-dist')}, but this is {thisdist}"
+            )
+            continue
+        missing = {"tracked-release", "current-release", "mtime-release"} - set(config)
+        if missing:
+            results["failed"][prefix] = (
+                f"Missing {', '.join(sorted(missing))} in komodoenv.conf"
+            )
+            continue
+        groups[config["komodo-root"], config["tracked-release"]].append(
+            (prefix, config)
+        )
+    return groups
+
+
+def update_all(
+    dirs: list[Path],
+    *,
+    workers: int = 1,
+    jobs: int = 1,
+    max_depth: int = 2,
+    dry_run: bool = False,
+) -> dict[str, dict[Path, str]]:
+    """Update all komodoenvs found in `dirs`. Returns the komodoenvs by status,
+    each with a message explaining it."""
+    results: dict[str, dict[Path, str]] = {status: {} for status in STATUSES}
+    groups = group_by_track(discover(dirs, max_depth=max_depth), results)
+
+    resolver = update.ReleaseResolver()
+    tasks = []
+    for (root, tracked), envs in groups.items():
+        current = update.find_current(envs[0][1], resolver)
+        if current is None:
+            for prefix, _ in envs:
+                results["failed"][prefix] = (
+                    f"Tracked release {root}/{tracked} not found"
+                )
+            continue
+        bins = None
+        if any(update.should_update(config, current) for _, config in envs):
+            srcpath = Path(root) / current["current-release"]
+            bins = update.release_bins(srcpath, jobs=jobs)
+        tasks.extend((prefix, config, current, bins) for prefix, config in envs)
+
+    def run(task) -> tuple[Path, str, str]:
+        prefix, config, current, bins = task
+        try:
+            status = update_env(
+                prefix, config, current, bins, resolver, jobs=jobs, dry_run=dry_run
+            )
+        except Exception as err:  # noqa: BLE001
+            return prefix, "failed", f"{type(err).__name__}: {err}"
+        return prefix, status, current["current-release"]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for prefix, status, message in executor.map(run, tasks):
+            results[status][prefix] = message
+
+    return results
+
+
+def report(results: dict[str, dict[Path, str]], *, dry_run: bool = False) -> None:
+    total = sum(len(envs) for envs in results.values())
+    print(f"Checked {total} komodoenvs{' (dry run)' if dry_run else ''}:")
+    for status in STATUSES:
+        if results[status]:
+            print(f"  {status:>12s}  {len(results[status])}")
+
+    for status in "incompatible", "wrong-distro", "failed":
+        for prefix, message in sorted(results[status].items()):
+            print(f"{status}: {prefix}: {message}", file=sys.stderr)
+
+
+def parse_args(args: list[str]) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(
+        prog="komodoenv update-all",
+        description="Update every komodoenv found in the given directories",
+    )
+    ap.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=min(32, os.cpu_count() or 1),
+        help="Number of komodoenvs to update concurrently",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Threads used to generate the shims of each komodoenv",
+    )
+    ap.add_argument(
+        "--max-depth",
+        type=int,
+        default=2,
+        help="How many directory levels below each directory to search",
+    )
+    ap.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Only report which komodoenvs would be updated",
+    )
+    ap.add_argument("directories", type=Path, nargs="+", help="Where to search")
+    return ap.parse_args(args)
+
+
+def main(args: list[str]) -> None:
+    args = parse_args(args)
+    results = update_all(
+        args.directories,
+        workers=args.workers,
+        jobs=args.jobs,
+        max_depth=args.max_depth,
+        dry_run=args.dry_run,
+    )
+    report(results, dry_run=args.dry_run)
+    if results["failed"]:
+        sys.exit(1)
@@ -15,6 +15,12 @@ def rhel_version():
     return "7" if ".el7" in platform.release() else "8"
 
 
+@pytest.fixture(autouse=True)
+def _cache_home(tmp_path_factory, monkeypatch):
+    """Don't let tests read or write the user's komodoenv cache"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path_factory.mktemp("cache")))
+
+
 @pytest.fixture(scope="session")
 def python311_path():
     """Locate Python 3.11 executable"""
@@ -0,0 +1,55 @@
+import os
+
+from komodoenv.cache import Cache, cache_dir
+
+
+def test_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert cache_dir() == tmp_path / "komodoenv"
+
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert cache_dir() == tmp_path / ".cache" / "komodoenv"
+
+
+def test_get_put():
+    cache = Cache("test")
+    assert cache.get("key") is None
+
+    cache.put("key", {"a": [1, 2, 3]})
+    assert cache.get("key") == {"a": [1, 2, 3]}
+    assert Cache("test").get("key") == {"a": [1, 2, 3]}
+    assert Cache("other").get("key") is None
+
+
+def test_corrupt_entry():
+    cache = Cache("test")
+    cache.put("key", 1)
+    (path,) = cache.path.glob("*.json")
+    path.write_text("{not json")
+    assert cache.get("key") is None
+
+
+def test_evict_least_recently_used():
+    cache = Cache("test", max_entries=3)
+    for i in range(3):
+        cache.put(str(i), i)
+        os.utime(cache.entry_path(str(i)), ns=(i, i))
+
+    # Reading makes the entry the most recently used one
+    assert cache.get("0") == 0
+
+    cache.put("new", 3)
+    assert len(list(cache.path.glob("*.json"))) == 3
+    assert cache.get("0") == 0
+    assert cache.get("1") is None
+    assert cache.get("2") == 2
+    assert cache.get("new") == 3
+
+
+def test_unwritable(tmp_path, monkeypatch):
+    (tmp_path / "file").write_text("")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "file"))
+    cache = Cache("test")
+    cache.put("key", 1)
+    assert cache.get("key") is None
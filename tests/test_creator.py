@@ -0,0 +1,36 @@
+import pytest
+
+from komodoenv import creator
+
+
+def test_clone_file(tmp_path):
+    (tmp_path / "src").write_text("hello")
+    (tmp_path / "src").chmod(0o755)
+
+    strategy = creator.clone_file(tmp_path / "src", tmp_path / "dst")
+    assert strategy in {"reflink", "hardlink"}
+    assert (tmp_path / "dst").read_text() == "hello"
+    assert (tmp_path / "dst").stat().st_mode & 0o777 == 0o755
+
+
+@pytest.mark.parametrize("fail", ["ioctl", "link"])
+def test_clone_file_fallback(tmp_path, monkeypatch, fail):
+    def raise_oserror(*_):
+        raise OSError
+
+    monkeypatch.setattr("komodoenv.creator.fcntl.ioctl", raise_oserror)
+    if fail == "link":
+        monkeypatch.setattr("komodoenv.creator.os.link", raise_oserror)
+    (tmp_path / "src").write_text("hello")
+
+    strategy = creator.clone_file(tmp_path / "src", tmp_path / "dst")
+    assert strategy == ("hardlink" if fail == "ioctl" else "copy")
+    assert (tmp_path / "dst").read_text() == "hello"
+
+
+def test_clone_file_other_filesystem(tmp_path, monkeypatch):
+    monkeypatch.setattr("komodoenv.creator.same_filesystem", lambda *_: False)
+    (tmp_path / "src").write_text("hello")
+
+    assert creator.clone_file(tmp_path / "src", tmp_path / "dst") == "copy"
+    assert (tmp_path / "dst").stat().st_ino != (tmp_path / "src").stat().st_ino
@@ -0,0 +1,105 @@
+import csv
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from komodoenv.installer import InvalidWheelError, console_scripts, install_wheel
+
+ENTRY_POINTS = """\
+[console_scripts]
+hello = hello.cli:main
+hello-sub = hello.cli:App.run
+
+[gui_scripts]
+hello-gui = hello.gui:main
+"""
+
+
+def make_wheel(path: Path, files: dict[str, str]) -> Path:
+    wheel = path / "hello-1.0-py3-none-any.whl"
+    with zipfile.ZipFile(wheel, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return wheel
+
+
+@pytest.fixture
+def wheel(tmp_path):
+    return make_wheel(
+        tmp_path,
+        {
+            "hello/__init__.py": "",
+            "hello/cli.py": "def main():\n    print('hello')\n",
+            "hello-1.0.data/scripts/hello.sh": "#!python\nprint('script')\n",
+            "hello-1.0.data/data/share/hello.txt": "data",
+            "hello-1.0.dist-info/METADATA": "Name: hello\nVersion: 1.0\n",
+            "hello-1.0.dist-info/WHEEL": "Wheel-Version: 1.0\nRoot-Is-Purelib: true\n",
+            "hello-1.0.dist-info/entry_points.txt": ENTRY_POINTS,
+            "hello-1.0.dist-info/RECORD": "",
+        },
+    )
+
+
+def test_install_wheel(tmp_path, wheel):
+    prefix = tmp_path / "root"
+    site_packages = prefix / "lib/python3.11/site-packages"
+    python = prefix / "bin/python"
+
+    installed = install_wheel(
+        wheel,
+        site_packages=site_packages,
+        prefix=prefix,
+        python=python,
+        version_info=(3, 11),
+    )
+
+    assert (site_packages / "hello/cli.py").is_file()
+    assert (prefix / "share/hello.txt").read_text() == "data"
+    assert (prefix / "bin/hello.sh").read_text() == f"#!{python}\nprint('script')\n"
+
+    script = (prefix / "bin/hello").read_text()
+    assert script.startswith(f"#!{python}\n")
+    assert "from hello.cli import main\n" in script
+    assert "sys.exit(main())" in script
+    assert "sys.exit(App.run())" in (prefix / "bin/hello-sub").read_text()
+    assert (prefix / "bin/hello").stat().st_mode & 0o777 == 0o755
+    assert not (prefix / "bin/hello-gui").exists()
+
+    dist_info = site_packages / "hello-1.0.dist-info"
+    assert (dist_info / "INSTALLER").read_text() == "komodoenv\n"
+    with open(dist_info / "RECORD", encoding="utf-8") as f:
+        record = {row[0]: row[1:] for row in csv.reader(f)}
+    assert record["hello-1.0.dist-info/RECORD"] == ["", ""]
+    assert record["../../../bin/hello"][0].startswith("sha256=")
+    assert "hello-1.0.dist-info/INSTALLER" in record
+    assert len(record) == len(installed)
+    assert all(path.exists() for path in installed)
+
+
+def test_install_wheel_outside_target(tmp_path):
+    wheel = make_wheel(
+        tmp_path,
+        {
+            "hello-1.0.dist-info/METADATA": "",
+            "../evil.py": "",
+        },
+    )
+    with pytest.raises(InvalidWheelError):
+        install_wheel(
+            wheel,
+            site_packages=tmp_path / "site-packages",
+            prefix=tmp_path,
+            python=tmp_path / "python",
+            version_info=(3, 11),
+        )
+    assert not (tmp_path / "evil.py").exists()
+
+
+def test_console_scripts_pip():
+    scripts = console_scripts(
+        "[console_scripts]\npip=pip._internal.cli.main:main\n",
+        "pip",
+        (3, 11, 7),
+    )
+    assert sorted(scripts) == ["pip", "pip3.11"]
@@ -1,3 +1,6 @@
+import json
+import os
+import stat
 import sys
 from subprocess import PIPE, STDOUT, Popen, check_output
 
@@ -41,11 +44,228 @@ def test_init_bash(komodo_root, tmp_path):
 
     [[ $(which python) == "{kmd}/root/bin/python" ]]
     [[ $(python -c "import numpy;print(numpy.__version__)") == "1.25.2" ]]
+    [[ $(which pip) == "{kmd}/root/bin/pip" ]]
+    pip --version
     """.format(kmd=tmp_path / "kenv")
 
     assert bash(script) == 0
 
 
+def test_init_link(komodo_root, tmp_path):
+    main(
+        "--root",
+        str(komodo_root),
+        "--release",
+        "2030.01.00-py311",
+        "--link",
+        str(tmp_path / "kenv"),
+    )
+    assert not (tmp_path / "kenv/root/bin/python").is_symlink()
+
+    script = """\
+    source {kmd}/enable
+
+    [[ $(which python) == "{kmd}/root/bin/python" ]]
+    [[ $(python -c "import numpy;print(numpy.__version__)") == "1.25.2" ]]
+    """.format(kmd=tmp_path / "kenv")
+
+    assert bash(script) == 0
+
+
+def test_init_timings(komodo_root, tmp_path):
+    timings = tmp_path / "timings.jsonl"
+    main(
+        "--root",
+        str(komodo_root),
+        "--release",
+        "2030.01.00-py311",
+        "--timings",
+        str(timings),
+        str(tmp_path / "kenv"),
+    )
+
+    records = [json.loads(line) for line in timings.read_text().splitlines()]
+    phases = {(r["command"], r["phase"]) for r in records}
+    assert {
+        ("create", "venv"),
+        ("create", "update"),
+        ("create", "pip"),
+        ("create", "total"),
+        ("update", "shims"),
+        ("update", "enable"),
+    } <= phases
+    # The steps of creating a komodoenv overlap, so only their wall time is
+    # recorded, and their I/O together
+    venv = next(r for r in records if r["phase"] == "venv")
+    assert venv["wall"] > 0
+    assert "subprocesses" not in venv
+    populate = next(r for r in records if r["phase"] == "populate")
+    assert populate["subprocesses"] >= 1
+
+
+def test_init_shared_shims(komodo_root, tmp_path):
+    main(
+        "--root",
+        str(komodo_root),
+        "--release",
+        "2030.01.00-py311",
+        "--shared-shims-dir",
+        str(tmp_path / "store"),
+        str(tmp_path / "kenv"),
+    )
+    assert f"shim-store = {tmp_path / 'store'}\n" in (
+        (tmp_path / "kenv" / "komodoenv.settings").read_text()
+    )
+
+    # The mock releases only contain Python scripts, which aren't shared
+    script = """\
+    source {kmd}/enable
+
+    [[ $(which f2py) == "{kmd}/root/shims/f2py" ]]
+    [[ $(python -c "import numpy;print(numpy.__version__)") == "1.25.2" ]]
+    """.format(kmd=tmp_path / "kenv")
+
+    assert bash(script) == 0
+
+
+def test_init_lazy_shims(komodo_root, tmp_path):
+    main(
+        "--root",
+        str(komodo_root),
+        "--release",
+        "2030.01.00-py311",
+        "--lazy-shims",
+        str(tmp_path / "kenv"),
+    )
+    settings = (tmp_path / "kenv" / "komodoenv.settings").read_text()
+    assert settings == "shim-mode = lazy\n"
+    assert "shim-mode" not in (tmp_path / "kenv" / "komodoenv.conf").read_text()
+    assert (tmp_path / "kenv" / "root" / "shims" / "f2py").is_symlink()
+
+    script = """\
+    source {kmd}/enable
+
+    [[ $(which f2py) == "{kmd}/root/shims/f2py" ]]
+    f2py -v
+    """.format(kmd=tmp_path / "kenv")
+
+    assert bash(script) == 0
+
+
+def test_init_template(komodo_root, tmp_path, capsys):
+    for name in "kenv1", "kenv2":
+        main(
+            "--root",
+            str(komodo_root),
+            "--release",
+            "2030.01.00-py311",
+            "--template-cache-dir",
+            str(tmp_path / "templates"),
+            str(tmp_path / name),
+        )
+    assert capsys.readouterr().out.count("building in") == 1
+    assert len(templates(tmp_path / "templates")) == 1
+
+    # Templates and the komodoenvs created from them can be shared with others
+    umask = os.umask(0)
+    os.umask(umask)
+    (template,) = templates(tmp_path / "templates")
+    assert stat.S_IMODE(template.stat().st_mode) == 0o777 & ~umask
+
+    for name in "kenv1", "kenv2":
+        kenv = tmp_path / name
+        assert stat.S_IMODE(kenv.stat().st_mode) == 0o777 & ~umask
+        assert not list(kenv.glob("komodoenv.template.json"))
+        assert (
+            (kenv / "root/bin/pip")
+            .read_text()
+            .startswith(f"#!{kenv}/root/bin/python\n")
+        )
+        script = f"""\
+        source {kenv}/enable
+
+        [[ $(which python) == "{kenv}/root/bin/python" ]]
+        [[ $(python -c "import sys;print(sys.prefix)") == "{kenv}/root" ]]
+        [[ $(python -c "import numpy;print(numpy.__version__)") == "1.25.2" ]]
+        pip --version
+        """
+        assert bash(script) == 0
+
+    # Template is rebuilt when the release changes
+    release = komodo_root / "2030.01.00-py311"
+    st = release.stat()
+    os.utime(release, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    try:
+        main(
+            "--root",
+            str(komodo_root),
+            "--release",
+            "2030.01.00-py311",
+            "--template-cache-dir",
+            str(tmp_path / "templates"),
+            str(tmp_path / "kenv3"),
+        )
+    finally:
+        os.utime(release, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert capsys.readouterr().out.count("building in") == 1
+    assert len(templates(tmp_path / "templates")) == 1
+
+
+def test_init_template_concurrent(komodo_root, tmp_path):
+    """Concurrent creations build the template once, and neither fails"""
+    procs = [
+        Popen(
+            [
+                sys.executable,
+                "-m",
+                "komodoenv",
+                "--root",
+                str(komodo_root),
+                "--release",
+                "2030.01.00-py311",
+                "--template-cache-dir",
+                str(tmp_path / "templates"),
+                str(tmp_path / name),
+            ],
+            stdout=PIPE,
+            stderr=STDOUT,
+        )
+        for name in ("kenv1", "kenv2")
+    ]
+    outputs = [proc.communicate()[0].decode() for proc in procs]
+
+    assert [proc.returncode for proc in procs] == [0, 0], outputs
+    assert "".join(outputs).count("building in") == 1
+    assert len(templates(tmp_path / "templates")) == 1
+    for name in "kenv1", "kenv2":
+        assert bash(f"source {tmp_path / name}/enable\npip --version") == 0
+
+
+def test_init_template_track_name(komodo_root, tmp_path, monkeypatch):
+    """A bare --track name is relative to the komodo root, not the working
+    directory"""
+    monkeypatch.chdir(tmp_path)
+    main(
+        "--root",
+        str(komodo_root),
+        "--release",
+        "2030.01.00-py311",
+        "--track",
+        "stable-py311",
+        "--template-cache-dir",
+        str(tmp_path / "templates"),
+        str(tmp_path / "kenv"),
+    )
+
+    (template,) = templates(tmp_path / "templates")
+    stamp = json.loads((template / "komodoenv.template.json").read_text())
+    assert stamp["tracked-release"] == os.path.realpath(komodo_root / "stable-py311")
+    assert (
+        "tracked-release = stable-py311\n"
+        in (tmp_path / "kenv" / "komodoenv.conf").read_text()
+    )
+
+
 def test_init_csh(komodo_root, tmp_path):
     main(
         "--root",
@@ -134,6 +354,11 @@ def main(*args):
     _main(args)
 
 
+def templates(template_cache):
+    """The templates in `template_cache`, without their lock files"""
+    return [p for p in template_cache.iterdir() if not p.name.endswith(".lock")]
+
+
 def _run(args, script):
     proc = Popen(args, stdin=PIPE)
     proc.communicate(script.encode("utf-8"))
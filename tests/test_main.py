@@ -1,3 +1,5 @@
+import shutil
+
 import pytest
 
 import komodoenv.__main__ as main
@@ -101,3 +103,94 @@ def test_resolve_no_update(komodo_root, expect, name):
     release, tracked = main.resolve_release(root=komodo_root, name=name, no_update=True)
     assert release == tracked
     assert release == komodo_root / expect
+
+
+def test_resolve_static(komodo_root, monkeypatch):
+    """The mock releases' enable scripts and interpreters are simple enough to
+    be resolved without running anything"""
+
+    def fail(*_args, **_kwargs):
+        raise AssertionError
+
+    monkeypatch.setattr(main, "which_python", fail)
+    monkeypatch.setattr(main.Python, "detect", fail)
+    release, tracked = main.resolve_release(root=komodo_root, name="stable")
+    assert release == komodo_root / "2030.01.00-py311"
+    assert tracked == komodo_root / "stable-py311"
+
+
+def test_resolve_bash_fallback(komodo_root, monkeypatch):
+    monkeypatch.setattr(main, "find_python", lambda _: None)
+    monkeypatch.setattr(main, "python_version", lambda _: None)
+    release, tracked = main.resolve_release(root=komodo_root, name="stable")
+    assert release == komodo_root / "2030.01.00-py311"
+    assert tracked == komodo_root / "stable-py311"
+
+
+def test_resolve_index(komodo_root, capsys):
+    try:
+        main.main(["index", str(komodo_root)])
+        assert "Indexed" in capsys.readouterr().out
+        main.main(["index", "--list", str(komodo_root)])
+        assert "stable-py311" in capsys.readouterr().out
+
+        for expect, track_name, name in generate_test_params_simple(rhel_version()):
+            release, tracked = main.resolve_release(root=komodo_root, name=name)
+            assert release == komodo_root / expect
+            assert tracked == komodo_root / track_name
+    finally:
+        shutil.rmtree(komodo_root / ".komodoenv", ignore_errors=True)
+
+
+def test_subcommand_name_as_destination(komodo_root, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = main.parse_args(
+        ["--root", str(komodo_root), "--release", "2030.01.00-py311", "./index"]
+    )
+    assert args.destination == tmp_path / "index"
+
+
+def test_shared_shims_takes_no_value(komodo_root, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = main.parse_args(
+        [
+            "--root",
+            str(komodo_root),
+            "--release",
+            "2030.01.00-py311",
+            "--shared-shims",
+            "kenv",
+        ]
+    )
+    assert args.destination == tmp_path / "kenv"
+    assert args.shared_shims == str(main.cache_dir() / "shims")
+
+    args = main.parse_args(
+        [
+            "--root",
+            str(komodo_root),
+            "--release",
+            "2030.01.00-py311",
+            "--shared-shims-dir",
+            "store",
+            "kenv",
+        ]
+    )
+    assert args.destination == tmp_path / "kenv"
+    assert args.shared_shims == "store"
+
+
+def test_template_cache_takes_no_value(komodo_root, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = main.parse_args(
+        [
+            "--root",
+            str(komodo_root),
+            "--release",
+            "2030.01.00-py311",
+            "--template-cache",
+            "kenv",
+        ]
+    )
+    assert args.destination == tmp_path / "kenv"
+    assert args.template_cache == str(main.cache_dir() / "templates")
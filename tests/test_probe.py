@@ -0,0 +1,110 @@
+import pytest
+
+from komodoenv import probe
+
+# Abridged from the enable scripts generated by komodo
+KOMODO_ENABLE = """\
+if [[ -z "${{ZSH_VERSION-}}" ]]; then
+    echo "Not zsh"
+fi
+
+disable_komodo () {{
+    if [[ -n "${{_PRE_KOMODO_PATH:-}}" ]]; then
+        export PATH="${{_PRE_KOMODO_PATH}}"
+        unset _PRE_KOMODO_PATH
+    fi
+}}
+
+# unset irrelevant variables
+disable_komodo preserve_disable_komodo
+
+export KOMODO_PREFIX={prefix}
+export _PRE_KOMODO_PATH="${{PATH:-}}"
+export PATH=$KOMODO_PREFIX/bin${{PATH:+:${{PATH}}}}
+export KOMODO_RELEASE=release
+
+local_script="$KOMODO_PREFIX/../local"
+if [[ -f "$local_script" ]]; then
+    source "$local_script"
+fi
+hash -r
+"""
+
+
+@pytest.fixture
+def release(tmp_path):
+    bindir = tmp_path / "release" / "root" / "bin"
+    bindir.mkdir(parents=True)
+    (bindir / "python3.11").write_text("")
+    (bindir / "python3.11").chmod(0o755)
+    (bindir / "python3").symlink_to("python3.11")
+    (bindir / "python").symlink_to("python3")
+    return tmp_path / "release"
+
+
+@pytest.mark.parametrize(
+    "script",
+    [
+        "export PATH={prefix}/bin:$PATH\n",
+        'PATH="{prefix}/bin:/usr/bin:${{PATH}}"\nexport PATH\n',
+        "ROOT={prefix}\nexport PATH=${{ROOT}}/bin:$PATH # comment\n",
+        KOMODO_ENABLE,
+    ],
+)
+def test_find_python(release, script):
+    (release / "enable").write_text(script.format(prefix=release / "root"))
+    assert probe.find_python(release / "enable") == release / "root" / "bin" / "python"
+
+
+def test_find_python_redirect(release, tmp_path):
+    (release / "enable").write_text(KOMODO_ENABLE.format(prefix=release / "root"))
+    redirect = tmp_path / "redirect" / "enable"
+    redirect.parent.mkdir()
+    redirect.write_text(f'CUSTOM_COORDINATE=""\nsource {release}/enable\n')
+
+    assert probe.find_python(redirect) == release / "root" / "bin" / "python"
+
+
+@pytest.mark.parametrize(
+    "script",
+    [
+        "",
+        "export PATH=/nonexistent:$PATH\n",
+        "export PATH=$(dirname $0)/root/bin:$PATH\n",
+        "export PATH=$UNKNOWN_{{0}}:$PATH\n",
+        'if [ "$USER" = x ]; then\n    export PATH={prefix}/bin:$PATH\nfi\n',
+        "PATH={prefix}/bin:$PATH command\n",
+        "true; source {prefix}/../enable.d\n",
+        "if true; then\n    source {prefix}/bin/python3.11\nfi\n",
+        "source relative/enable\n",
+        "export PATH=${{PATH/x/y}}\n",
+        "eval export PATH={prefix}/bin:$PATH\n",
+    ],
+)
+def test_find_python_unsupported(release, script):
+    """These must fall back to running the enable script in bash"""
+    (release / "enable").write_text(script.format(prefix=release / "root"))
+    assert probe.find_python(release / "enable") is None
+
+
+def test_find_python_environment(release, monkeypatch):
+    monkeypatch.setenv("KOMODO_TEST_PREFIX", str(release / "root"))
+    (release / "enable").write_text("export PATH=$KOMODO_TEST_PREFIX/bin:$PATH\n")
+    assert probe.find_python(release / "enable") == release / "root" / "bin" / "python"
+
+
+def test_python_version(release):
+    root = release / "root"
+    assert probe.python_version(root) == (3, 11)
+
+    (root / "bin" / "python").unlink()
+    (root / "bin" / "python").symlink_to("/nonexistent/python3")
+    (root / "pyvenv.cfg").write_text("home = /usr/bin\nversion = 3.12.1\n")
+    assert probe.python_version(root) == (3, 12)
+
+    (root / "pyvenv.cfg").unlink()
+    (root / "lib" / "python3.10").mkdir(parents=True)
+    assert probe.python_version(root) == (3, 10)
+
+    (root / "lib" / "python3.9").mkdir()
+    assert probe.python_version(root) is None
@@ -1,4 +1,5 @@
 import sys
+import sysconfig
 
 from komodoenv.python import Python
 
@@ -18,6 +19,24 @@ def test_detect():
     assert py.komodo_prefix == sys.prefix
     assert str(py.site_packages_path) in sys.path
     assert py.version_info == sys.version_info
+    assert py.prefix == sys.prefix
+    assert py.sysconfig_paths == sysconfig.get_paths()
+    assert py.abi_tag == sysconfig.get_config_var("SOABI")
+
+
+def test_detect_once(monkeypatch):
+    py = Python(sys.executable, sys.prefix)
+    py.detect()
+
+    def call(*_, **__):
+        msg = "Interpreter was started again"
+        raise AssertionError(msg)
+
+    other = Python(sys.executable, sys.prefix)
+    monkeypatch.setattr(other, "call", call)
+    other.detect()
+    assert other.version_info == py.version_info
+    assert other.site_paths == py.site_paths
 
 
 def test_ld_library_path():
@@ -27,3 +46,19 @@ def test_ld_library_path():
     expect = f"{base}/lib64:{base}/lib\n".encode("utf-8")  # noqa: UP012
     actual = py.call(script=b"import os;print(os.environ['LD_LIBRARY_PATH'])")
     assert expect == actual
+
+
+def test_detect_cached(monkeypatch):
+    monkeypatch.setattr("komodoenv.python._detected", {})
+    Python(sys.executable, sys.prefix).detect()
+
+    def call(*_, **__):
+        msg = "Interpreter was started again"
+        raise AssertionError(msg)
+
+    # Forget what this process has detected, leaving only the on-disk cache
+    monkeypatch.setattr("komodoenv.python._detected", {})
+    py = Python(sys.executable, sys.prefix)
+    monkeypatch.setattr(py, "call", call)
+    py.detect()
+    assert py.version_info == sys.version_info
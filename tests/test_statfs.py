@@ -25,3 +25,9 @@ def test_pathlib():
 
 def test_dir_not_exist():
     assert statfs.is_tmpfs("/dev/shm/this/directory/doesnt/exist/yet")
+
+
+def test_same_filesystem(tmp_path):
+    assert statfs.same_filesystem(tmp_path, tmp_path / "doesnt" / "exist")
+    assert statfs.same_filesystem("/dev/shm/a", "/dev/shm/b")
+    assert not statfs.same_filesystem("/dev/shm", "/proc")
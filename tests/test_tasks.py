@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from komodoenv.tasks import TaskGraph, echo
+
+
+def test_independent_steps_overlap():
+    barrier = threading.Barrier(2, timeout=10)
+    order = []
+    tasks = TaskGraph()
+    tasks.add("first", lambda: order.append("first"))
+    tasks.add("a", barrier.wait, after=("first",))
+    tasks.add("b", barrier.wait, after=("first",))
+    tasks.add("last", lambda: order.append("last"), after=("a", "b"))
+    tasks.run()  # Would break the barrier if 'a' and 'b' ran serially
+
+    assert order == ["first", "last"]
+
+
+def test_output_in_order(capsys):
+    slow_started = threading.Event()
+    fast_done = threading.Event()
+
+    def slow():
+        echo("slow started")
+        slow_started.set()
+        assert fast_done.wait(10)
+        echo("slow done")
+
+    def fast():
+        assert slow_started.wait(10)
+        echo("fast")
+        fast_done.set()
+
+    tasks = TaskGraph()
+    tasks.add("slow", slow)
+    tasks.add("fast", fast)
+    tasks.run()
+
+    assert capsys.readouterr().out == "slow started\nslow done\nfast\n"
+
+
+def test_failure(capsys):
+    ran = []
+
+    def fail():
+        echo("failing")
+        msg = "step failed"
+        raise RuntimeError(msg)
+
+    tasks = TaskGraph()
+    tasks.add("fail", fail)
+    tasks.add("dependent", lambda: ran.append("dependent"), after=("fail",))
+    with pytest.raises(RuntimeError, match="step failed"):
+        tasks.run()
+
+    assert ran == []
+    assert capsys.readouterr().out == "failing\n"
+
+
+def test_unknown_dependency():
+    tasks = TaskGraph()
+    tasks.add("a", lambda: None)
+    with pytest.raises(ValueError, match="unknown steps: b"):
+        tasks.add("c", lambda: None, after=("a", "b"))
+    with pytest.raises(ValueError, match="already added"):
+        tasks.add("a", lambda: None)
+
+
+def test_echo_outside_of_steps(capsys):
+    echo("hello")
+    assert capsys.readouterr().out == "hello\n"
@@ -1,5 +1,8 @@
 import importlib
+import json
+import os
 import shutil
+import subprocess
 import sys
 import time
 from importlib.metadata import distribution
@@ -116,6 +119,117 @@ def test_track_symlink(tmp_path):
     )  # This *could* cause false-negatives if for
 
 
+def test_release_resolver(tmp_path):
+    release = tmp_path / "2030.01.00-py311-rhel8-foo"
+    (release / "root").mkdir(parents=True)
+    (tmp_path / "2030.01.00-py311").mkdir()
+    (tmp_path / "2030.01.00-py311" / "enable").write_text(
+        'CUSTOM_COORDINATE="-foo"\n' + "# padding\n" * 10_000,
+    )
+    (tmp_path / "stable-py311").symlink_to("2030.01.00-py311")
+
+    resolver = update.ReleaseResolver("-rhel8")
+    track = resolver.resolve(tmp_path / "stable-py311")
+    assert resolver.tracked_release(track) == release
+    assert resolver.stats["open"] == 1
+    assert resolver.stats["bytes_read"] <= update.ENABLE_PROBE_CHUNK
+
+    # Resolving again doesn't touch the filesystem
+    stats = dict(resolver.stats)
+    assert resolver.tracked_release(resolver.resolve(tmp_path / "stable-py311")) == (
+        release
+    )
+    assert {k: v for k, v in resolver.stats.items() if k != "hits"} == {
+        k: v for k, v in stats.items() if k != "hits"
+    }
+    assert resolver.stats["hits"] > stats["hits"]
+
+
+def test_release_resolver_long_enable(tmp_path):
+    """CUSTOM_COORDINATE is found however far into the enable script it is"""
+    (tmp_path / "2030.01.00-py311").mkdir()
+    (tmp_path / "2030.01.00-py311" / "enable").write_text(
+        "# padding\n" * 100_000 + 'CUSTOM_COORDINATE="-foo"\n',
+    )
+
+    resolver = update.ReleaseResolver("-rhel8")
+    assert resolver.custom_coordinate(tmp_path / "2030.01.00-py311") == "-foo"
+
+
+def test_index_releases(tmp_path, monkeypatch):
+    root = tmp_path / "komodo"
+    release = root / "2030.01.00-py311-rhel8-foo"
+    (release / "root").mkdir(parents=True)
+    (root / "2030.01.00-py311").mkdir()
+    (root / "2030.01.00-py311" / "enable").write_text('CUSTOM_COORDINATE="-foo"\n')
+    (root / "stable-py311").symlink_to("2030.01.00-py311")
+    (root / "dangling").symlink_to("nonexistent")
+
+    index = update.index_releases(root, jobs=2)
+    assert update.read_release_index(root) == index
+    assert sorted(index["releases"]) == [
+        "2030.01.00-py311",
+        "2030.01.00-py311-rhel8-foo",
+        "stable-py311",
+    ]
+    assert index["releases"]["2030.01.00-py311-rhel8-foo"] == {
+        "target": str(release),
+        "mtime": release.stat().st_mtime_ns,
+        "has-root": True,
+        "custom-coordinate": "-foo",
+        "python": "3.11",
+        "rhel-suffix": "-rhel8",
+    }
+
+    # Resolving a release only reads the index
+    resolver = update.ReleaseResolver("-rhel8")
+    assert resolver.tracked_release(resolver.resolve(root / "stable-py311")) == release
+    assert resolver.stats["indices"] == 1
+    assert resolver.stats["resolve"] == resolver.stats["is_dir"] == 0
+    assert resolver.stats["open"] == 0
+
+    # A release found when the tracked release wasn't doesn't look for an
+    # index relative to the working directory
+    monkeypatch.chdir(root)
+    resolver = update.ReleaseResolver("-rhel8")
+    assert not resolver.is_dir(Path() / "root")
+    assert resolver.stats["indices"] == 0
+
+    # A release that gets its root/ after indexing is found
+    (root / "2030.01.00-py311-rhel8").mkdir()
+    index = update.index_releases(root)
+    assert not index["releases"]["2030.01.00-py311-rhel8"]["has-root"]
+    (root / "2030.01.00-py311-rhel8" / "root").mkdir()
+    assert update.read_release_index(root) == index
+    resolver = update.ReleaseResolver("-rhel8")
+    assert resolver.is_dir(root / "2030.01.00-py311-rhel8" / "root")
+
+    # Adding a release makes the index out of date
+    (root / "2030.02.00-py311-rhel8").mkdir()
+    assert update.read_release_index(root) is None
+    resolver = update.ReleaseResolver("-rhel8")
+    assert resolver.tracked_release(resolver.resolve(root / "stable-py311")) == release
+    assert resolver.stats["indices"] == 0
+
+
+@pytest.mark.parametrize(
+    ("name", "enable", "expected"),
+    [
+        ("2030.01.00-py311", 'export CUSTOM_COORDINATE="-bar"\n', "-bar"),
+        ("2030.01.00-py311", "CUSTOM_COORDINATE=bar", "-bar"),
+        ("2030.01.00-py311", "export PATH=/bin\n", ""),
+        ("2030.01.00-py311-baz", "export PATH=/bin\n", "-baz"),
+        ("2030.01.00-py311-baz", None, "-baz"),
+    ],
+)
+def test_find_custom_coordinate(tmp_path, name, enable, expected):
+    release = tmp_path / name
+    release.mkdir()
+    if enable is not None:
+        (release / "enable").write_text(enable)
+    assert update.find_custom_coordinate(release) == expected
+
+
 def test_should_update_trivial(tmp_path):
     (tmp_path / "bleeding" / "root").mkdir(parents=True)
 
@@ -204,6 +318,35 @@ def test_get_pkg_version(srcpath, package, validation):
     assert validation(ver)
 
 
+def test_dist_info_index(tmp_path, monkeypatch):
+    prefix = tmp_path / "kenv"
+    (prefix / "root" / "bin").mkdir(parents=True)
+    (prefix / "komodoenv.conf").write_text("")
+    monkeypatch.setattr(update, "__file__", str(prefix / "root/bin/komodoenv-update"))
+    monkeypatch.setattr(update, "_pkg_indices", {})
+
+    pkgdir = tmp_path / "site-packages"
+    pkgdir.mkdir()
+    (pkgdir / "notebook-6.4.0.dist-info").mkdir()
+    (pkgdir / "notebook-6.5.0.dist-info").mkdir()
+    (pkgdir / "notebook").mkdir()
+    (pkgdir / "komodoenv-1.0.0.dist-info").mkdir()
+
+    index = update.dist_info_index(pkgdir)
+    assert index == {"notebook": "6.5.0", "komodoenv": "1.0.0"}
+    assert (prefix / update.PKG_INDEX).is_file()
+
+    # A fresh process uses the persisted index without scanning pkgdir
+    monkeypatch.setattr(update, "_pkg_indices", {})
+    with patch("os.scandir", side_effect=AssertionError("scanned")):
+        assert update.dist_info_index(pkgdir) == index
+
+    # Installing a package changes the mtime and invalidates the index
+    (pkgdir / "pip-24.0.dist-info").mkdir()
+    os.utime(pkgdir, ns=(0, pkgdir.stat().st_mtime_ns + 10**9))
+    assert update.dist_info_index(pkgdir)["pip"] == "24.0"
+
+
 def test_read_config_with_valid_file():
     with patch(
         "komodoenv.update.open", new_callable=mock_open, read_data=CONFIG_CONTENT
@@ -216,6 +359,153 @@ def test_read_config_with_valid_file():
         assert config["komodo-root"] == "/prog/res/komodo"
 
 
+def test_write_config(tmp_path):
+    update.write_config({"key1": "value1"}, tmp_path)
+    assert update.read_config(tmp_path)["key1"] == "value1"
+
+    update.write_config({"key1": "value2", "key2": "value3"}, tmp_path)
+    config = update.read_config(tmp_path)
+    assert config["key1"] == "value2"
+    assert config["key2"] == "value3"
+    assert [p.name for p in tmp_path.iterdir()] == ["komodoenv.conf"]
+
+    # Callers may modify the returned config without affecting the cache
+    config["key1"] = "modified"
+    assert update.read_config(tmp_path)["key1"] == "value2"
+
+
+def test_read_config_settings(tmp_path):
+    update.write_config({"key1": "value1", "auto-update": "true"}, tmp_path)
+    (tmp_path / update.SETTINGS_FILE).write_text("auto-update = false\n")
+
+    config = update.read_config(tmp_path)
+    assert config["key1"] == "value1"
+    assert config["auto-update"] == "false"
+
+
+def test_update_lock(tmp_path):
+    with update.update_lock(tmp_path) as locked:
+        assert locked
+        with update.update_lock(tmp_path, blocking=False) as other:
+            assert not other
+    with update.update_lock(tmp_path, blocking=False) as locked:
+        assert locked
+
+
+def test_update_lock_readonly(tmp_path):
+    with update.update_lock(tmp_path / "nonexistent") as locked:
+        assert locked
+
+
+def test_concurrent_updates(tmp_path):
+    """Concurrent komodoenv-update processes only update once"""
+    release = tmp_path / "komodo" / "2030.01.00-py311"
+    (release / "root" / "bin").mkdir(parents=True)
+    (release / "root" / "bin" / "tool").write_bytes(b"\x7fELF\x00")
+    (tmp_path / "komodo" / "stable").symlink_to(release.name)
+
+    kenv = tmp_path / "kenv"
+    (kenv / "root" / "bin").mkdir(parents=True)
+    (kenv / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    shutil.copy(update.__file__, kenv / "root" / "bin" / "komodoenv-update")
+    update.write_config(
+        {
+            "current-release": "old",
+            "tracked-release": "stable",
+            "mtime-release": "0",
+            "python-version": "3.11",
+            "komodo-root": str(tmp_path / "komodo"),
+            "linux-dist": update.distro_id() + update.distro_versions()[0],
+        },
+        kenv,
+    )
+
+    # Let all processes queue up behind the lock before any of them can update
+    timings = tmp_path / "timings.jsonl"
+    with update.update_lock(kenv):
+        procs = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    str(kenv / "root" / "bin" / "komodoenv-update"),
+                    "--timings",
+                    str(timings),
+                ],
+            )
+            for _ in range(4)
+        ]
+        time.sleep(0.5)
+    assert [proc.wait() for proc in procs] == [0] * 4
+
+    phases = [json.loads(line)["phase"] for line in timings.read_text().splitlines()]
+    assert phases.count("shims") == 1
+    assert update.read_config(kenv)["current-release"] == release.name
+    assert (kenv / "root" / "shims" / "tool").is_file()
+
+
+def test_background_update(tmp_path):
+    """With auto-update, --check starts the update and returns right away"""
+    release = tmp_path / "komodo" / "2030.01.00-py311"
+    (release / "root" / "bin").mkdir(parents=True)
+    (release / "root" / "bin" / "tool").write_bytes(b"\x7fELF\x00")
+    pkgdir = release / "root" / "lib" / "python3.11" / "site-packages"
+    (pkgdir / "komodoenv-1.2.0.dist-info").mkdir(parents=True)
+    (tmp_path / "komodo" / "stable").symlink_to(release.name)
+
+    kenv = tmp_path / "kenv"
+    (kenv / "root" / "bin").mkdir(parents=True)
+    (kenv / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    script = kenv / "root" / "bin" / "komodoenv-update"
+    shutil.copy(update.__file__, script)
+    config = {
+        "current-release": "old",
+        "tracked-release": "stable",
+        "mtime-release": "0",
+        "python-version": "3.11",
+        "komodoenv-version": "1.0.0",
+        "komodo-root": str(tmp_path / "komodo"),
+        "linux-dist": update.distro_id() + update.distro_versions()[0],
+    }
+    update.write_config(config, kenv)
+
+    def check():
+        return subprocess.run(
+            [sys.executable, str(script), "--check"],
+            check=True,
+            stderr=subprocess.PIPE,
+            text=True,
+        ).stderr
+
+    # Not enabled
+    assert "run the following command" in check()
+    assert not (kenv / update.UPDATE_LOG).exists()
+
+    # A recent background update that didn't finish isn't retried
+    update.write_config({**config, "auto-update": "true"}, kenv)
+    (kenv / update.UPDATE_LOG).write_text("Traceback\n")
+    assert "run the following command" in check()
+
+    (kenv / update.UPDATE_LOG).unlink()
+    assert "in the background" in check()
+    deadline = time.monotonic() + 30
+    while (kenv / update.UPDATE_LOG).exists() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    assert not (kenv / update.UPDATE_LOG).exists()
+    assert update.read_config(kenv)["current-release"] == release.name
+    assert (kenv / "root" / "shims" / "tool").is_file()
+    assert check() == ""
+
+
+@pytest.fixture
+def restore_update():
+    """Reload komodoenv.update with distro once the test has reloaded it
+    without, so that later tests see the distro a fresh process would"""
+    yield
+    importlib.reload(update)
+
+
+@pytest.mark.usefixtures("restore_update")
 @pytest.mark.parametrize(
     "input_rhel_version, expected_rhel_version",
     [
@@ -245,6 +535,7 @@ def test_rhel_version_suffix_with_distro_not_installed(
         assert update.rhel_version_suffix() == expected_rhel_version
 
 
+@pytest.mark.usefixtures("restore_update")
 def test_rhel_version_suffix_with_distro_not_installed_incompatible(capsys):
     with (
         patch.dict("sys.modules", {"distro": None}),
@@ -259,6 +550,7 @@ def test_rhel_version_suffix_with_distro_not_installed_incompatible(capsys):
         )
 
 
+@pytest.mark.usefixtures("restore_update")
 @pytest.mark.parametrize(
     "original_rhel_version, current_rhel_version, warning_text, result",
     [
@@ -322,3 +614,632 @@ def test_can_update(monkeypatch, old_version, new_version, result):
     }
 
     assert update.can_update(config) == result
+
+
+def test_stamp(tmp_path):
+    (tmp_path / "a" / "root").mkdir(parents=True)
+    (tmp_path / "b" / "root").mkdir(parents=True)
+    (tmp_path / "stable").symlink_to("a")
+    config = {
+        "komodo-root": str(tmp_path),
+        "tracked-release": "stable",
+        "current-release": "a",
+    }
+    stamp_path = tmp_path / update.STAMP_FILE
+
+    assert not update.stamp_is_fresh(config, stamp_path)
+    update.write_stamp(config, stamp_path)
+    assert update.stamp_is_fresh(config, stamp_path)
+
+    (tmp_path / "stable").unlink()
+    (tmp_path / "stable").symlink_to("b")
+    assert not update.stamp_is_fresh(config, stamp_path)
+
+
+def test_stamp_missing_release(tmp_path):
+    config = {"komodo-root": str(tmp_path), "tracked-release": "stable"}
+    stamp_path = tmp_path / update.STAMP_FILE
+
+    update.write_stamp(config, stamp_path)
+    assert not update.stamp_is_fresh(config, stamp_path)
+
+
+def test_check_fast_path(monkeypatch):
+    def fail(*_):
+        msg = "Fast path should not do any work"
+        raise AssertionError(msg)
+
+    monkeypatch.setattr("komodoenv.update.read_config", dict)
+    monkeypatch.setattr("komodoenv.update.check_same_distro", lambda _: True)
+    monkeypatch.setattr("komodoenv.update.stamp_is_fresh", lambda *_: True)
+    monkeypatch.setattr("komodoenv.update.copy_config_dirs", fail)
+    monkeypatch.setattr("komodoenv.update.current_track", fail)
+
+    update.main(["--check"])
+
+
+def test_enable_shell_check(tmp_path):
+    komodo_root = tmp_path / "komodo"
+    (komodo_root / "a" / "root").mkdir(parents=True)
+    (komodo_root / "b" / "root").mkdir(parents=True)
+    (komodo_root / "stable").symlink_to("a")
+    config = {
+        "komodo-root": str(komodo_root),
+        "tracked-release": "stable",
+        "current-release": "a",
+    }
+
+    # Fake komodoenv-update which lets us know that it has been run
+    kenv = tmp_path / "kenv"
+    marker = tmp_path / "marker"
+    (kenv / "root" / "bin").mkdir(parents=True)
+    (kenv / "root" / "bin" / "komodoenv-update").write_text(
+        f"#!/bin/sh\ntouch {marker}\n"
+    )
+    (kenv / "root" / "bin" / "komodoenv-update").chmod(0o755)
+    generation = update.new_generation(kenv)
+    update.update_enable_script(
+        komodo_root / "a", kenv, generation, komodo_root / "stable"
+    )
+
+    def source_runs_check():
+        marker.unlink(missing_ok=True)
+        subprocess.run(["/bin/bash", "-c", f"source {generation}/enable"], check=True)
+        return marker.exists()
+
+    # No stamp yet
+    assert source_runs_check()
+
+    update.write_stamp(config, kenv / update.STAMP_FILE)
+    assert not source_runs_check()
+
+    (komodo_root / "stable").unlink()
+    (komodo_root / "stable").symlink_to("b")
+    assert source_runs_check()
+
+
+def test_enable_without_tracked_release(tmp_path):
+    script = update.enable_script(update.ENABLE_BASH, Path("/komodo/a"), tmp_path)
+    assert script.endswith(f"\n{tmp_path}/root/bin/komodoenv-update --check\n")
+
+
+def _make_bins(srcpath, dstpath):
+    (srcpath / "root" / "bin").mkdir(parents=True)
+    (dstpath / "root" / "bin").mkdir(parents=True)
+    (dstpath / "root" / "bin" / "python").write_text("")
+    (srcpath / "root" / "bin" / "python").write_text("")
+    (srcpath / "root" / "bin" / "script").write_text("#!/usr/bin/python\nprint(1)\n")
+    (srcpath / "root" / "bin" / "binary").write_bytes(b"\x7fELF\x00")
+    return update.new_generation(dstpath)
+
+
+def test_update_bins(tmp_path):
+    srcpath = tmp_path / "komodo"
+    dstpath = tmp_path / "kenv"
+    generation = _make_bins(srcpath, dstpath)
+
+    update.update_bins(srcpath, dstpath, generation)
+
+    shimdir = generation / "root" / "shims"
+    assert sorted(p.name for p in shimdir.iterdir()) == ["binary", "script"]
+    assert (shimdir / "script").read_text() == (
+        f"#!{dstpath}/root/bin/python\nprint(1)\n"
+    )
+    assert (
+        f'exec -a "$0" "{srcpath}/root/bin/binary"' in (shimdir / "binary").read_text()
+    )
+    assert (shimdir / "binary").stat().st_mode & 0o777 == 0o755
+
+
+def test_update_bins_incremental(tmp_path):
+    srcpath = tmp_path / "komodo"
+    dstpath = tmp_path / "kenv"
+    generation = _make_bins(srcpath, dstpath)
+    shimdir = generation / "root" / "shims"
+    update.update_bins(srcpath, dstpath, generation)
+    script_ino = (shimdir / "script").stat().st_ino
+
+    # Change one, remove one, add one
+    (srcpath / "root" / "bin" / "script").write_text("#!/usr/bin/python\nprint(2)\n")
+    (srcpath / "root" / "bin" / "binary").unlink()
+    (srcpath / "root" / "bin" / "other").write_bytes(b"\x7fELF\x00")
+    update.update_bins(srcpath, dstpath, generation)
+
+    assert sorted(p.name for p in shimdir.iterdir()) == ["other", "script"]
+    assert (shimdir / "script").stat().st_ino != script_ino
+    assert "print(2)" in (shimdir / "script").read_text()
+
+    # Nothing changed, so nothing is rewritten
+    other_ino = (shimdir / "other").stat().st_ino
+    script_ino = (shimdir / "script").stat().st_ino
+    update.update_bins(srcpath, dstpath, generation)
+    assert (shimdir / "other").stat().st_ino == other_ino
+    assert (shimdir / "script").stat().st_ino == script_ino
+
+    # Full regeneration rewrites shims whose contents differ
+    (shimdir / "other").write_text("garbage")
+    update.update_bins(srcpath, dstpath, generation, incremental=False)
+    assert "exec -a" in (shimdir / "other").read_text()
+
+
+def test_update_bins_shared(tmp_path):
+    srcpath = tmp_path / "komodo"
+    store = tmp_path / "store"
+    kenvs = [tmp_path / "kenv1", tmp_path / "kenv2"]
+    generations = [
+        _make_bins(srcpath, kenvs[0]),
+        _make_bins(tmp_path / "unused", kenvs[1]),
+    ]
+
+    shared = [
+        update.update_bins(srcpath, kenv, generation, shim_store=store)
+        for kenv, generation in zip(kenvs, generations, strict=True)
+    ]
+
+    assert shared[0] == shared[1]
+    assert shared[0].parent == store
+    assert sorted(p.name for p in shared[0].iterdir()) == ["binary"]
+    for kenv, generation in zip(kenvs, generations, strict=True):
+        shimdir = generation / "root" / "shims"
+        assert sorted(p.name for p in shimdir.iterdir()) == ["script"]
+        assert (shimdir / "script").read_text() == (
+            f"#!{kenv}/root/bin/python\nprint(1)\n"
+        )
+
+    # Unchanged release, unchanged shared directory
+    assert (
+        update.update_bins(srcpath, kenvs[0], generations[0], shim_store=store)
+        == shared[0]
+    )
+
+    # Shared directories are never modified, a changed release gets a new one
+    (srcpath / "root" / "bin" / "other").write_bytes(b"\x7fELF\x00")
+    new_shared = update.update_bins(srcpath, kenvs[0], generations[0], shim_store=store)
+    assert new_shared != shared[0]
+    assert sorted(p.name for p in new_shared.iterdir()) == ["binary", "other"]
+    assert sorted(p.name for p in shared[0].iterdir()) == ["binary"]
+
+    # Going back to per-komodoenv shims
+    assert update.update_bins(srcpath, kenvs[0], generations[0]) is None
+    assert sorted(p.name for p in (generations[0] / "root" / "shims").iterdir()) == [
+        "binary",
+        "other",
+        "script",
+    ]
+
+
+def test_update_lazy_bins(tmp_path):
+    srcpath = tmp_path / "komodo"
+    dstpath = tmp_path / "kenv"
+    generation = _make_bins(srcpath, dstpath)
+    shimdir = generation / "root" / "shims"
+    update.update_bins(srcpath, dstpath, generation)
+
+    # Switching from shims to symlinks
+    update.update_lazy_bins(srcpath, dstpath, generation)
+    assert sorted(p.name for p in shimdir.iterdir()) == [
+        update.DISPATCHER,
+        "binary",
+        "script",
+    ]
+    for name in "binary", "script":
+        assert str((shimdir / name).readlink()) == update.DISPATCHER
+    table = (generation / update.SHIMS_TABLE).read_text()
+    assert f"root={srcpath}/root\n" in table
+    assert "python='|script|'\n" in table
+    assert "libexec='|'\n" in table
+
+    # Updates only touch the table and the symlinks of added executables
+    script_ino = (shimdir / "script").lstat().st_ino
+    (srcpath / "root" / "bin" / "binary").unlink()
+    (srcpath / "root" / "bin" / "other").write_text("#!/usr/bin/env python3\n")
+    update.update_lazy_bins(srcpath, dstpath, generation)
+    assert sorted(p.name for p in shimdir.iterdir()) == [
+        update.DISPATCHER,
+        "other",
+        "script",
+    ]
+    assert (shimdir / "script").lstat().st_ino == script_ino
+    table = (generation / update.SHIMS_TABLE).read_text()
+    assert "python='|other|script|'\n" in table
+
+    # And back to shims
+    update.update_bins(srcpath, dstpath, generation)
+    assert sorted(p.name for p in shimdir.iterdir()) == ["other", "script"]
+    assert not (shimdir / "script").is_symlink()
+    assert (shimdir / "script").read_text() == (
+        f"#!{dstpath}/root/bin/python\nprint(1)\n"
+    )
+
+
+def test_lazy_shims_exec(tmp_path):
+    srcpath = tmp_path / "komodo"
+    dstpath = tmp_path / "kenv"
+    generation = _make_bins(srcpath, dstpath)
+    python = dstpath / "root" / "bin" / "python"
+    python.write_text('#!/bin/sh\necho "python $*"\n')
+    (srcpath / "root" / "bin" / "binary").write_text(
+        '#!/bin/sh\necho "binary $* $LD_LIBRARY_PATH"\n'
+    )
+    (srcpath / "root" / "libexec").mkdir()
+    (srcpath / "root" / "libexec" / "binary").write_text(
+        '#!/bin/sh\necho "libexec $* $LD_LIBRARY_PATH"\n'
+    )
+    for path in python, *(srcpath / "root").glob("*/*"):
+        path.chmod(0o755)
+
+    update.update_lazy_bins(srcpath, dstpath, generation)
+
+    def run(name):
+        shim = generation / "root" / "shims" / name
+        return subprocess.check_output([shim, "a b"], env={}, text=True)
+
+    assert run("script") == f"python {srcpath}/root/bin/script a b\n"
+    assert run("binary") == (f"libexec a b {srcpath}/root/lib:{srcpath}/root/lib64\n")
+
+
+def test_enable_shared_shims(tmp_path):
+    script = update.enable_script(
+        update.ENABLE_BASH,
+        Path("/komodo/a"),
+        tmp_path,
+        shared_shims=Path("/store/abc"),
+    )
+    path = f"{tmp_path}/root/bin:{tmp_path}/root/shims:/store/abc"
+    assert f"\nexport PATH={path}${{PATH:+" in script
+
+
+def test_generate_shim_python(tmp_path):
+    body = "print('hello')\n" * 100
+    (tmp_path / "script").write_text("#!/usr/bin/python3\n" + body)
+
+    shim = update.generate_shim(tmp_path / "script", "/kenv/root/bin/python")
+    assert shim.decode("utf-8") == "#!/kenv/root/bin/python\n" + body
+
+
+def test_generate_shim_binary(tmp_path, monkeypatch):
+    (tmp_path / "binary").write_bytes(b"\x7fELF" + b"\x00" * 1024**2)
+
+    read_sizes = []
+    original = update.rewrite_executable
+
+    def rewrite_executable(path, python, text):
+        read_sizes.append(len(text))
+        return original(path, python, text)
+
+    monkeypatch.setattr("komodoenv.update.rewrite_executable", rewrite_executable)
+    shim = update.generate_shim(tmp_path / "binary", "unused")
+    assert shim.startswith(b"#!/bin/bash\n")
+    assert read_sizes == [update.SHEBANG_MAX]
+
+
+def test_update_bins_parallel(tmp_path):
+    serial = tmp_path / "serial"
+    parallel = tmp_path / "parallel"
+    srcpath = tmp_path / "komodo"
+    serial_gen = _make_bins(srcpath, serial)
+    (parallel / "root" / "bin").mkdir(parents=True)
+    (parallel / "root" / "bin" / "python").write_text("")
+    parallel_gen = update.new_generation(parallel)
+    for i in range(50):
+        (srcpath / "root" / "bin" / f"script{i}").write_text(
+            f"#!/usr/bin/python\nprint({i})\n"
+        )
+
+    update.update_bins(srcpath, serial, serial_gen)
+    update.update_bins(srcpath, parallel, parallel_gen, jobs=8)
+
+    def shims(path, generation):
+        return {
+            p.name: p.read_text().replace(str(path), "")
+            for p in (generation / "root" / "shims").iterdir()
+        }
+
+    assert len(shims(parallel, parallel_gen)) == 52
+    assert shims(serial, serial_gen) == shims(parallel, parallel_gen)
+    assert list(update.read_json(serial_gen / update.SHIMS_MANIFEST)["shims"]) == list(
+        update.read_json(parallel_gen / update.SHIMS_MANIFEST)["shims"]
+    )
+
+
+def _make_site(tmp_path):
+    config = {"python-version": "3.11"}
+    srcpath = tmp_path / "komodo"
+    sitedir = srcpath / "root" / "lib" / "python3.11" / "site-packages"
+    sitedir.mkdir(parents=True)
+    (srcpath / "root" / "extra").mkdir()
+    (sitedir / "nested").mkdir()
+    (sitedir / "b.pth").write_text("nested\n")
+    (sitedir / "a.pth").write_text(
+        "# comment\n\nimport os; os.abort()\n../../../extra\nmissing\nnested\n"
+    )
+    (sitedir / ".hidden.pth").write_text(str(tmp_path))
+
+    dstpath = tmp_path / "kenv"
+    (dstpath / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    (tmp_path / "base" / "lib" / "python3.11").mkdir(parents=True)
+    (dstpath / "root" / "pyvenv.cfg").write_text(f"home = {tmp_path}/base/bin\n")
+    return config, srcpath, dstpath
+
+
+def test_komodo_site_paths(tmp_path):
+    config, srcpath, _ = _make_site(tmp_path)
+    sitedir = srcpath / "root" / "lib" / "python3.11" / "site-packages"
+
+    assert update.komodo_site_paths(config, srcpath) == [
+        str(sitedir),
+        str(srcpath / "root" / "extra"),
+        str(sitedir / "nested"),
+    ]
+
+
+def test_create_pth_sitecustomize(tmp_path, monkeypatch):
+    config, srcpath, dstpath = _make_site(tmp_path)
+    generation = update.new_generation(dstpath)
+    sitedir = generation / "root" / "lib" / "python3.11" / "site-packages"
+
+    update.create_pth(config, srcpath, dstpath, generation)
+
+    assert (sitedir / "zzz_komodo.pth").read_text() == ""
+    monkeypatch.setattr(sys, "path", ["/venv", str(srcpath / "root" / "extra")])
+    exec((sitedir / "sitecustomize.py").read_text(), {})  # noqa: S102
+    komodo_sitedir = srcpath / "root" / "lib" / "python3.11" / "site-packages"
+    assert sys.path == [
+        "/venv",
+        str(srcpath / "root" / "extra"),
+        str(komodo_sitedir),
+        str(komodo_sitedir / "nested"),
+    ]
+
+
+def test_create_pth_fallback(tmp_path):
+    config, srcpath, dstpath = _make_site(tmp_path)
+    sitedir = Path("root", "lib", "python3.11", "site-packages")
+    paths = "".join(p + "\n" for p in update.komodo_site_paths(config, srcpath))
+
+    # The base interpreter's sitecustomize would be imported instead of ours
+    (tmp_path / "base" / "lib" / "python3.11" / "sitecustomize.py").write_text("")
+    generation = update.new_generation(dstpath)
+    update.create_pth(config, srcpath, dstpath, generation)
+    assert (generation / sitedir / "zzz_komodo.pth").read_text() == paths
+    assert not (generation / sitedir / "sitecustomize.py").exists()
+
+    # So would the user's own sitecustomize
+    (tmp_path / "base" / "lib" / "python3.11" / "sitecustomize.py").unlink()
+    (dstpath / sitedir / "sitecustomize.py").write_text("import mine\n")
+    generation = update.new_generation(dstpath)
+    update.create_pth(config, srcpath, dstpath, generation)
+    assert (generation / sitedir / "zzz_komodo.pth").read_text() == paths
+    assert not (generation / sitedir / "sitecustomize.py").exists()
+    assert (dstpath / sitedir / "sitecustomize.py").read_text() == "import mine\n"
+
+
+def test_generations(tmp_path):
+    """Updates switch between generations, and can be rolled back"""
+    komodo_root = tmp_path / "komodo"
+    for name in "2030.01.00-py311", "2030.02.00-py311":
+        (komodo_root / name / "root" / "bin").mkdir(parents=True)
+        (komodo_root / name / "root" / "bin" / "tool").write_bytes(b"\x7fELF")
+        (komodo_root / name / "root" / "bin" / "script").write_text(
+            "#!/usr/bin/env python\nprint('hello')\n"
+        )
+    (komodo_root / "stable").symlink_to("2030.02.00-py311")
+
+    # A komodoenv from before generations
+    kenv = tmp_path / "kenv"
+    sitedir = kenv / "root" / "lib" / "python3.11" / "site-packages"
+    sitedir.mkdir(parents=True)
+    (kenv / "root" / "bin").mkdir()
+    (kenv / "root" / "shims").mkdir()
+    (kenv / "root" / "shims" / "tool").write_text("old shim\n")
+    (kenv / "enable").write_text("old enable\n")
+    (kenv / "enable.csh").write_text("old enable\n")
+    (sitedir / "zzz_komodo.pth").write_text("/old\n")
+    (tmp_path / "base" / "lib" / "python3.11").mkdir(parents=True)
+    (kenv / "root" / "pyvenv.cfg").write_text(f"home = {tmp_path}/base/bin\n")
+    config = {
+        "current-release": "2029.12.00-py311",
+        "tracked-release": "stable",
+        "mtime-release": "0",
+        "python-version": "3.11",
+        "komodo-root": str(komodo_root),
+    }
+    update.write_config(config, kenv)
+    (kenv / update.SETTINGS_FILE).write_text("auto-update = true\n")
+
+    gens = kenv / update.GENERATIONS
+    update.apply_update(
+        update.read_config(kenv), {"current-release": "2030.01.00-py311"}, kenv
+    )
+    for name in update.generation_paths(config):
+        assert (kenv / name).is_symlink()
+        assert not (kenv / name).readlink().is_absolute()  # Relocatable
+    assert (gens / "current").readlink() == Path("gen-1")
+    assert (gens / "previous").readlink() == Path("gen-0")
+    assert (gens / "gen-0" / "root" / "shims" / "tool").read_text() == "old shim\n"
+    assert (gens / "gen-0" / "enable").read_text() == "old enable\n"
+    assert "2030.01.00" in (kenv / "root" / "shims" / "tool").read_text()
+    assert "2030.01.00-py311" in (kenv / "enable").read_text()
+    assert update.is_own_sitecustomize(sitedir / "sitecustomize.py")
+    assert (sitedir / "zzz_komodo.pth").read_text() == ""
+
+    update.apply_update(
+        update.read_config(kenv), {"current-release": "2030.02.00-py311"}, kenv
+    )
+    assert sorted(p.name for p in gens.iterdir()) == [
+        "current",
+        "gen-1",
+        "gen-2",
+        "previous",
+    ]
+    assert update.read_config(kenv)["current-release"] == "2030.02.00-py311"
+    assert "2030.02.00" in (kenv / "root" / "shims" / "tool").read_text()
+    # Settings are left to their own file, which updates don't replace
+    assert "auto-update" not in (kenv / "komodoenv.conf").read_text()
+    (kenv / update.SETTINGS_FILE).unlink()
+    assert "auto-update" not in update.read_config(kenv)
+    # Unchanged shims are shared with the previous generation
+    assert (kenv / "root" / "shims" / "script").samefile(
+        gens / "gen-1" / "root" / "shims" / "script"
+    )
+
+    assert update.rollback(kenv)["current-release"] == "2030.01.00-py311"
+    assert update.read_config(kenv)["current-release"] == "2030.01.00-py311"
+    assert "2030.01.00" in (kenv / "root" / "shims" / "tool").read_text()
+    assert "2030.01.00-py311" in (kenv / "enable").read_text()
+    assert update.stamp_is_fresh(update.read_config(kenv), kenv / update.STAMP_FILE)
+
+    # Rolling back again undoes the rollback
+    script = kenv / "root" / "bin" / "komodoenv-update"
+    shutil.copy(update.__file__, script)
+    proc = subprocess.run(
+        [sys.executable, str(script), "--rollback"],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert proc.stdout == "Rolled back to komodo release 2030.02.00-py311\n"
+    assert "2030.02.00" in (kenv / "root" / "shims" / "tool").read_text()
+
+
+def test_rollback_enable_fresh(tmp_path):
+    """After a rollback, enabling doesn't run komodoenv-update until the tracked
+    release changes again"""
+    komodo_root = tmp_path / "komodo"
+    for name in "2030.01.00-py311", "2030.02.00-py311":
+        (komodo_root / name / "root" / "bin").mkdir(parents=True)
+    (komodo_root / "stable").symlink_to("2030.01.00-py311")
+
+    kenv = tmp_path / "kenv"
+    (kenv / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    (kenv / "root" / "bin").mkdir()
+    (tmp_path / "base" / "lib" / "python3.11").mkdir(parents=True)
+    (kenv / "root" / "pyvenv.cfg").write_text(f"home = {tmp_path}/base/bin\n")
+    marker = tmp_path / "marker"
+    (kenv / "root" / "bin" / "komodoenv-update").write_text(
+        f"#!/bin/sh\ntouch {marker}\n"
+    )
+    (kenv / "root" / "bin" / "komodoenv-update").chmod(0o755)
+    update.write_config(
+        {
+            "current-release": "2030.01.00-py311",
+            "tracked-release": "stable",
+            "mtime-release": "0",
+            "python-version": "3.11",
+            "komodo-root": str(komodo_root),
+        },
+        kenv,
+    )
+
+    update.apply_update(
+        update.read_config(kenv), {"current-release": "2030.01.00-py311"}, kenv
+    )
+    (komodo_root / "stable").unlink()
+    (komodo_root / "stable").symlink_to("2030.02.00-py311")
+    update.apply_update(
+        update.read_config(kenv), {"current-release": "2030.02.00-py311"}, kenv
+    )
+    assert update.rollback(kenv)["current-release"] == "2030.01.00-py311"
+
+    subprocess.run(["/bin/bash", "-c", f"source {kenv}/enable"], check=True)
+    assert not marker.exists()
+
+
+def test_rollback_without_previous(tmp_path):
+    assert update.rollback(tmp_path) is None
+
+    # The files of a new komodoenv from before the first update aren't enough to
+    # roll back to
+    release = tmp_path / "komodo" / "2030.01.00-py311"
+    (release / "root" / "bin").mkdir(parents=True)
+    kenv = tmp_path / "kenv"
+    (kenv / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    (kenv / "root" / "bin").mkdir()
+    config = {
+        "komodo-root": str(tmp_path / "komodo"),
+        "tracked-release": "stable",
+        "python-version": "3.11",
+    }
+    update.write_config(config, kenv)
+    update.apply_update(config, {"current-release": release.name}, kenv)
+    assert update.rollback(kenv) is None
+    assert update.read_config(kenv)["current-release"] == release.name
+
+
+def test_timings(tmp_path):
+    path = tmp_path / "timings.jsonl"
+    timings = update.Timings("update", path)
+    with timings.phase("first"):
+        (tmp_path / "file").write_bytes(b"x" * 1000)
+        (tmp_path / "file").read_bytes()
+        list(tmp_path.iterdir())
+    with pytest.raises(RuntimeError), timings.phase("second"):
+        raise RuntimeError
+
+    first, second = (json.loads(line) for line in path.read_text().splitlines())
+    assert first["command"] == "update"
+    assert first["phase"] == "first"
+    assert first["files_opened"] == 2
+    assert first["dirs_listed"] == 1
+    assert first["subprocesses"] == 0
+    assert first["bytes_written"] >= 1000
+    assert second["phase"] == "second"
+    assert second["started"] == first["started"]
+
+
+def test_timings_disabled(tmp_path):
+    timings = update.Timings("update")
+    with timings.phase("first"):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "args, jobs",
+    [
+        ([], 1),
+        (["--jobs", "4"], 4),
+        (["-j"], os.cpu_count()),
+    ],
+)
+def test_parse_args_jobs(args, jobs):
+    assert update.parse_args(args).jobs == jobs
+
+
+def test_sync_tree(tmp_path):
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    (src / "sub").mkdir(parents=True)
+    (src / "a").write_text("new a")
+    (src / "sub" / "b").write_text("b")
+    (src / "sub" / "b").chmod(0o600)
+    (src / "link").symlink_to("a")
+    dst.mkdir()
+    (dst / "a").write_text("existing a")
+
+    update.sync_tree(src, dst)
+
+    assert (dst / "a").read_text() == "existing a"
+    assert (dst / "sub" / "b").read_text() == "b"
+    assert (dst / "sub" / "b").stat().st_mode & 0o777 == 0o600
+    assert (dst / "link").is_symlink()
+    assert str((dst / "link").readlink()) == "a"
+
+
+def test_copy_config_dirs(tmp_path, monkeypatch):
+    release = tmp_path / "komodo" / "2030.01"
+    (release / "root" / "share" / "rips").mkdir(parents=True)
+    (release / "root" / "share" / "rips" / "config").write_text("rips")
+    (tmp_path / "kenv" / "root").mkdir(parents=True)
+    config = {
+        "komodo-root": str(tmp_path / "komodo"),
+        "current-release": "2030.01",
+        "python-version": "3.11",
+    }
+
+    update.copy_config_dirs(config, tmp_path / "kenv")
+    assert (tmp_path / "kenv/root/share/rips/config").read_text() == "rips"
+
+    # The source tree isn't walked again for the same release
+    monkeypatch.setattr("komodoenv.update.sync_tree", None)
+    update.copy_config_dirs(config, tmp_path / "kenv")
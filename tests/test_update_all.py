@@ -0,0 +1,154 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from komodoenv import update, update_all
+from komodoenv.__main__ import main
+
+
+def make_release(komodo_root, name, komodoenv_version="1.5.0"):
+    root = komodo_root / name / "root"
+    (root / "bin").mkdir(parents=True)
+    (root / "bin" / "tool").write_text("#!/bin/sh\necho tool\n")
+    pkgdir = root / "lib" / "python3.11" / "site-packages"
+    pkgdir.mkdir(parents=True)
+    (pkgdir / f"komodoenv-{komodoenv_version}.dist-info").mkdir()
+
+
+def make_kenv(path, komodo_root, **config):
+    config = {
+        "current-release": "2030.01.00-py311",
+        "tracked-release": "stable-py311",
+        "mtime-release": "0",
+        "python-version": "3.11",
+        "komodoenv-version": "1.0.0",
+        "komodo-root": str(komodo_root),
+        "linux-dist": update.distro_id() + update.distro_versions()[0],
+        **config,
+    }
+    (path / "root" / "bin").mkdir(parents=True)
+    (path / "root" / "lib" / "python3.11" / "site-packages").mkdir(parents=True)
+    update.write_config(config, path)
+    return path
+
+
+@pytest.fixture
+def komodo_root(tmp_path):
+    root = tmp_path / "komodo"
+    make_release(root, "2030.01.00-py311")
+    make_release(root, "2030.02.00-py311")
+    (root / "stable-py311").symlink_to("2030.02.00-py311")
+    return root
+
+
+def test_discover(tmp_path, komodo_root):
+    projects = tmp_path / "projects"
+    make_kenv(projects / "a" / "kenv", komodo_root)
+    make_kenv(projects / "b", komodo_root)
+    make_kenv(projects / ".hidden" / "kenv", komodo_root)
+    make_kenv(projects / "c" / "d" / "e" / "kenv", komodo_root)
+    (projects / "link").symlink_to(projects / "a")
+
+    assert update_all.discover([projects]) == [projects / "a" / "kenv", projects / "b"]
+    assert projects / "c" / "d" / "e" / "kenv" in update_all.discover(
+        [projects], max_depth=4
+    )
+    assert update_all.discover([projects / "b"]) == [projects / "b"]
+
+
+def test_update_all(tmp_path, komodo_root, monkeypatch):
+    projects = tmp_path / "projects"
+    current = update.find_current(
+        {"komodo-root": str(komodo_root), "tracked-release": "stable-py311"},
+    )
+    outdated = [make_kenv(projects / f"old{i}", komodo_root) for i in range(3)]
+    fresh = make_kenv(projects / "fresh", komodo_root, **current)
+    incompatible = make_kenv(projects / "v2", komodo_root, **{"komodoenv-version": "2"})
+    other_distro = make_kenv(projects / "el7", komodo_root, **{"linux-dist": "rhel7"})
+    missing = make_kenv(projects / "gone", komodo_root, **{"tracked-release": "gone"})
+
+    listings = []
+    original_release_bins = update.release_bins
+
+    def release_bins(srcpath, **kwargs):
+        listings.append(srcpath)
+        return original_release_bins(srcpath, **kwargs)
+
+    monkeypatch.setattr(update, "release_bins", release_bins)
+
+    results = update_all.update_all([projects], workers=4)
+
+    assert set(results["updated"]) == set(outdated)
+    assert set(results["up-to-date"]) == {fresh}
+    assert set(results["incompatible"]) == {incompatible}
+    assert set(results["wrong-distro"]) == {other_distro}
+    assert set(results["failed"]) == {missing}
+    assert listings == [komodo_root / "2030.02.00-py311"]
+
+    for kenv in outdated:
+        assert update.read_config(kenv)["current-release"] == "2030.02.00-py311"
+        assert (kenv / "root" / "shims" / "tool").is_file()
+        assert (kenv / "enable").is_file()
+    assert update.read_config(incompatible)["current-release"] == "2030.01.00-py311"
+
+
+def test_update_all_dry_run(tmp_path, komodo_root):
+    kenv = make_kenv(tmp_path / "kenv", komodo_root)
+
+    results = update_all.update_all([tmp_path], dry_run=True)
+
+    assert set(results["updated"]) == {kenv}
+    assert update.read_config(kenv)["current-release"] == "2030.01.00-py311"
+    assert not (kenv / "root" / "shims").exists()
+
+
+def test_main_update_all(tmp_path, komodo_root, capsys):
+    make_kenv(tmp_path / "kenv", komodo_root)
+
+    main(["update-all", str(tmp_path)])
+
+    out = capsys.readouterr().out
+    assert "Checked 1 komodoenvs" in out
+    assert "updated  1" in out
+
+
+def test_update_all_refreshes_update_script(tmp_path, komodo_root):
+    """Komodoenvs from before generations keep working with their own
+    komodoenv-update once update-all has moved them to generations"""
+    kenv = make_kenv(tmp_path / "kenv", komodo_root)
+    (kenv / "root" / "shims").mkdir()
+    (kenv / "root" / "shims" / "tool").write_text("old shim\n")
+    (kenv / "enable").write_text("old enable\n")
+    script = kenv / "root" / "bin" / "komodoenv-update"
+    old_script = "#!/bin/sh\necho 'komodoenv-update of an old komodoenv'\n"
+    script.write_text(old_script)
+    script.chmod(0o755)
+
+    # Komodoenvs that aren't updated keep their komodoenv-update
+    current = update.find_current(
+        {"komodo-root": str(komodo_root), "tracked-release": "stable-py311"},
+    )
+    fresh = make_kenv(tmp_path / "fresh", komodo_root, **current)
+    incompatible = make_kenv(tmp_path / "v2", komodo_root, **{"komodoenv-version": "2"})
+    for other in fresh, incompatible:
+        (other / "root" / "bin" / "komodoenv-update").write_text(old_script)
+
+    results = update_all.update_all([tmp_path])
+
+    assert set(results["updated"]) == {kenv}
+    assert set(results["up-to-date"]) == {fresh}
+    assert set(results["incompatible"]) == {incompatible}
+    for other in fresh, incompatible:
+        assert (other / "root" / "bin" / "komodoenv-update").read_text() == old_script
+    assert (kenv / "komodoenv.conf").is_symlink()
+    assert script.read_bytes() == Path(update.__file__).read_bytes()
+
+    make_release(komodo_root, "2030.03.00-py311")
+    (komodo_root / "stable-py311").unlink()
+    (komodo_root / "stable-py311").symlink_to("2030.03.00-py311")
+    subprocess.run([sys.executable, str(script)], check=True)
+
+    assert update.read_config(kenv)["current-release"] == "2030.03.00-py311"
+    assert "2030.03.00-py311" in (kenv / "root" / "shims" / "tool").read_text()